@@ -6,16 +6,57 @@
 """
 Base classes for scripts and script subcommands
 """
+# pylint: disable=too-many-lines
 import argparse
 import asyncio
-import os
+import json
+import signal
 import sys
+import time
 
-from typing import Any, Dict, Callable, List, Optional, TYPE_CHECKING
+from contextlib import ExitStack, nullcontext
+from typing import (
+    Any,
+    AsyncIterator,
+    ContextManager,
+    Dict,
+    Callable,
+    Coroutine,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 from sys_toolkit.base import LoggingBaseClass
 
-from .exceptions import ScriptError
+from .concurrency import AdaptiveConcurrencyController
+from .exceptions import ScriptError, TaskError
+from .loopmonitor import EventLoopMonitor, SlowCallback
+from .metrics import MetricsRegistry
+from .output import (
+    DEFAULT_TASK_OUTPUT_QUEUE_SIZE,
+    DEFAULT_TASK_OUTPUT_SPOOL_SIZE,
+    TASK_OUTPUT_MODE_KEEP_ORDER,
+    TASK_OUTPUT_MODE_UNGROUPED,
+    TASK_OUTPUT_MODES,
+    TaskOutputCollector,
+    TaskOutputWriter,
+)
+from .profiler import MemoryProfiler, MemorySnapshot, Profiler
+from .ratelimit import RateLimiter
+from .scheduler import TaskDurationHistory, TaskScheduler
+from .task import (
+    BaseScriptTask,
+    TASK_STATUS_CANCELLED,
+    TASK_STATUS_FAILED,
+    TASK_STATUS_PENDING,
+    TASK_STATUS_RUNNING,
+    TASK_STATUS_SUCCEEDED,
+)
+from .trace import TraceRecorder
 
 if TYPE_CHECKING:
     from logging import Logger
@@ -23,7 +64,17 @@ if TYPE_CHECKING:
 
 DEFAULT_SUBPARSER_HELP = ''
 
+TASK_FAILURE_POLICY_FAIL_FAST = 'fail-fast'
+TASK_FAILURE_POLICY_KEEP_GOING = 'keep-going'
+TASK_FAILURE_POLICY_MAX_FAILURES = 'max-failures'
+TASK_FAILURE_POLICIES = (
+    TASK_FAILURE_POLICY_FAIL_FAST,
+    TASK_FAILURE_POLICY_KEEP_GOING,
+    TASK_FAILURE_POLICY_MAX_FAILURES,
+)
 
+
+# pylint: disable=too-many-public-methods
 class Base(LoggingBaseClass):
     """
     Base class with message / error handling and runner for registered
@@ -31,10 +82,107 @@ class Base(LoggingBaseClass):
 
     Also includes self.logger instance of cli_toolkit.logger.Logger with
     specified logger group name
+
+    Failures of async tasks are handled according to task_failure_policy:
+
+    - fail-fast: cancel remaining tasks on first failure and raise the exception
+    - keep-going: run all tasks and raise TaskError at the end if any failed
+    - max-failures: cancel remaining tasks after max_task_failures failures
+
+    Number of concurrently running tasks can be limited with max_concurrent_tasks.
+    Tasks waiting to retry a failed attempt do not hold a concurrency slot.
+
+    Task launches can be rate limited with named rate limiters registered with
+    add_rate_limiter(). Rate limiters are shared with child commands.
+
+    When the number of running tasks is limited, waiting tasks are started in
+    order of task priority, highest first. With longest_tasks_first, tasks with
+    same priority are started in order of expected duration, longest first.
+
+    With adaptive_concurrency, the number of running tasks is adjusted between
+    min_concurrent_tasks and max_concurrent_tasks based on system load, available
+    memory and task latency.
+
+    Task status, timing and resource usage is shown on stderr after running tasks
+    with task_summary and written as JSON to task_summary_file.
+
+    With event_loop_monitor, event loop lag is sampled while running tasks and lag
+    exceeding event_loop_lag_threshold is reported with the task blocking the loop.
+    Lag percentiles are shown in the task summary.
+
+    With task_output_thread, output of command line tasks is decoded and written by
+    a writer thread instead of the event loop thread. At most task_output_queue_size
+    output chunks are queued for writing.
+
+    Output of tasks is written as it is received with the default task_output_mode
+    ungrouped. With group mode output of each task is buffered and written when the
+    task finishes, and with keep-order mode in order the tasks were added. Output
+    exceeding task_output_spool_size characters is buffered to a temporary file. With
+    task_output_prefix the lines are prefixed with the task name.
+
+    When the script is interrupted while running tasks, queued tasks are cancelled and
+    running tasks are given drain_grace_period seconds to finish before cancelling them.
+    With drain_forward_signal the signal is forwarded to processes of running command
+    line tasks.
+
+    When tracing is enabled in the script, task lifetimes, queue waits and task
+    attempts are recorded to the trace.
     """
+    task_failure_policy: str = TASK_FAILURE_POLICY_FAIL_FAST
+    """Policy for handling failed async tasks"""
+    max_task_failures: Optional[int] = None
+    """Number of failed tasks allowed with max-failures policy"""
+    max_concurrent_tasks: Optional[int] = None
+    """Maximum number of concurrently running async tasks, None for no limit"""
+    longest_tasks_first: bool = False
+    """Start tasks with longest expected duration first"""
+    task_duration_history_file: Optional[str] = None
+    """JSON file to store task duration history for longest_tasks_first"""
+    adaptive_concurrency: bool = False
+    """Adjust number of concurrently running tasks based on system load"""
+    min_concurrent_tasks: int = 1
+    """Minimum number of concurrently running async tasks with adaptive_concurrency"""
+    task_summary: bool = False
+    """Show summary of task resource usage after running tasks"""
+    task_summary_file: Optional[str] = None
+    """JSON file to write summary of task resource usage after running tasks"""
+    event_loop_monitor: bool = False
+    """Monitor event loop lag and report tasks blocking the event loop"""
+    event_loop_monitor_interval: float = 0.1
+    """Seconds between event loop lag samples with event_loop_monitor"""
+    event_loop_lag_threshold: float = 0.1
+    """Event loop lag in seconds reported as slow callback with event_loop_monitor"""
+    drain_grace_period: float = 10.0
+    """Seconds to wait for running tasks to finish after interrupt before cancelling them"""
+    drain_forward_signal: bool = False
+    """Forward interrupt signal to processes of running command line tasks"""
+    task_output_thread: bool = False
+    """Decode and write output of command line tasks in a writer thread"""
+    task_output_queue_size: int = DEFAULT_TASK_OUTPUT_QUEUE_SIZE
+    """Maximum number of output chunks queued for the writer thread with task_output_thread"""
+    task_output_mode: str = TASK_OUTPUT_MODE_UNGROUPED
+    """Mode for grouping output of concurrently running tasks"""
+    task_output_spool_size: int = DEFAULT_TASK_OUTPUT_SPOOL_SIZE
+    """Characters of grouped task output kept in memory before using a temporary file"""
+    task_output_prefix: bool = False
+    """Prefix output lines of tasks with task name"""
+
     __parent__: 'Base'
+    __trace_recorder__: Optional[TraceRecorder] = None
+    __metrics__: Optional[MetricsRegistry] = None
     __async_task_callbacks__: List[Callable]
     __async_tasks__ = List['Task']
+    __task_scheduler__: Optional[TaskScheduler]
+    __task_duration_history__: Optional[TaskDurationHistory]
+    __concurrency_controller__: Optional[AdaptiveConcurrencyController]
+    __event_loop_monitor__: Optional[EventLoopMonitor]
+    __task_output_writer__: Optional[TaskOutputWriter]
+    __task_output_collector__: Optional[TaskOutputCollector]
+    __task_loop__: Optional[asyncio.AbstractEventLoop]
+    __running_async_tasks__: Set[asyncio.Task]
+    __drain_signal__: Optional[int]
+    __drain_timer__: Optional[asyncio.TimerHandle]
+    __rate_limiters__: Dict[str, RateLimiter]
 
     def __init__(self,
                  parent: Optional['Base'] = None,
@@ -47,6 +195,17 @@ class Base(LoggingBaseClass):
         self.__parent__ = parent
         self.__async_task_callbacks__ = []
         self.__async_tasks__ = []
+        self.__task_scheduler__ = None
+        self.__task_duration_history__ = None
+        self.__concurrency_controller__ = None
+        self.__event_loop_monitor__ = None
+        self.__task_output_writer__ = None
+        self.__task_output_collector__ = None
+        self.__task_loop__ = None
+        self.__running_async_tasks__ = set()
+        self.__drain_signal__ = None
+        self.__drain_timer__ = None
+        self.__rate_limiters__ = {}
 
     @property
     def __is_debug_enabled__(self) -> bool:
@@ -66,34 +225,704 @@ class Base(LoggingBaseClass):
             return self.__parent__.__is_silent__ or self.__silent__
         return super().__is_silent__
 
+    @property
+    def metrics(self) -> MetricsRegistry:
+        """
+        Return metrics registry shared by the script and its commands
+        """
+        if self.__parent__ is not None:
+            return self.__parent__.metrics
+        if self.__metrics__ is None:
+            self.__metrics__ = MetricsRegistry()
+        return self.__metrics__
+
+    def __get_trace_recorder__(self) -> Optional[TraceRecorder]:
+        """
+        Return trace recorder of the script if tracing is enabled
+        """
+        if self.__parent__ is not None:
+            return self.__parent__.__get_trace_recorder__()
+        return None
+
+    def __get_profiler__(self) -> Optional[Profiler]:
+        """
+        Return profiler of the script if profiling is enabled
+        """
+        if self.__parent__ is not None:
+            return self.__parent__.__get_profiler__()
+        return None
+
+    def __get_memory_profiler__(self) -> Optional[MemoryProfiler]:
+        """
+        Return memory profiler of the script if memory profiling is enabled
+        """
+        if self.__parent__ is not None:
+            return self.__parent__.__get_memory_profiler__()
+        return None
+
+    def __get_task_output_writer__(self) -> Optional[TaskOutputWriter]:
+        """
+        Return writer thread for task output if running tasks with task_output_thread
+        """
+        if self.__task_output_writer__ is not None:
+            return self.__task_output_writer__
+        if self.__parent__ is not None:
+            return self.__parent__.__get_task_output_writer__()
+        return None
+
+    def create_task_output_writer(self) -> TaskOutputWriter:
+        """
+        Create writer thread for task output
+
+        Override to use a writer with custom encoding
+        """
+        return TaskOutputWriter(queue_size=self.task_output_queue_size)
+
+    def __create_task_output_collector__(self) -> None:
+        """
+        Create collector for grouped task output and start buffering output of script tasks
+        """
+        self.__task_output_collector__ = None
+        if self.task_output_mode not in TASK_OUTPUT_MODES:
+            raise ScriptError(f'Invalid task output mode: {self.task_output_mode}')
+        if self.task_output_mode == TASK_OUTPUT_MODE_UNGROUPED:
+            return
+        self.__task_output_collector__ = TaskOutputCollector(
+            self,
+            keep_order=self.task_output_mode == TASK_OUTPUT_MODE_KEEP_ORDER,
+            spool_size=self.task_output_spool_size,
+        )
+        for callback, _kwargs in self.__async_task_callbacks__:
+            script_task = self.__get_script_task__(callback)
+            if script_task is not None:
+                self.__task_output_collector__.add(script_task)
+
+    def __profile__(self) -> ContextManager:
+        """
+        Return context manager profiling the context when profiling is enabled
+        """
+        profilers = [
+            profiler
+            for profiler in (self.__get_profiler__(), self.__get_memory_profiler__())
+            if profiler is not None
+        ]
+        if not profilers:
+            return nullcontext()
+        stack = ExitStack()
+        for profiler in profilers:
+            stack.enter_context(profiler.profile())
+        return stack
+
+    def memory_snapshot(self, label: str) -> Optional[MemorySnapshot]:
+        """
+        Record traced memory usage with label when memory profiling is enabled
+        """
+        memory_profiler = self.__get_memory_profiler__()
+        if memory_profiler is None:
+            return None
+        return memory_profiler.snapshot(label)
+
+    def trace_span(self, name: str, category: str = 'script', **args: Dict[str, Any]) -> ContextManager:
+        """
+        Return context manager recording a span to the trace when tracing is enabled
+        """
+        trace_recorder = self.__get_trace_recorder__()
+        if trace_recorder is None:
+            return nullcontext()
+        return trace_recorder.span(name, category, args=args)
+
     def add_async_task(self, callback: Callable, **kwargs: Dict[Any, Any]) -> None:
         """
         Register a new async task to be run when run_async_tasks is triggered
         """
         self.__async_task_callbacks__.append((callback, kwargs))
 
-    async def create_async_tasks(self) -> None:
+    def __get_max_task_failures__(self) -> Optional[int]:
         """
-        Create asynchronous tasks added by self.add_async_task_callback
+        Return number of task failures after which remaining tasks are cancelled
+
+        Returns None if all tasks are to be run regardless of failures
         """
-        self.__async_tasks__ = []
+        if self.task_failure_policy == TASK_FAILURE_POLICY_FAIL_FAST:
+            return 1
+        if self.task_failure_policy == TASK_FAILURE_POLICY_KEEP_GOING:
+            return None
+        if self.task_failure_policy == TASK_FAILURE_POLICY_MAX_FAILURES:
+            if not isinstance(self.max_task_failures, int) or self.max_task_failures < 1:
+                raise ScriptError(f'Invalid max_task_failures value: {self.max_task_failures}')
+            return self.max_task_failures
+        raise ScriptError(f'Invalid task failure policy: {self.task_failure_policy}')
+
+    @staticmethod
+    def __get_script_task__(callback: Callable) -> Optional[BaseScriptTask]:
+        """
+        Return script task linked to async task callback, or None for plain callbacks
+        """
+        task = getattr(callback, '__self__', None)
+        return task if isinstance(task, BaseScriptTask) else None
+
+    def __get_task_duration_history__(self) -> TaskDurationHistory:
+        """
+        Return task duration history, loading it from task_duration_history_file
+        """
+        if self.__task_duration_history__ is None:
+            self.__task_duration_history__ = TaskDurationHistory(self.task_duration_history_file)
+            self.__task_duration_history__.load()
+        return self.__task_duration_history__
+
+    def get_task_expected_duration(self, task: BaseScriptTask) -> Optional[float]:
+        """
+        Return expected duration of script task from task attribute or duration history
+        """
+        if task.expected_duration is not None:
+            return task.expected_duration
+        return self.__get_task_duration_history__().get(task.history_key)
+
+    def __get_task_sort_key__(self, task: Optional[BaseScriptTask]) -> Tuple[float, float]:
+        """
+        Return scheduler sort key for script task. Lowest key is started first
+        """
+        if task is None:
+            return (0, 0)
+        expected_duration = 0
+        if self.longest_tasks_first:
+            expected_duration = self.get_task_expected_duration(task) or 0
+        return (-task.priority, -expected_duration)
+
+    async def __acquire_task_slot__(self,
+                                    script_task: Optional[BaseScriptTask],
+                                    sort_key: Tuple[float, float],
+                                    trace_id: Optional[int]) -> None:
+        """
+        Wait for concurrency slot and rate limiter token for a task attempt
+
+        The token is taken only after the slot is held, so tasks waiting for a slot
+        do not collect tokens and start at the same time. Tasks wait for a token to
+        be available before waiting for the slot, so slots are not held while waiting
+        for rate limits unless other tasks took the token in between.
+        """
+        trace_recorder = self.__get_trace_recorder__() if trace_id is not None else None
+        start = time.monotonic()
+        if trace_recorder is not None:
+            trace_recorder.begin_async('queue wait', 'task', trace_id)
+        rate_limiter = None
+        if script_task is not None and script_task.rate_limiter is not None:
+            rate_limiter = self.get_rate_limiter(script_task.rate_limiter)
+            await rate_limiter.wait()
+        if script_task is not None:
+            await script_task.__acquire_slot__(self.__task_scheduler__, sort_key)
+        else:
+            await self.__task_scheduler__.acquire(sort_key)
+        if rate_limiter is not None:
+            try:
+                await rate_limiter.acquire()
+            except asyncio.CancelledError:
+                self.__release_task_slot__(script_task)
+                raise
+        if trace_recorder is not None:
+            trace_recorder.end_async('queue wait', 'task', trace_id)
+        if script_task is not None:
+            script_task.queue_time += time.monotonic() - start
+
+    def __release_task_slot__(self, script_task: Optional[BaseScriptTask]) -> None:
+        """
+        Release concurrency slot held by a task attempt
+        """
+        if script_task is not None:
+            script_task.__release_slot__(self.__task_scheduler__)
+        else:
+            self.__task_scheduler__.release()
+
+    def __record_task_attempt__(self, script_task: Optional[BaseScriptTask], duration: float) -> None:
+        """
+        Record duration of successful task attempt for scheduling decisions
+        """
+        if script_task is not None and self.longest_tasks_first:
+            self.__get_task_duration_history__().update(script_task.history_key, duration)
+        if self.__concurrency_controller__ is not None:
+            key = script_task.history_key if script_task is not None else None
+            self.__concurrency_controller__.record_latency(duration, key)
+
+    # pylint: disable=too-many-arguments
+    async def __run_async_task_attempts__(self,
+                                          script_task: Optional[BaseScriptTask],
+                                          callback: Callable,
+                                          kwargs: Dict[Any, Any],
+                                          sort_key: Tuple[float, float],
+                                          trace_id: Optional[int]) -> Any:
+        """
+        Run async task callback attempts, retrying failed attempts with task retry policy
+
+        The concurrency slot is held only while an attempt is running, not while
+        waiting for retry backoff delay. Rate limiter token is taken when the
+        concurrency slot is held.
+        """
+        retry_policy = script_task.retry_policy if script_task is not None else None
+        trace_recorder = self.__get_trace_recorder__() if trace_id is not None else None
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.__drain_signal__ is not None:
+                raise asyncio.CancelledError
+            await self.__acquire_task_slot__(script_task, sort_key, trace_id)
+            self.__running_async_tasks__.add(asyncio.current_task())
+            start = time.monotonic()
+            if script_task is not None:
+                script_task.attempts = attempt
+                script_task.status = TASK_STATUS_RUNNING
+                script_task.start_time = start
+            if trace_recorder is not None:
+                trace_lane = trace_recorder.acquire_lane()
+                trace_start = trace_recorder.timestamp()
+            try:
+                result = await callback(**kwargs)
+                self.__record_task_attempt__(script_task, time.monotonic() - start)
+                return result
+            except Exception as error:
+                if retry_policy is None or not retry_policy.should_retry(script_task, error, attempt):
+                    raise
+                delay = retry_policy.get_delay(attempt)
+                self.debug(f'Retry task {script_task} attempt {attempt + 1} in {delay:.3f}s: {error}')
+            finally:
+                if script_task is not None:
+                    script_task.wall_time += time.monotonic() - start
+                    script_task.status = TASK_STATUS_PENDING
+                    script_task.start_time = None
+                if trace_recorder is not None:
+                    trace_recorder.add_complete_event(
+                        asyncio.current_task().get_name(), 'attempt', trace_start,
+                        tid=trace_lane, args={'attempt': attempt},
+                    )
+                    trace_recorder.release_lane(trace_lane)
+                self.__running_async_tasks__.discard(asyncio.current_task())
+                self.__release_task_slot__(script_task)
+            await asyncio.sleep(delay)
+
+    async def __run_async_task__(self,
+                                 callback: Callable,
+                                 kwargs: Dict[Any, Any],
+                                 sort_key: Tuple[float, float]) -> Any:
+        """
+        Run a single async task callback, updating the status of script tasks and
+        recording the task lifetime to the trace
+        """
+        script_task = self.__get_script_task__(callback)
+        trace_recorder = self.__get_trace_recorder__()
+        trace_id = None
+        if trace_recorder is not None:
+            trace_id = trace_recorder.get_span_id()
+            trace_recorder.begin_async(asyncio.current_task().get_name(), 'task', trace_id)
+        status = TASK_STATUS_FAILED
+        try:
+            result = await self.__run_async_task_attempts__(script_task, callback, kwargs, sort_key, trace_id)
+            status = TASK_STATUS_SUCCEEDED
+            return result
+        except asyncio.CancelledError:
+            status = TASK_STATUS_CANCELLED
+            raise
+        finally:
+            if script_task is not None:
+                script_task.status = status
+            if trace_recorder is not None:
+                trace_recorder.end_async(asyncio.current_task().get_name(), 'task', trace_id, {'status': status})
+            self.memory_snapshot(f'task {asyncio.current_task().get_name()} {status}')
+            if self.__task_output_collector__ is not None and script_task is not None:
+                self.__task_output_collector__.finish(script_task)
+
+    def create_concurrency_controller(self) -> AdaptiveConcurrencyController:
+        """
+        Create controller for adaptive concurrency
 
-        for callback_args in self.__async_task_callbacks__:
-            callback = callback_args[0]
-            kwargs = callback_args[1]
-            task = asyncio.create_task(callback(**kwargs))
-            self.__async_tasks__.append(task)
+        Override to use a controller with custom thresholds
+        """
+        return AdaptiveConcurrencyController(self.min_concurrent_tasks, self.max_concurrent_tasks)
 
+    async def __adapt_concurrency__(self) -> None:
+        """
+        Periodically update concurrency limit of the task scheduler
+        """
+        controller = self.__concurrency_controller__
+        scheduler = self.__task_scheduler__
+        while True:
+            await asyncio.sleep(controller.interval)
+            previous = scheduler.max_concurrent
+            limit, reason = controller.update(scheduler.running, scheduler.queued)
+            if reason is not None:
+                scheduler.set_max_concurrent(limit)
+                self.debug(f'Adaptive concurrency {previous} -> {limit}: {reason}')
+
+    def create_event_loop_monitor(self) -> EventLoopMonitor:
+        """
+        Create event loop lag monitor
+
+        Override to use a monitor with custom callback
+        """
+        return EventLoopMonitor(
+            interval=self.event_loop_monitor_interval,
+            threshold=self.event_loop_lag_threshold,
+            callback=self.__report_slow_callback__,
+        )
+
+    def __report_slow_callback__(self, slow_callback: SlowCallback) -> None:
+        """
+        Report event loop lag exceeding event_loop_lag_threshold
+        """
+        self.error(f'Slow callback: {slow_callback}')
+
+    async def __stop_event_loop_monitor__(self) -> None:
+        """
+        Stop event loop monitor and record lag samples to event_loop_lag_seconds metric
+        """
+        await self.__event_loop_monitor__.stop()
+        histogram = self.metrics.histogram('event_loop_lag_seconds', 'Event loop lag sampled while running tasks')
+        for lag in self.__event_loop_monitor__.lags:
+            histogram.observe(lag)
+
+    def __get_running_command_line_tasks__(self) -> List[BaseScriptTask]:
+        """
+        Return script tasks with a running child process
+        """
+        tasks = []
+        for callback, _kwargs in self.__async_task_callbacks__:
+            task = self.__get_script_task__(callback)
+            if task is not None and getattr(task, 'process', None) is not None:
+                tasks.append(task)
+        return tasks
+
+    def drain_async_tasks(self, signum: int) -> None:
+        """
+        Stop starting new tasks after interrupt signal
+
+        Queued tasks and tasks waiting to retry are cancelled. Running tasks are
+        cancelled if they do not finish in drain_grace_period seconds. This must
+        be called in the event loop running the tasks.
+        """
+        if self.__task_loop__ is None or self.__drain_signal__ is not None:
+            return
+        self.__drain_signal__ = signum
         for task in self.__async_tasks__:
-            await task
+            if not task.done() and task not in self.__running_async_tasks__:
+                task.cancel()
+        if self.drain_forward_signal:
+            for task in self.__get_running_command_line_tasks__():
+                try:
+                    task.send_signal(signum)
+                except ProcessLookupError:
+                    pass
+        self.__drain_timer__ = self.__task_loop__.call_later(self.drain_grace_period, self.__drain_timeout__)
 
-        return asyncio.gather(*self.__async_tasks__)
+    def __drain_timeout__(self) -> None:
+        """
+        Cancel tasks still running when drain grace period expires
+        """
+        running = [task for task in self.__async_tasks__ if not task.done()]
+        if running:
+            self.error(f'Drain grace period expired, cancelling {len(running)} running tasks')
+            for task in running:
+                task.cancel()
+
+    def kill_async_tasks(self) -> None:
+        """
+        Kill processes of running command line tasks immediately
+
+        The processes are reaped when the tasks are cancelled.
+        """
+        for task in self.__get_running_command_line_tasks__():
+            try:
+                task.send_signal(signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    @staticmethod
+    async def cancel_async_tasks(tasks: List[asyncio.Task]) -> None:
+        """
+        Cancel specified async tasks and wait for the cancellation to be processed
+
+        Waiting for the tasks allows CommandLineTask to terminate running processes
+        """
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def add_rate_limiter(self, name: str, rate: float, burst: int = 1) -> RateLimiter:
+        """
+        Register a named rate limiter allowing rate task starts per second with bursts
+        """
+        if name in self.__rate_limiters__:
+            raise ScriptError(f'Rate limiter already registered: {name}')
+        rate_limiter = RateLimiter(name, rate, burst)
+        self.__rate_limiters__[name] = rate_limiter
+        return rate_limiter
+
+    def get_rate_limiter(self, name: str) -> RateLimiter:
+        """
+        Return named rate limiter registered to this object or parents
+        """
+        if name in self.__rate_limiters__:
+            return self.__rate_limiters__[name]
+        if self.__parent__ is not None:
+            return self.__parent__.get_rate_limiter(name)
+        raise ScriptError(f'Rate limiter not registered: {name}')
+
+    def get_task_stats(self) -> List[Dict[str, Any]]:
+        """
+        Return status and resource usage of script tasks, most expensive task first
+
+        Tasks are sorted by wall time spent running the task
+        """
+        stats = []
+        for callback, _kwargs in self.__async_task_callbacks__:
+            task = self.__get_script_task__(callback)
+            if task is not None:
+                stats.append(task.get_stats())
+        return sorted(stats, key=lambda item: item['wall_time'], reverse=True)
+
+    def show_task_summary(self) -> None:
+        """
+        Show summary of task status and resource usage on stderr
+        """
+        stats = self.get_task_stats()
+        counts = {}
+        for item in stats:
+            counts[item['status']] = counts.get(item['status'], 0) + 1
+        totals = ', '.join(f'{count} {status}' for status, count in sorted(counts.items()))
+        self.error(f'Task summary: {len(stats)} tasks: {totals}')
+        if self.__event_loop_monitor__ is not None and self.__event_loop_monitor__.lags:
+            monitor = self.__event_loop_monitor__
+            percentiles = ' '.join(f'{name} {value:.3f}s' for name, value in monitor.get_percentiles().items())
+            self.error(
+                f'Event loop lag: {len(monitor.lags)} samples {percentiles}, '
+                f'{len(monitor.slow_callbacks)} slow callbacks'
+            )
+        self.error(f'{"wall":>10} {"queue":>10} {"user":>10} {"sys":>10} {"max rss":>10} {"status":10} task')
+        for item in stats:
+            user_time = f'{item["user_time"]:.3f}s' if 'user_time' in item else '-'
+            system_time = f'{item["system_time"]:.3f}s' if 'system_time' in item else '-'
+            max_rss = f'{item["max_rss"] / 1024 / 1024:.1f}M' if 'max_rss' in item else '-'
+            self.error(
+                f'{item["wall_time"]:>9.3f}s {item["queue_time"]:>9.3f}s {user_time:>10} {system_time:>10} '
+                f'{max_rss:>10} {item["status"]:10} {item["task"]}'
+            )
+
+    def write_task_summary(self, path: str) -> None:
+        """
+        Write summary of task status and resource usage to JSON file
+        """
+        try:
+            with open(path, 'w', encoding='utf-8') as filedescriptor:
+                json.dump(self.get_task_stats(), filedescriptor, indent=2)
+        except OSError as error:
+            raise ScriptError(f'Error writing task summary {path}: {error}') from error
+
+    def __create_task_scheduler__(self) -> None:
+        """
+        Create task scheduler and adaptive concurrency controller for running tasks
+        """
+        self.__concurrency_controller__ = None
+        if self.adaptive_concurrency:
+            self.__concurrency_controller__ = self.create_concurrency_controller()
+            self.__task_scheduler__ = TaskScheduler(self.__concurrency_controller__.limit)
+            self.debug(f'Adaptive concurrency initial limit {self.__concurrency_controller__.limit}')
+        else:
+            self.__task_scheduler__ = TaskScheduler(self.max_concurrent_tasks)
+
+    def __report_async_tasks__(self) -> None:
+        """
+        Save task duration history and show and write task summary after running tasks
+        """
+        if self.longest_tasks_first:
+            self.__get_task_duration_history__().save()
+        if self.task_summary:
+            self.show_task_summary()
+        if self.task_summary_file:
+            self.write_task_summary(self.task_summary_file)
+
+    def __start_task_runner__(self) -> None:
+        """
+        Create task scheduler and output collector and start event loop monitor and
+        task output writer
+        """
+        self.__create_task_scheduler__()
+        self.__create_task_output_collector__()
+        self.__task_loop__ = asyncio.get_running_loop()
+        self.__drain_signal__ = None
+        if self.event_loop_monitor:
+            self.__event_loop_monitor__ = self.create_event_loop_monitor()
+            self.__event_loop_monitor__.start()
+        if self.task_output_thread:
+            self.__task_output_writer__ = self.create_task_output_writer()
+            self.__task_output_writer__.start()
+
+    async def __stop_task_runner__(self) -> None:
+        """
+        Stop event loop monitor, task output writer and drain timer and write remaining
+        grouped task output after running tasks
+        """
+        if self.__event_loop_monitor__ is not None:
+            await self.__stop_event_loop_monitor__()
+        if self.__task_output_writer__ is not None:
+            await self.__task_output_writer__.stop()
+            self.__task_output_writer__ = None
+        if self.__task_output_collector__ is not None:
+            self.__task_output_collector__.flush()
+            self.__task_output_collector__ = None
+        if self.__drain_timer__ is not None:
+            self.__drain_timer__.cancel()
+            self.__drain_timer__ = None
+        self.__task_loop__ = None
+
+    def __start_async_tasks__(self) -> None:
+        """
+        Create asyncio tasks for callbacks added with add_async_task
+        """
+        # Tasks are created in scheduling order to dispatch the first free slots in order
+        callbacks = [
+            (index, callback, kwargs, self.__get_task_sort_key__(self.__get_script_task__(callback)))
+            for index, (callback, kwargs) in enumerate(self.__async_task_callbacks__)
+        ]
+        tasks = {}
+        for index, callback, kwargs, sort_key in sorted(callbacks, key=lambda item: item[3]):
+            name = repr(getattr(callback, '__self__', callback))
+            tasks[index] = asyncio.create_task(self.__run_async_task__(callback, kwargs, sort_key), name=name)
+        self.__async_tasks__ = [tasks[index] for index in range(len(callbacks))]
+
+    def __raise_async_task_errors__(self, failures: List[asyncio.Task]) -> None:
+        """
+        Raise error if running tasks was interrupted or tasks failed
+        """
+        if self.__drain_signal__ is not None:
+            cancelled = len([task for task in self.__async_tasks__ if task.cancelled()])
+            raise TaskError(
+                f'Interrupted by {signal.Signals(self.__drain_signal__).name}: '
+                f'{cancelled} of {len(self.__async_tasks__)} tasks cancelled'
+            )
+        if failures:
+            if self.task_failure_policy == TASK_FAILURE_POLICY_FAIL_FAST:
+                raise failures[0].exception()
+            for task in failures:
+                self.error(f'Task {task.get_name()} failed: {task.exception()}')
+            raise TaskError(f'{len(failures)} of {len(self.__async_tasks__)} tasks failed')
+
+    async def as_completed_async_tasks(self) -> AsyncIterator[Any]:
+        """
+        Create asynchronous tasks added by self.add_async_task and yield results of
+        the tasks as they finish
+
+        Remaining tasks keep running while results are processed. Failures are handled
+        as specified by task_failure_policy: results of failed tasks are not yielded
+        and errors are raised as with create_async_tasks(). Remaining tasks are
+        cancelled when the iterator is closed before all tasks have finished. Stopping
+        the iteration with break does not close the iterator: call aclose() of the
+        iterator, or iterate it in contextlib.aclosing().
+        """
+        max_failures = self.__get_max_task_failures__()
+        self.__start_task_runner__()
+        self.__start_async_tasks__()
+
+        adapt_task = None
+        if self.__concurrency_controller__ is not None:
+            adapt_task = asyncio.create_task(self.__adapt_concurrency__())
+        # Finished tasks are queued by done callbacks instead of waiting on all pending tasks
+        completed = asyncio.Queue()
+        for task in self.__async_tasks__:
+            task.add_done_callback(completed.put_nowait)
+        failures = []
+        remaining = len(self.__async_tasks__)
+        try:
+            while remaining:
+                task = await completed.get()
+                remaining -= 1
+                if task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    failures.append(task)
+                    if max_failures is not None and len(failures) >= max_failures:
+                        break
+                else:
+                    yield task.result()
+        finally:
+            await self.cancel_async_tasks([task for task in self.__async_tasks__ if not task.done()])
+            if adapt_task is not None:
+                await self.cancel_async_tasks([adapt_task])
+            await self.__stop_task_runner__()
+
+        self.__report_async_tasks__()
+        self.__raise_async_task_errors__(failures)
 
-    def run_async_tasks(self) -> None:
+    async def create_async_tasks(self) -> List[Any]:
+        """
+        Create asynchronous tasks added by self.add_async_task_callback
+
+        Returns results of the tasks in order the tasks were added. Failures are
+        handled as specified by task_failure_policy.
+        """
+        async for _result in self.as_completed_async_tasks():
+            pass
+        return [task.result() if not task.cancelled() else None for task in self.__async_tasks__]
+
+    def __get_event_loop__(self) -> Optional[asyncio.AbstractEventLoop]:
+        """
+        Return event loop of the script, or None if there is no script
+        """
+        if self.__parent__ is not None:
+            return self.__parent__.__get_event_loop__()
+        return None
+
+    def close_event_loop(self) -> None:
+        """
+        Cancel remaining tasks and close the event loop of the script
+        """
+        if self.__parent__ is not None:
+            self.__parent__.close_event_loop()
+
+    def __running_command_line__(self) -> bool:
+        """
+        Check if the script is running a batch or invoked command line, which exits
+        without exiting the script
+        """
+        if self.__parent__ is not None:
+            return self.__parent__.__running_command_line__()
+        return False
+
+    def run_coroutine(self, coroutine: Coroutine) -> Any:
+        """
+        Run coroutine in the event loop of the script and return the result
+
+        The event loop is kept open for following calls and closed when the script
+        exits. Without a script, the coroutine is run with asyncio.run().
+
+        If the coroutine is interrupted by exit or keyboard interrupt while running a
+        batch or invoked command line, the coroutine is cancelled and the event loop
+        is kept for following command lines. Otherwise the event loop is closed.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            coroutine.close()
+            raise ScriptError(f'{self} can not run coroutine from a running event loop')
+        loop = self.__get_event_loop__()
+        if loop is None:
+            return asyncio.run(coroutine)
+        task = loop.create_task(coroutine)
+        try:
+            return loop.run_until_complete(task)
+        except (KeyboardInterrupt, SystemExit):
+            if self.__running_command_line__():
+                task.cancel()
+                loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+            else:
+                self.close_event_loop()
+            raise
+
+    def run_async_tasks(self) -> List[Any]:
         """
         Create and run async tasks registered with add_async_task
+
+        Coroutine run() methods of commands must await create_async_tasks() instead
         """
-        return asyncio.run(self.create_async_tasks())
+        return self.run_coroutine(self.create_async_tasks())
 
 
 class NestedCliCommand(Base):
@@ -146,21 +975,39 @@ class NestedCliCommand(Base):
         """
         return f'{self.name}_command'
 
+    @staticmethod
+    def __get_exit_code__(value: Any) -> int:
+        """
+        Return exit code for exit value
+
+        Boolean True is exit code 0 and False 1. Values that are not valid exit codes
+        are returned as exit code 1.
+        """
+        if isinstance(value, bool):
+            return 0 if value else 1
+        try:
+            value = int(value)
+            if value < 0 or value > 255:
+                raise ValueError
+        except (TypeError, ValueError):
+            value = 1
+        return value
+
+    def __iter_commands__(self) -> Iterator['NestedCliCommand']:
+        """
+        Iterate this command and all nested subcommands
+        """
+        yield self
+        for command in self.__subcommands__.values():
+            yield from command.__iter_commands__()
+
     def exit(self, value: int = 0, message: Optional[str] = None) -> None:
         """
         Exit the script with given exit value
 
         If message is not None, it is output to stderr
         """
-        if isinstance(value, bool):
-            value = 0 if value else 1
-        else:
-            try:
-                value = int(value)
-                if value < 0 or value > 255:
-                    raise ValueError
-            except ValueError:
-                value = 1
+        value = self.__get_exit_code__(value)
 
         if message:
             self.error(message)
@@ -182,18 +1029,12 @@ class NestedCliCommand(Base):
             self.add_subcommand(command)
             command.__register_subcommands__()
 
-    @staticmethod
-    def reset_stty() -> None:
+    def reset_stty(self) -> None:
         """
-        Clear stty settings by running 'stty sane' in terminal
+        Restore terminal attributes captured when the script was started
         """
-        if sys.platform == 'win32':
-            return
-        try:
-            if sys.stdin.isatty():
-                os.system('stty sane')
-        except Exception:
-            pass
+        if self.__parent__ is not None:
+            self.__parent__.reset_stty()
 
     # pylint: disable=redefined-builtin
     def add_subparsers(self, help: Optional[str] = None) -> None:
@@ -264,7 +1105,12 @@ class NestedCliCommand(Base):
         Run subcommand with arguments
         """
         if self.__async_task_callbacks__:
-            self.run_async_tasks()
+            try:
+                with self.trace_span(f'{self} tasks', 'dispatch', tasks=len(self.__async_task_callbacks__)):
+                    with self.__profile__():
+                        self.run_async_tasks()
+            except TaskError as error:
+                self.exit(1, error)
             self.exit(0)
 
         if self.command_dest not in args:
@@ -275,7 +1121,34 @@ class NestedCliCommand(Base):
             self.exit(1, self.no_subcommand_error)
 
         command = self.__subcommands__[command_dest]
-        args = command.parse_args(args)
-        command.run(args)
+        with self.trace_span(f'{self} {command}', 'dispatch'):
+            args = command.parse_args(args)
+            with self.__profile__():
+                self.__run_command__(command, args)
         # Explicitly exit after running command
         self.exit(0)
+
+    @staticmethod
+    async def __run_async_command__(command: 'NestedCliCommand', args: argparse.Namespace) -> None:
+        """
+        Run coroutine run() method of command, and then tasks registered by the command
+        and not run by it, in the same event loop
+        """
+        await command.run(args)
+        if command.__async_task_callbacks__ and not command.__async_tasks__:
+            await command.create_async_tasks()
+
+    def __run_command__(self, command: 'NestedCliCommand', args: argparse.Namespace) -> None:
+        """
+        Run command with arguments
+
+        If run() of the command is a coroutine function, it is run in an event loop
+        shared with the async tasks of the command.
+        """
+        if not asyncio.iscoroutinefunction(command.run):
+            command.run(args)
+            return
+        try:
+            self.run_coroutine(self.__run_async_command__(command, args))
+        except TaskError as error:
+            self.exit(1, error)
@@ -0,0 +1,54 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Command lines run by scripts in batch mode
+
+Batch files contain one command line per line, with arguments quoted as in shell.
+Empty lines and lines starting with # are skipped.
+"""
+import shlex
+
+from typing import Iterator, List, Optional, TextIO
+
+
+class BatchLine:
+    """
+    Command line read from a batch file, with exit code of the command when run
+    """
+    number: int
+    line: str
+    exit_code: Optional[int]
+
+    def __init__(self, number: int, line: str) -> None:
+        self.number = number
+        self.line = line
+        self.exit_code = None
+
+    def __repr__(self) -> str:
+        """
+        Return line number and command line
+        """
+        return f'line {self.number}: {self.line}'
+
+    @property
+    def argv(self) -> List[str]:
+        """
+        Return arguments of the command line split as in shell
+
+        Raises ValueError for invalid quoting
+        """
+        return shlex.split(self.line, comments=True)
+
+
+def read_batch_lines(stream: TextIO) -> Iterator[BatchLine]:
+    """
+    Iterate command lines in batch file stream, skipping empty lines and comments
+    """
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        yield BatchLine(number, line)
@@ -0,0 +1,166 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Adaptive concurrency control for script tasks
+
+The controller adjusts the number of concurrently running tasks with additive
+increase / multiplicative decrease (AIMD) based on system load average, available
+memory and observed task latency.
+"""
+import math
+import os
+import time
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .exceptions import ScriptError
+
+MEMINFO_PATH = Path('/proc/meminfo')
+
+
+def get_cpu_count() -> int:
+    """
+    Return number of CPUs available for the process
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_load_per_cpu() -> Optional[float]:
+    """
+    Return 1 minute load average divided by number of CPUs, None if not available
+    """
+    try:
+        return os.getloadavg()[0] / get_cpu_count()
+    except (AttributeError, OSError):
+        return None
+
+
+def get_available_memory() -> Optional[float]:
+    """
+    Return available memory as fraction of total memory, None if not available
+    """
+    try:
+        meminfo = {}
+        for line in MEMINFO_PATH.read_text(encoding='utf-8').splitlines():
+            key, value = line.split(':', 1)
+            meminfo[key] = int(value.split()[0])
+        return meminfo['MemAvailable'] / meminfo['MemTotal']
+    except (OSError, KeyError, ValueError, ZeroDivisionError):
+        return None
+
+
+class AdaptiveConcurrencyController:
+    """
+    AIMD controller for number of concurrently running tasks
+
+    The limit is decreased by decrease_factor when load average per CPU exceeds
+    max_load_per_cpu, available memory fraction is below min_available_memory, or
+    task latencies in last interval exceed latency_factor times their baseline latency
+    on average. Latency of each task is compared to a decaying average latency of earlier
+    tasks with the same key, so workloads mixing short and long tasks are not taken
+    as overloaded. After a decrease the limit is not decreased again for
+    decrease_cooldown seconds.
+
+    Otherwise the limit is increased by increase when tasks are waiting for slots.
+    """
+    interval: float = 1.0
+    """Seconds between limit updates"""
+    increase: int = 1
+    """Number of slots added when tasks are waiting"""
+    decrease_factor: float = 0.5
+    """Multiplier for the limit when system is overloaded"""
+    decrease_cooldown: float = 10.0
+    """Seconds to wait after decrease before decreasing again"""
+    max_load_per_cpu: float = 1.0
+    """Maximum 1 minute load average per CPU"""
+    min_available_memory: float = 0.1
+    """Minimum available memory as fraction of total memory"""
+    latency_factor: float = 2.0
+    """Maximum average ratio of task latency to the baseline latency of the task key"""
+    baseline_weight: float = 0.1
+    """Weight of each task latency in the decaying baseline latency of the task key"""
+
+    min_concurrent: int
+    max_concurrent: int
+    limit: int
+
+    def __init__(self, min_concurrent: int = 1, max_concurrent: Optional[int] = None) -> None:
+        if max_concurrent is None:
+            max_concurrent = get_cpu_count() * 2
+        if min_concurrent < 1 or max_concurrent < min_concurrent:
+            raise ScriptError(f'Invalid adaptive concurrency bounds: {min_concurrent}-{max_concurrent}')
+        self.min_concurrent = min_concurrent
+        self.max_concurrent = max_concurrent
+        self.limit = max(min_concurrent, min(max_concurrent, get_cpu_count()))
+        self.__latency_ratios__: List[float] = []
+        self.__baseline_latencies__: Dict[Optional[str], float] = {}
+        self.__last_decrease__: Optional[float] = None
+
+    def record_latency(self, duration: float, key: Optional[str] = None) -> None:
+        """
+        Record duration of a finished task attempt
+
+        The duration is compared to the baseline latency of earlier task attempts with
+        the same key, and the baseline is updated with the duration.
+        """
+        baseline = self.__baseline_latencies__.get(key, None)
+        if baseline is None:
+            self.__baseline_latencies__[key] = duration
+            return
+        if baseline > 0:
+            self.__latency_ratios__.append(duration / baseline)
+        self.__baseline_latencies__[key] = baseline + self.baseline_weight * (duration - baseline)
+
+    def __get_latency_ratio__(self) -> Optional[float]:
+        """
+        Return average ratio of task latencies in last interval to their baseline latencies
+        """
+        if not self.__latency_ratios__:
+            return None
+        ratio = sum(self.__latency_ratios__) / len(self.__latency_ratios__)
+        self.__latency_ratios__ = []
+        return ratio
+
+    def __get_overload_reason__(self) -> Optional[str]:
+        """
+        Return reason for decreasing concurrency, None if system is not overloaded
+        """
+        reasons = []
+        load = get_load_per_cpu()
+        if load is not None and load > self.max_load_per_cpu:
+            reasons.append(f'load {load:.2f}/cpu')
+        memory = get_available_memory()
+        if memory is not None and memory < self.min_available_memory:
+            reasons.append(f'available memory {memory:.0%}')
+        latency_ratio = self.__get_latency_ratio__()
+        if latency_ratio is not None and latency_ratio > self.latency_factor:
+            reasons.append(f'latency {latency_ratio:.1f}x baseline')
+        return ', '.join(reasons) if reasons else None
+
+    def update(self, running: int, queued: int) -> Tuple[int, Optional[str]]:
+        """
+        Update concurrency limit based on current state
+
+        Returns the new limit and reason for the change, or None if limit was not changed
+        """
+        now = time.monotonic()
+        previous = self.limit
+        reason = self.__get_overload_reason__()
+        if reason is not None:
+            if self.__last_decrease__ is not None and now - self.__last_decrease__ < self.decrease_cooldown:
+                return self.limit, None
+            self.limit = max(self.min_concurrent, math.floor(self.limit * self.decrease_factor))
+            self.__last_decrease__ = now
+        elif queued and running >= self.limit:
+            self.limit = min(self.max_concurrent, self.limit + self.increase)
+            reason = f'{queued} tasks queued'
+        if self.limit == previous:
+            return self.limit, None
+        return self.limit, reason
@@ -0,0 +1,535 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Daemon mode for scripts invoked frequently from other automation
+
+The daemon imports the script module and creates the script object once, and waits
+for clients on a local Unix socket. Each client request is run in a process forked
+from the daemon, so python startup, imports and creating the script are not repeated
+for each run, and runs do not share state.
+
+Clients send their arguments, environment, working directory and stdin, stdout and
+stderr file descriptors to the daemon and exit with the exit code of the run. When no
+daemon is running, the script is run in the client process.
+
+This module only imports standard library modules, so the client starts quickly.
+"""
+import argparse
+import importlib
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import tempfile
+import traceback
+
+from types import FrameType
+from typing import Any, Dict, List, Optional, Sequence, TYPE_CHECKING
+
+from .exceptions import ScriptError
+
+if TYPE_CHECKING:
+    from .script import Script
+
+DAEMON_DIRECTORY_MODE = 0o700
+DAEMON_SOCKET_UMASK = 0o177
+DAEMON_MESSAGE_SIZE = 65536
+DAEMON_STDIO_FDS = (0, 1, 2)
+DEFAULT_DAEMON_RELOAD_INTERVAL = 1.0
+DAEMON_FORWARDED_SIGNALS = tuple(
+    getattr(signal, name) for name in ('SIGINT', 'SIGTERM', 'SIGHUP', 'SIGUSR1') if hasattr(signal, name)
+)
+
+
+def get_daemon_socket_path(script: str) -> str:
+    """
+    Return default socket path for daemon of script given as module:Class
+
+    Sockets are created in XDG_RUNTIME_DIR, or in a directory of the user in the
+    temporary directory if XDG_RUNTIME_DIR is not set.
+    """
+    directory = os.environ.get('XDG_RUNTIME_DIR', None)
+    if not directory:
+        directory = os.path.join(tempfile.gettempdir(), f'cli-toolkit-{os.getuid()}')
+    name = ''.join(character if character.isalnum() or character in '._-' else '-' for character in script)
+    return os.path.join(directory, f'cli-toolkit-{name}.sock')
+
+
+def load_script_class(script: str) -> type:
+    """
+    Import script class given as module:Class
+    """
+    try:
+        module_name, class_name = script.split(':', 1)
+    except ValueError as error:
+        raise ScriptError(f'Script must be given as module:Class, not {script}') from error
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as error:
+        raise ScriptError(f'Error importing script module {module_name}: {error}') from error
+    try:
+        return getattr(module, class_name)
+    except AttributeError as error:
+        raise ScriptError(f'Script class {class_name} not found in module {module_name}') from error
+
+
+def get_exit_code(code: Any) -> int:
+    """
+    Return process exit code for SystemExit code, showing non-integer codes on stderr
+    """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write(f'{code}\n')
+    return 1
+
+
+class DaemonConnection:
+    """
+    Connection between daemon and client, passing messages as lines of JSON
+
+    File descriptors received with messages are collected to fds.
+    """
+    connection: socket.socket
+    fds: List[int]
+
+    def __init__(self, connection: socket.socket) -> None:
+        self.connection = connection
+        self.fds = []
+        self.__buffer__ = b''
+
+    def send(self, message: Dict[str, Any], fds: Sequence[int] = ()) -> None:
+        """
+        Send message, passing file descriptors with the message
+        """
+        data = json.dumps(message).encode('utf-8') + b'\n'
+        if fds:
+            data = data[socket.send_fds(self.connection, [data], list(fds)):]
+        self.connection.sendall(data)
+
+    def receive(self) -> Optional[Dict[str, Any]]:
+        """
+        Receive next message, or None if the connection was closed
+        """
+        while b'\n' not in self.__buffer__:
+            data, fds, _flags, _address = socket.recv_fds(self.connection, DAEMON_MESSAGE_SIZE, len(DAEMON_STDIO_FDS))
+            self.fds.extend(fds)
+            if not data:
+                return None
+            self.__buffer__ += data
+        line, self.__buffer__ = self.__buffer__.split(b'\n', 1)
+        return json.loads(line)
+
+    def close(self) -> None:
+        """
+        Close the connection and received file descriptors
+        """
+        for filedescriptor in self.fds:
+            try:
+                os.close(filedescriptor)
+            except OSError:
+                pass
+        self.fds = []
+        self.connection.close()
+
+
+class DaemonClient:
+    """
+    Client running script in a daemon listening on socket path
+    """
+    path: str
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def __connect__(self) -> Optional[DaemonConnection]:
+        """
+        Connect to the daemon, returning None if no daemon of the user is listening
+        """
+        if not hasattr(socket, 'AF_UNIX') or not hasattr(socket, 'send_fds'):
+            return None
+        try:
+            if os.stat(self.path).st_uid != os.getuid():
+                return None
+        except OSError:
+            return None
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.path)
+        except OSError:
+            connection.close()
+            return None
+        return DaemonConnection(connection)
+
+    @staticmethod
+    def __forward_signals__(pid: int) -> Dict[int, Any]:
+        """
+        Forward signals received by the client to the daemon process running the script
+
+        Returns previous signal handlers
+        """
+        # pylint: disable=unused-argument
+        def forward_signal(signum: int, frame: Optional[FrameType]) -> None:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+        handlers = {}
+        try:
+            for signum in DAEMON_FORWARDED_SIGNALS:
+                handlers[signum] = signal.signal(signum, forward_signal)
+        except ValueError:
+            # Signal handlers can only be set in the main thread
+            pass
+        return handlers
+
+    def run(self,
+            argv: Optional[List[str]] = None,
+            env: Optional[Dict[str, str]] = None,
+            cwd: Optional[str] = None,
+            stdio: Sequence[int] = DAEMON_STDIO_FDS) -> Optional[int]:
+        """
+        Run script in the daemon, returning the exit code of the run
+
+        Arguments, environment and working directory of the client process are sent
+        unless given. Returns None if the script was not started by a daemon, and the
+        script should be run in process.
+        """
+        connection = self.__connect__()
+        if connection is None:
+            return None
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        try:
+            connection.send(
+                {
+                    'argv': argv if argv is not None else sys.argv,
+                    'env': env if env is not None else dict(os.environ),
+                    'cwd': cwd if cwd is not None else os.getcwd(),
+                },
+                stdio
+            )
+            message = connection.receive()
+        except OSError:
+            message = None
+        if message is None or 'pid' not in message:
+            connection.close()
+            return None
+
+        handlers = self.__forward_signals__(message['pid'])
+        try:
+            message = connection.receive()
+        except OSError:
+            message = None
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            connection.close()
+        if message is None or 'exit_code' not in message:
+            sys.stderr.write(f'Daemon {self.path} closed connection before the script exited\n')
+            return 1
+        return message['exit_code']
+
+
+class ScriptDaemon:
+    """
+    Daemon running script given as module:Class for clients connecting to socket path
+
+    The script object is created when the daemon is started, with name as sys.argv[0].
+    Each request is run by calling run() of the script in a forked process with the
+    arguments, environment, working directory and stdio of the client. The script name
+    is set from the first argument of the client, as when the script is run in process.
+
+    Modification times of imported python modules are checked every reload_interval
+    seconds and before starting a run. When modules have changed, the daemon stops
+    accepting connections and restarts itself with restart_command, and clients run
+    the script in process until the daemon is listening again.
+    """
+    script: str
+    path: str
+    name: Optional[str]
+    reload_interval: float
+    restart_command: List[str]
+
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 script: str,
+                 path: Optional[str] = None,
+                 name: Optional[str] = None,
+                 reload_interval: float = DEFAULT_DAEMON_RELOAD_INTERVAL,
+                 restart_command: Optional[List[str]] = None) -> None:
+        self.script = script
+        self.path = path if path is not None else get_daemon_socket_path(script)
+        self.name = name
+        self.reload_interval = reload_interval
+        self.restart_command = restart_command if restart_command is not None else [sys.executable] + sys.argv
+        self.__script__: Optional['Script'] = None
+        self.__modules__: Dict[str, int] = {}
+        self.__signal_handlers__: Dict[int, Any] = {}
+        self.__stopped__ = False
+
+    def __create_script__(self) -> 'Script':
+        """
+        Create the script object run for clients
+        """
+        script_class = load_script_class(self.script)
+        argv = sys.argv
+        if self.name is not None:
+            sys.argv = [self.name]
+        try:
+            return script_class()
+        finally:
+            sys.argv = argv
+
+    @staticmethod
+    def __get_module_mtimes__() -> Dict[str, int]:
+        """
+        Return modification times of files of imported modules
+        """
+        mtimes = {}
+        for module in list(sys.modules.values()):
+            path = getattr(module, '__file__', None)
+            if not path or path in mtimes:
+                continue
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+        return mtimes
+
+    def __code_changed__(self) -> bool:
+        """
+        Check if files of modules imported when the daemon was started have changed
+        """
+        for path, mtime in self.__modules__.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def __bind__(self) -> socket.socket:
+        """
+        Create directory for the socket and start listening on the socket
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, mode=DAEMON_DIRECTORY_MODE, exist_ok=True)
+            if os.stat(directory).st_uid != os.getuid():
+                raise ScriptError(f'Daemon socket directory {directory} is not owned by the user')
+            if os.path.exists(self.path):
+                if DaemonClient(self.path).__connect__() is not None:
+                    raise ScriptError(f'Daemon is already listening on {self.path}')
+                os.unlink(self.path)
+        except OSError as error:
+            raise ScriptError(f'Error creating daemon socket {self.path}: {error}') from error
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(DAEMON_SOCKET_UMASK)
+        try:
+            listener.bind(self.path)
+            listener.listen()
+        except OSError as error:
+            listener.close()
+            raise ScriptError(f'Error listening on daemon socket {self.path}: {error}') from error
+        finally:
+            os.umask(umask)
+        return listener
+
+    # pylint: disable=unused-argument
+    def __stop__(self, signum: int, frame: Optional[FrameType]) -> None:
+        """
+        Stop the daemon on SIGTERM
+        """
+        self.__stopped__ = True
+
+    @staticmethod
+    def __reap_children__() -> None:
+        """
+        Collect exit status of finished run processes
+        """
+        while True:
+            try:
+                pid, _status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+    def serve(self) -> None:
+        """
+        Create the script and run it for clients until stopped with SIGTERM or restarted
+        after code changes
+        """
+        self.__script__ = self.__create_script__()
+        self.__modules__ = self.__get_module_mtimes__()
+        listener = self.__bind__()
+        self.__signal_handlers__ = {
+            signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, self.__stop__)
+        self.__stopped__ = False
+        try:
+            while True:
+                readable, _writable, _errors = select.select([listener], [], [], self.reload_interval)
+                self.__reap_children__()
+                if self.__stopped__:
+                    return
+                if self.__code_changed__():
+                    break
+                if readable:
+                    connection, _address = listener.accept()
+                    self.__handle__(listener, DaemonConnection(connection))
+        finally:
+            listener.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self.restart()
+
+    def restart(self) -> None:
+        """
+        Restart the daemon to load changed code
+        """
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        os.execv(self.restart_command[0], self.restart_command)
+
+    def __handle__(self, listener: socket.socket, connection: DaemonConnection) -> None:
+        """
+        Fork a process to run the script for a client connection
+        """
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        pid = os.fork()
+        if pid != 0:
+            connection.close()
+            return
+        exit_code = 1
+        try:
+            listener.close()
+            exit_code = self.__run_request__(connection)
+        finally:
+            os._exit(exit_code)  # pylint: disable=protected-access
+
+    def __setup_process__(self, request: Dict[str, Any], fds: List[int]) -> None:
+        """
+        Use stdio, environment, working directory and arguments of the client in the run process
+        """
+        for target, filedescriptor in zip(DAEMON_STDIO_FDS, fds):
+            os.dup2(filedescriptor, target)
+            os.close(filedescriptor)
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.reconfigure(line_buffering=stream.isatty())
+            except (AttributeError, OSError, ValueError):
+                pass
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.chdir(request['cwd'])
+        sys.argv = list(request['argv'])
+        for signum, handler in self.__signal_handlers__.items():
+            signal.signal(signum, handler)
+
+    def __run_request__(self, connection: DaemonConnection) -> int:
+        """
+        Run the script with arguments, environment and stdio received from the client
+        """
+        request = connection.receive()
+        if request is None or len(connection.fds) != len(DAEMON_STDIO_FDS):
+            return 1
+        fds, connection.fds = connection.fds, []
+        connection.send({'pid': os.getpid()})
+        try:
+            self.__setup_process__(request, fds)
+            self.__script__.__reset_run_state__()
+            self.__script__.run()
+            exit_code = 0
+        except SystemExit as error:
+            exit_code = get_exit_code(error.code)
+        except BaseException:  # pylint: disable=broad-exception-caught
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            self.__script__.flush_output()
+            for stream in (sys.stdout, sys.stderr):
+                try:
+                    stream.flush()
+                except (OSError, ValueError):
+                    pass
+        try:
+            connection.send({'exit_code': exit_code})
+        except OSError:
+            pass
+        return exit_code
+
+
+def run_script(script: str, path: Optional[str] = None) -> None:
+    """
+    Run script given as module:Class in a daemon listening on path, or in process if no
+    daemon is running, and exit with exit code of the run
+
+    Use this in entry points of scripts run with daemon mode, so the script module is
+    not imported when the daemon runs the script.
+    """
+    exit_code = DaemonClient(path if path is not None else get_daemon_socket_path(script)).run()
+    if exit_code is not None:
+        sys.exit(exit_code)
+    load_script_class(script)().run()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse arguments for the daemon command
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m cli_toolkit.daemon',
+        description='Run cli-toolkit script in daemon mode',
+    )
+    parser.add_argument('--socket', metavar='PATH', help='Socket path of the daemon')
+    parser.add_argument('--name', help='Script name, by default last component of the script module')
+    parser.add_argument(
+        '--reload-interval',
+        metavar='SECONDS',
+        type=float,
+        default=DEFAULT_DAEMON_RELOAD_INTERVAL,
+        help=f'Interval to check for changed code (default {DEFAULT_DAEMON_RELOAD_INTERVAL:g})'
+    )
+    parser.add_argument('script', help='Script class as module:Class')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Run daemon for script given on command line
+    """
+    args = parse_args(argv)
+    name = args.name if args.name else args.script.split(':', 1)[0].rsplit('.', 1)[-1]
+    daemon = ScriptDaemon(
+        args.script,
+        path=args.socket,
+        name=name,
+        reload_interval=args.reload_interval,
+        restart_command=[sys.executable, '-m', 'cli_toolkit.daemon'] + (argv if argv is not None else sys.argv[1:]),
+    )
+    try:
+        daemon.serve()
+    except ScriptError as error:
+        sys.stderr.write(f'{error}\n')
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,3 +12,9 @@ class ScriptError(Exception):
     """
     Errors raise during script processing
     """
+
+
+class TaskError(ScriptError):
+    """
+    Errors raised by script tasks
+    """
@@ -0,0 +1,174 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Event loop lag monitor for script tasks
+
+The monitor measures how late a periodic timer on the event loop wakes up. A
+watchdog thread detects when the loop has not woken up in time and records the
+asyncio task and code location blocking the loop, so callbacks blocking the loop
+can be attributed to a task without running the loop in debug mode.
+"""
+import asyncio
+import math
+import sys
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_LAG_PERCENTILES = (50, 90, 99)
+
+
+class SlowCallback:
+    """
+    Event loop lag exceeding the monitor threshold
+    """
+    lag: float
+    task: Optional[str]
+    location: Optional[str]
+
+    def __init__(self, lag: float, task: Optional[str] = None, location: Optional[str] = None) -> None:
+        self.lag = lag
+        self.task = task
+        self.location = location
+
+    def __repr__(self) -> str:
+        """
+        Return lag with blocking task and location when known
+        """
+        if self.task is None:
+            return f'event loop lag {self.lag:.3f}s'
+        return f'event loop blocked for {self.lag:.3f}s by task {self.task} at {self.location}'
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Return slow callback as dictionary
+        """
+        return {
+            'lag': self.lag,
+            'task': self.task,
+            'location': self.location,
+        }
+
+
+class EventLoopMonitor:
+    """
+    Monitor for event loop lag and callbacks blocking the event loop
+
+    Lag is sampled every interval seconds. Lag exceeding threshold seconds is
+    recorded to slow_callbacks and passed to the callback function if given.
+    """
+    interval: float
+    threshold: float
+    lags: List[float]
+    slow_callbacks: List[SlowCallback]
+
+    def __init__(self,
+                 interval: float = 0.1,
+                 threshold: float = 0.1,
+                 callback: Optional[Callable[[SlowCallback], None]] = None) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = []
+        self.slow_callbacks = []
+        self.__callback__ = callback
+        self.__loop__: Optional[asyncio.AbstractEventLoop] = None
+        self.__thread_id__: Optional[int] = None
+        self.__heartbeat__: Optional[float] = None
+        self.__blocking__: Optional[Tuple[Optional[str], str]] = None
+        self.__monitor_task__: Optional[asyncio.Task] = None
+        self.__watchdog__: Optional[threading.Thread] = None
+        self.__stop_event__ = threading.Event()
+
+    def start(self) -> None:
+        """
+        Start monitoring the running event loop
+        """
+        self.__loop__ = asyncio.get_running_loop()
+        self.__thread_id__ = threading.get_ident()
+        self.__heartbeat__ = time.monotonic()
+        self.__stop_event__.clear()
+        self.__monitor_task__ = asyncio.create_task(self.__measure__(), name='event loop monitor')
+        self.__watchdog__ = threading.Thread(target=self.__watch__, name='event-loop-watchdog', daemon=True)
+        self.__watchdog__.start()
+
+    async def stop(self) -> None:
+        """
+        Stop monitoring
+
+        Lag of a wakeup already missed when stopping is recorded as the last sample
+        """
+        self.__stop_event__.set()
+        if self.__monitor_task__ is not None:
+            lag = time.monotonic() - self.__heartbeat__ - self.interval
+            if lag > 0:
+                self.__record_lag__(lag)
+            self.__monitor_task__.cancel()
+            await asyncio.gather(self.__monitor_task__, return_exceptions=True)
+            self.__monitor_task__ = None
+        if self.__watchdog__ is not None:
+            self.__watchdog__.join()
+            self.__watchdog__ = None
+
+    async def __measure__(self) -> None:
+        """
+        Sample event loop lag until cancelled
+        """
+        while True:
+            self.__heartbeat__ = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.__record_lag__(max(0.0, time.monotonic() - self.__heartbeat__ - self.interval))
+
+    def __record_lag__(self, lag: float) -> None:
+        """
+        Record lag sample, reporting lag exceeding threshold as slow callback
+        """
+        blocking, self.__blocking__ = self.__blocking__, None
+        self.lags.append(lag)
+        if lag >= self.threshold:
+            task, location = blocking if blocking is not None else (None, None)
+            slow_callback = SlowCallback(lag, task, location)
+            self.slow_callbacks.append(slow_callback)
+            if self.__callback__ is not None:
+                self.__callback__(slow_callback)
+
+    def __get_blocking_location__(self) -> str:
+        """
+        Return code location the event loop thread is running
+        """
+        # pylint: disable=protected-access
+        frame = sys._current_frames().get(self.__thread_id__, None)
+        if frame is None:
+            return 'unknown location'
+        return f'{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}'
+
+    def __watch__(self) -> None:
+        """
+        Record task and location blocking the event loop when loop misses the wakeup
+        """
+        poll_interval = min(self.interval, self.threshold) / 2
+        while not self.__stop_event__.wait(poll_interval):
+            if self.__blocking__ is not None:
+                continue
+            if time.monotonic() - self.__heartbeat__ - self.interval < self.threshold:
+                continue
+            task = asyncio.current_task(self.__loop__)
+            location = self.__get_blocking_location__()
+            self.__blocking__ = (task.get_name() if task is not None else None, location)
+
+    def get_percentiles(self, percentiles: Tuple[int] = DEFAULT_LAG_PERCENTILES) -> Dict[str, float]:
+        """
+        Return lag percentiles and maximum lag in seconds with nearest rank method
+        """
+        if not self.lags:
+            return {}
+        lags = sorted(self.lags)
+        values = {}
+        for percentile in percentiles:
+            index = max(0, math.ceil(percentile / 100 * len(lags)) - 1)
+            values[f'p{percentile}'] = lags[index]
+        values['max'] = lags[-1]
+        return values
@@ -0,0 +1,331 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Metrics registry for scripts and commands
+
+The registry holds counters, gauges and histograms. Metrics are shared by the
+script and all of its commands and tasks. When the registry is disabled, metric
+updates only check the enabled flag and timers do not read the clock.
+"""
+import asyncio
+import functools
+import json
+import math
+import re
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .exceptions import ScriptError
+
+DEFAULT_HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_NAME_PATTERN = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+
+
+class Metric:
+    """
+    Common base class for metrics
+    """
+    metric_type: str = ''
+    name: str
+    description: str
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, description: str = '') -> None:
+        self.__registry__ = registry
+        self.name = name
+        self.description = description
+
+    def __repr__(self) -> str:
+        """
+        Return metric type and name
+        """
+        return f'{self.metric_type} {self.name}'
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Check if the registry of the metric is enabled
+        """
+        return self.__registry__.enabled
+
+    def as_dict(self) -> Any:
+        """
+        Return metric value for JSON output. This must be implemented in child class
+        """
+        raise NotImplementedError('Metric as_dict() must be implemented in child class')
+
+
+class Counter(Metric):
+    """
+    Counter for values that only increase, like items processed or bytes read
+    """
+    metric_type = 'counter'
+    value: float
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, description: str = '') -> None:
+        super().__init__(registry, name, description)
+        self.value = 0
+
+    def inc(self, value: float = 1) -> None:
+        """
+        Increment counter by value
+        """
+        if self.enabled:
+            if value < 0:
+                raise ScriptError(f'Counter {self.name} can not be decremented')
+            self.value += value
+
+    def as_dict(self) -> float:
+        """
+        Return counter value
+        """
+        return self.value
+
+
+class Gauge(Metric):
+    """
+    Gauge for values that can go up and down, like queue length
+    """
+    metric_type = 'gauge'
+    value: float
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, description: str = '') -> None:
+        super().__init__(registry, name, description)
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        """
+        Set gauge value
+        """
+        if self.enabled:
+            self.value = value
+
+    def inc(self, value: float = 1) -> None:
+        """
+        Increment gauge by value
+        """
+        if self.enabled:
+            self.value += value
+
+    def dec(self, value: float = 1) -> None:
+        """
+        Decrement gauge by value
+        """
+        if self.enabled:
+            self.value -= value
+
+    def as_dict(self) -> float:
+        """
+        Return gauge value
+        """
+        return self.value
+
+
+class Timer:
+    """
+    Context manager and decorator recording elapsed seconds to a histogram
+
+    Decorated coroutine functions are timed until the coroutine returns.
+    """
+    histogram: 'Histogram'
+
+    def __init__(self, histogram: 'Histogram') -> None:
+        self.histogram = histogram
+        self.__start__: Optional[float] = None
+
+    def __enter__(self) -> 'Timer':
+        if self.histogram.enabled:
+            self.__start__ = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: List[Any]) -> None:
+        if self.__start__ is not None:
+            self.histogram.observe(time.perf_counter() - self.__start__)
+            self.__start__ = None
+
+    def __call__(self, func: Callable) -> Callable:
+        """
+        Decorate function to record duration of each call
+        """
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: List[Any], **kwargs: Dict[Any, Any]) -> Any:
+                with Timer(self.histogram):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: List[Any], **kwargs: Dict[Any, Any]) -> Any:
+            with Timer(self.histogram):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class Histogram(Metric):
+    """
+    Histogram of observed values, like durations in seconds
+
+    Bucket counts are cumulative: each bucket counts observations less than or
+    equal to the bucket upper bound.
+    """
+    metric_type = 'histogram'
+    buckets: Tuple[float]
+    bucket_counts: List[int]
+    count: int
+    sum: float
+    min: Optional[float]
+    max: Optional[float]
+
+    def __init__(self,
+                 registry: 'MetricsRegistry',
+                 name: str,
+                 description: str = '',
+                 buckets: Tuple[float] = DEFAULT_HISTOGRAM_BUCKETS) -> None:
+        super().__init__(registry, name, description)
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        """
+        Record an observed value
+        """
+        if not self.enabled:
+            return
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+
+    def time(self) -> Timer:
+        """
+        Return timer recording elapsed seconds to the histogram
+        """
+        return Timer(self)
+
+    @property
+    def mean(self) -> Optional[float]:
+        """
+        Return mean of observed values
+        """
+        return self.sum / self.count if self.count else None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Return histogram statistics and cumulative bucket counts
+        """
+        buckets = {str(bound): count for bound, count in zip(self.buckets, self.bucket_counts)}
+        buckets[str(math.inf)] = self.count
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'buckets': buckets,
+        }
+
+
+class MetricsRegistry:
+    """
+    Registry of named metrics
+
+    Metrics are created on first lookup and returned by name afterwards. Looking
+    up an existing name as a different metric type raises ScriptError.
+    """
+    enabled: bool
+    metrics: Dict[str, Metric]
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.metrics = {}
+
+    def __get_metric__(self, metric_class: type, name: str, **kwargs: Dict[str, Any]) -> Metric:
+        """
+        Return existing metric by name or create new metric
+        """
+        metric = self.metrics.get(name, None)
+        if metric is None:
+            if not METRIC_NAME_PATTERN.match(name):
+                raise ScriptError(f'Invalid metric name: {name}')
+            metric = metric_class(self, name, **kwargs)
+            self.metrics[name] = metric
+        elif not isinstance(metric, metric_class):
+            raise ScriptError(f'Metric {name} is already registered as {metric.metric_type}')
+        return metric
+
+    def counter(self, name: str, description: str = '') -> Counter:
+        """
+        Return counter with name
+        """
+        return self.__get_metric__(Counter, name, description=description)
+
+    def gauge(self, name: str, description: str = '') -> Gauge:
+        """
+        Return gauge with name
+        """
+        return self.__get_metric__(Gauge, name, description=description)
+
+    def histogram(self,
+                  name: str,
+                  description: str = '',
+                  buckets: Tuple[float] = DEFAULT_HISTOGRAM_BUCKETS) -> Histogram:
+        """
+        Return histogram with name
+        """
+        return self.__get_metric__(Histogram, name, description=description, buckets=buckets)
+
+    def timer(self, name: str, description: str = '') -> Timer:
+        """
+        Return timer recording elapsed seconds to histogram with name
+
+        The timer can be used as context manager or function decorator.
+        """
+        return self.histogram(name, description).time()
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Return metric values grouped by metric type
+        """
+        data = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        for name, metric in sorted(self.metrics.items()):
+            data[f'{metric.metric_type}s'][name] = metric.as_dict()
+        return data
+
+    def get_lines(self) -> List[str]:
+        """
+        Return metric values as lines of text
+        """
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            if isinstance(metric, Histogram):
+                if metric.count:
+                    lines.append(
+                        f'{metric.metric_type} {name} count {metric.count} sum {metric.sum:.6g} '
+                        f'min {metric.min:.6g} mean {metric.mean:.6g} max {metric.max:.6g}'
+                    )
+                else:
+                    lines.append(f'{metric.metric_type} {name} count 0')
+            else:
+                lines.append(f'{metric.metric_type} {name} {metric.value:g}')
+        return lines
+
+    def write(self, path: str) -> None:
+        """
+        Write metric values to JSON file
+        """
+        try:
+            with open(path, 'w', encoding='utf-8') as filedescriptor:
+                json.dump(self.as_dict(), filedescriptor, indent=2)
+        except OSError as error:
+            raise ScriptError(f'Error writing metrics file {path}: {error}') from error
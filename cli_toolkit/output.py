@@ -0,0 +1,498 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Buffered console output for scripts
+
+Script messages and errors are collected to buffers and written to stdout and
+stderr in batches, reducing write calls when commands print many lines. Buffers
+are flushed when they grow over the buffer size, periodically by a flusher thread
+and when the script exits. Streams connected to a terminal are line buffered.
+
+Output of command line tasks can be passed as raw chunks to a writer thread, which
+decodes the chunks to lines and writes them outside of the event loop thread.
+
+Output of concurrently running tasks can be grouped by task, buffering the output
+of each task and writing it when the task finishes.
+
+Output of scripts invoked from other programs is written to the streams of the
+invocation running in the current thread or asyncio task.
+"""
+import asyncio
+import atexit
+import codecs
+import contextvars
+import json
+import locale
+import queue
+import sys
+import tempfile
+import threading
+import time
+import weakref
+
+from typing import Any, Dict, IO, Iterator, List, Optional, TextIO, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .base import Base
+    from .task import BaseScriptTask
+
+DEFAULT_OUTPUT_BUFFER_SIZE = 65536
+DEFAULT_OUTPUT_FLUSH_INTERVAL = 0.1
+DEFAULT_TASK_OUTPUT_QUEUE_SIZE = 256
+DEFAULT_TASK_OUTPUT_SPOOL_SIZE = 1048576
+
+TASK_OUTPUT_STDOUT = 'stdout'
+TASK_OUTPUT_STDERR = 'stderr'
+
+TASK_OUTPUT_MODE_UNGROUPED = 'ungrouped'
+TASK_OUTPUT_MODE_GROUP = 'group'
+TASK_OUTPUT_MODE_KEEP_ORDER = 'keep-order'
+TASK_OUTPUT_MODES = (
+    TASK_OUTPUT_MODE_UNGROUPED,
+    TASK_OUTPUT_MODE_GROUP,
+    TASK_OUTPUT_MODE_KEEP_ORDER,
+)
+
+
+# Output streams of the invocation running in the current thread or asyncio task
+INVOCATION_STREAMS: contextvars.ContextVar = contextvars.ContextVar('invocation_streams', default=None)
+
+
+class InvocationStream:
+    """
+    Replacement for sys.stdout or sys.stderr used while scripts are invoked
+
+    Output is written to the stream of the invocation running in the current thread or
+    asyncio task, or to the replaced stream outside invocations.
+    """
+    def __init__(self, name: str, stream: TextIO) -> None:
+        self.__stream_name__ = name
+        self.__stream__ = stream
+
+    @classmethod
+    def install(cls) -> None:
+        """
+        Replace sys.stdout and sys.stderr with invocation streams, unless already replaced
+        """
+        for name in ('stdout', 'stderr'):
+            if not isinstance(getattr(sys, name), cls):
+                setattr(sys, name, cls(name, getattr(sys, name)))
+
+    @property
+    def __target__(self) -> TextIO:
+        """
+        Return the stream written to in the current context
+        """
+        streams = INVOCATION_STREAMS.get()
+        if streams is None:
+            return self.__stream__
+        return streams[self.__stream_name__]
+
+    def __getattr__(self, attr: str) -> Any:
+        """
+        Pass attributes and methods of the stream written to in the current context
+        """
+        return getattr(self.__target__, attr)
+
+
+class BufferedStreamWriter:
+    """
+    Buffered writer for sys.stdout or sys.stderr
+
+    The stream is looked up from sys module by name when flushing, so replaced
+    streams are written to.
+    """
+    name: str
+    buffer_size: int
+    flush_interval: float
+    line_buffered: bool
+
+    def __init__(self,
+                 name: str,
+                 buffer_size: int = DEFAULT_OUTPUT_BUFFER_SIZE,
+                 flush_interval: float = DEFAULT_OUTPUT_FLUSH_INTERVAL,
+                 line_buffered: Optional[bool] = None) -> None:
+        self.name = name
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.line_buffered = line_buffered if line_buffered is not None else self.__is_terminal__()
+        self.__lock__ = threading.RLock()
+        self.__buffer__: List[str] = []
+        self.__size__ = 0
+        self.__flusher__: Optional[threading.Thread] = None
+
+    @property
+    def stream(self) -> TextIO:
+        """
+        Return the output stream
+        """
+        return getattr(sys, self.name)
+
+    def __is_terminal__(self) -> bool:
+        """
+        Check if the output stream is connected to a terminal
+        """
+        try:
+            return self.stream.isatty()
+        except (AttributeError, OSError, ValueError):
+            return False
+
+    def write(self, text: str) -> None:
+        """
+        Add text to the buffer, flushing the buffer when it is full or line buffered
+        """
+        with self.__lock__:
+            self.__buffer__.append(text)
+            self.__size__ += len(text)
+            if self.line_buffered or self.__size__ >= self.buffer_size:
+                self.flush()
+                return
+            if self.__flusher__ is None:
+                self.__flusher__ = threading.Thread(
+                    target=self.__flush_periodically__,
+                    name=f'{self.name}-flusher',
+                    daemon=True,
+                )
+                self.__flusher__.start()
+
+    def flush(self) -> None:
+        """
+        Write buffered text to the output stream
+        """
+        with self.__lock__:
+            if not self.__buffer__:
+                return
+            data = ''.join(self.__buffer__)
+            self.__buffer__ = []
+            self.__size__ = 0
+            stream = self.stream
+            stream.write(data)
+            stream.flush()
+
+    def __flush_periodically__(self) -> None:
+        """
+        Flush the buffer every flush_interval seconds until nothing was written
+        """
+        while True:
+            time.sleep(self.flush_interval)
+            with self.__lock__:
+                if not self.__buffer__:
+                    self.__flusher__ = None
+                    return
+                try:
+                    self.flush()
+                except (OSError, ValueError):
+                    pass
+
+
+# pylint: disable=too-few-public-methods
+class ConsoleWriter:
+    """
+    Buffered writers for stdout and stderr of a script
+    """
+    stdout: BufferedStreamWriter
+    stderr: BufferedStreamWriter
+
+    def __init__(self,
+                 buffer_size: int = DEFAULT_OUTPUT_BUFFER_SIZE,
+                 flush_interval: float = DEFAULT_OUTPUT_FLUSH_INTERVAL) -> None:
+        self.stdout = BufferedStreamWriter('stdout', buffer_size, flush_interval)
+        self.stderr = BufferedStreamWriter('stderr', buffer_size, flush_interval)
+        CONSOLE_WRITERS.add(self)
+
+    def flush(self) -> None:
+        """
+        Flush stdout and stderr buffers
+        """
+        self.stdout.flush()
+        self.stderr.flush()
+
+
+class TaskOutputWriter:
+    """
+    Writer thread for output of command line tasks
+
+    Tasks queue raw output chunks with write() from the event loop. The writer thread
+    decodes the chunks, splits them to lines, adds the lines to task messages and
+    errors and writes them with task message() and error().
+
+    The number of queued chunks is limited to queue_size. When the queue is full,
+    write() waits for the writer thread, so tasks producing output faster than it
+    can be written stop reading the output of their processes.
+    """
+    queue_size: int
+    encoding: str
+
+    def __init__(self,
+                 queue_size: int = DEFAULT_TASK_OUTPUT_QUEUE_SIZE,
+                 encoding: Optional[str] = None) -> None:
+        self.queue_size = queue_size
+        self.encoding = encoding if encoding is not None else locale.getpreferredencoding(False)
+        self.__queue__: queue.Queue = queue.Queue()
+        self.__loop__: Optional[asyncio.AbstractEventLoop] = None
+        self.__queue_slots__: Optional[asyncio.Semaphore] = None
+        self.__thread__: Optional[threading.Thread] = None
+        self.__decoders__: Dict[Tuple[int, str], codecs.IncrementalDecoder] = {}
+        self.__partial_lines__: Dict[Tuple[int, str], str] = {}
+
+    @property
+    def queued(self) -> int:
+        """
+        Return number of chunks waiting in the queue
+        """
+        return self.__queue__.qsize()
+
+    def start(self) -> None:
+        """
+        Start the writer thread for tasks running in the current event loop
+        """
+        self.__loop__ = asyncio.get_running_loop()
+        self.__queue_slots__ = asyncio.Semaphore(self.queue_size)
+        # Write in the context of the caller, so output of invoked scripts goes to the invocation streams
+        self.__thread__ = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self.__write_chunks__,),
+            name='task-output-writer',
+            daemon=True,
+        )
+        self.__thread__.start()
+
+    async def stop(self) -> None:
+        """
+        Write queued chunks and stop the writer thread
+        """
+        if self.__thread__ is None:
+            return
+        self.__queue__.put(None)
+        await self.__loop__.run_in_executor(None, self.__thread__.join)
+        self.__thread__ = None
+
+    async def write(self, task: 'BaseScriptTask', stream: str, chunk: bytes) -> None:
+        """
+        Queue output chunk of task stream, waiting while the queue is full
+        """
+        await self.__queue_slots__.acquire()
+        self.__queue__.put((task, stream, chunk, None))
+
+    async def close(self, task: 'BaseScriptTask', stream: str) -> None:
+        """
+        Write remaining output of task stream and wait until it has been written
+        """
+        done = self.__loop__.create_future()
+        await self.__queue_slots__.acquire()
+        self.__queue__.put((task, stream, None, done))
+        await done
+
+    def __set_done__(self, done: Optional[asyncio.Future]) -> None:
+        """
+        Release queue slot of processed chunk and mark closed stream done
+        """
+        self.__queue_slots__.release()
+        if done is not None and not done.done():
+            done.set_result(None)
+
+    def __decode__(self, task: 'BaseScriptTask', stream: str, chunk: Optional[bytes]) -> List[str]:
+        """
+        Decode chunk of task stream and return completed lines
+
+        Chunk None ends the stream and returns the incomplete last line
+        """
+        key = (id(task), stream)
+        decoder = self.__decoders__.get(key, None)
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+            self.__decoders__[key] = decoder
+        text = self.__partial_lines__.pop(key, '')
+        if chunk is None:
+            text += decoder.decode(b'', final=True)
+            del self.__decoders__[key]
+            return [text] if text else []
+        lines = (text + decoder.decode(chunk)).split('\n')
+        if lines[-1]:
+            self.__partial_lines__[key] = lines[-1]
+        return lines[:-1]
+
+    def __write_lines__(self, task: 'BaseScriptTask', stream: str, lines: List[str]) -> None:
+        """
+        Add lines to task messages or errors and write them with task message() or error()
+        """
+        for line in lines:
+            line = line.rstrip()
+            if stream == TASK_OUTPUT_STDERR:
+                task.errors.append(line)
+                task.error(line)
+            else:
+                task.messages.append(line)
+                task.message(line)
+
+    def __write_chunks__(self) -> None:
+        """
+        Decode and write queued chunks until stopped
+        """
+        while True:
+            item = self.__queue__.get()
+            if item is None:
+                return
+            task, stream, chunk, done = item
+            try:
+                self.__write_lines__(task, stream, self.__decode__(task, stream, chunk))
+            except (OSError, ValueError):
+                pass
+            finally:
+                try:
+                    self.__loop__.call_soon_threadsafe(self.__set_done__, done)
+                except RuntimeError:
+                    pass
+
+
+class TaskOutputBuffer:
+    """
+    Output of a task buffered until the task finishes
+
+    Output is kept in memory until it grows over spool_size characters, after which
+    the output is moved to a temporary file.
+    """
+    spool_size: int
+    size: int
+
+    def __init__(self, spool_size: int = DEFAULT_TASK_OUTPUT_SPOOL_SIZE) -> None:
+        self.spool_size = spool_size
+        self.size = 0
+        self.__lock__ = threading.Lock()
+        self.__records__: List[Tuple[str, str]] = []
+        self.__file__: Optional[IO[str]] = None
+
+    @property
+    def spilled(self) -> bool:
+        """
+        Check if buffered output has been moved to a temporary file
+        """
+        return self.__file__ is not None
+
+    def write(self, stream: str, text: str) -> None:
+        """
+        Buffer text written to stdout or stderr stream
+        """
+        with self.__lock__:
+            self.size += len(text)
+            if self.__file__ is not None:
+                self.__file__.write(f'{json.dumps([stream, text])}\n')
+                return
+            self.__records__.append((stream, text))
+            if self.size > self.spool_size:
+                # pylint: disable=consider-using-with
+                self.__file__ = tempfile.TemporaryFile('w+', encoding='utf-8', prefix='cli-task-output-')
+                for record in self.__records__:
+                    self.__file__.write(f'{json.dumps(record)}\n')
+                self.__records__ = []
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        """
+        Iterate buffered output as stream and text tuples
+        """
+        yield from self.__records__
+        if self.__file__ is not None:
+            self.__file__.seek(0)
+            for line in self.__file__:
+                stream, text = json.loads(line)
+                yield stream, text
+
+    def close(self) -> None:
+        """
+        Discard buffered output and remove the temporary file
+        """
+        with self.__lock__:
+            self.__records__ = []
+            if self.__file__ is not None:
+                self.__file__.close()
+                self.__file__ = None
+
+
+class TaskOutputCollector:
+    """
+    Collector of grouped task output
+
+    Output of each task is buffered and written with message() and error() of the
+    target when the task finishes, without lines from other tasks in between. With
+    keep_order the output is written in order the tasks were added, holding output
+    of finished tasks until output of all earlier tasks has been written.
+    """
+    target: 'Base'
+    keep_order: bool
+    spool_size: int
+
+    def __init__(self,
+                 target: 'Base',
+                 keep_order: bool = False,
+                 spool_size: int = DEFAULT_TASK_OUTPUT_SPOOL_SIZE) -> None:
+        self.target = target
+        self.keep_order = keep_order
+        self.spool_size = spool_size
+        self.__tasks__: List['BaseScriptTask'] = []
+        self.__task_indexes__: Dict[int, int] = {}
+        self.__finished__: Dict[int, 'BaseScriptTask'] = {}
+        self.__next_index__ = 0
+
+    def add(self, task: 'BaseScriptTask') -> TaskOutputBuffer:
+        """
+        Add task and start buffering its output
+        """
+        self.__task_indexes__[id(task)] = len(self.__tasks__)
+        self.__tasks__.append(task)
+        task.__output_buffer__ = TaskOutputBuffer(self.spool_size)
+        return task.__output_buffer__
+
+    def __emit__(self, task: 'BaseScriptTask') -> None:
+        """
+        Write buffered output of task to target and stop buffering task output
+        """
+        buffer, task.__output_buffer__ = task.__output_buffer__, None
+        if buffer is None:
+            return
+        try:
+            for stream, text in buffer:
+                if stream == TASK_OUTPUT_STDERR:
+                    self.target.error(text)
+                else:
+                    self.target.message(text)
+        finally:
+            buffer.close()
+
+    def finish(self, task: 'BaseScriptTask') -> None:
+        """
+        Mark task finished and write output of tasks ready to be written
+        """
+        if not self.keep_order:
+            self.__emit__(task)
+            return
+        self.__finished__[self.__task_indexes__[id(task)]] = task
+        while self.__next_index__ in self.__finished__:
+            self.__emit__(self.__finished__.pop(self.__next_index__))
+            self.__next_index__ += 1
+
+    def flush(self) -> None:
+        """
+        Write buffered output of all remaining tasks in order the tasks were added
+        """
+        for task in self.__tasks__[self.__next_index__:]:
+            self.__emit__(task)
+        self.__finished__ = {}
+        self.__next_index__ = len(self.__tasks__)
+
+
+CONSOLE_WRITERS = weakref.WeakSet()
+
+
+@atexit.register
+def flush_console_writers() -> None:
+    """
+    Flush buffered output of all console writers when python exits
+    """
+    for writer in list(CONSOLE_WRITERS):
+        try:
+            writer.flush()
+        except (OSError, ValueError):
+            pass
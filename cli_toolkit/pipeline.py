@@ -0,0 +1,352 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Producer and consumer pipelines of script tasks
+
+Pipeline stages are script tasks connected with bounded queues. The source stage
+produces items, and each following stage processes items received from the previous
+stage with its own number of concurrent workers. Stages are run by the script or
+command like any other tasks.
+"""
+import asyncio
+import re
+import time
+
+from typing import Any, AsyncIterator, Dict, List, Optional, TYPE_CHECKING
+
+from .exceptions import ScriptError
+from .task import Task
+
+if TYPE_CHECKING:
+    from .base import NestedCliCommand
+    from .scheduler import TaskScheduler
+
+DEFAULT_PIPELINE_QUEUE_SIZE = 100
+
+
+# pylint: disable=too-few-public-methods
+class EndOfStream:
+    """
+    Marker passed through pipeline queues after the last item
+    """
+    def __repr__(self) -> str:
+        """
+        Return marker name
+        """
+        return 'end of stream'
+
+
+END_OF_STREAM = EndOfStream()
+
+
+class BasePipelineStage(Task):
+    """
+    Common base class for pipeline stages
+
+    Items are sent to the next stage with put(). When a stage has finished, the end
+    of stream is passed to the next stage.
+
+    Received and sent items are counted in items_received and items_sent and in
+    pipeline_<stage>_received_total and pipeline_<stage>_sent_total metrics.
+    """
+    items_received: int
+    items_sent: int
+    run_time: float
+    pipeline: Optional['Pipeline']
+
+    def __init__(self, parent: 'NestedCliCommand', **kwargs: Dict[Any, Any]) -> None:
+        super().__init__(parent, **kwargs)
+        self.items_received = 0
+        self.items_sent = 0
+        self.run_time = 0.0
+        self.pipeline = None
+        self.__input__: Optional[asyncio.Queue] = None
+        self.__output__: Optional[asyncio.Queue] = None
+        self.__task__: Optional[asyncio.Task] = None
+
+    @property
+    def metric_name(self) -> str:
+        """
+        Return prefix for names of stage metrics
+        """
+        name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', repr(self))
+        return f'pipeline_{re.sub(r"[^a-zA-Z0-9_]+", "_", name).lower()}'
+
+    @property
+    def running(self) -> bool:
+        """
+        Check if the stage task is running
+        """
+        return self.__task__ is not None and not self.__task__.done()
+
+    def __connect__(self, output_stage: Optional['PipelineStage']) -> None:
+        """
+        Create input queue of the next stage and use it as output of this stage
+        """
+        if output_stage is not None:
+            output_stage.__input__ = asyncio.Queue(output_stage.queue_size)
+            self.__output__ = output_stage.__input__
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Return task status with numbers of received and sent items and throughput
+        """
+        stats = super().get_stats()
+        stats['items_received'] = self.items_received
+        stats['items_sent'] = self.items_sent
+        items = self.items_received if self.__input__ is not None else self.items_sent
+        stats['items_per_second'] = items / self.run_time if self.run_time > 0 else None
+        return stats
+
+    async def __acquire_slot__(self, scheduler: 'TaskScheduler', sort_key: Any) -> None:
+        """
+        Wait for the concurrency slots reserved for all stages of the pipeline
+        """
+        if self.pipeline is None:
+            return await super().__acquire_slot__(scheduler, sort_key)
+        return await self.pipeline.__acquire_slots__(scheduler, sort_key)
+
+    def __release_slot__(self, scheduler: 'TaskScheduler') -> None:
+        """
+        Release the concurrency slots of the pipeline after the last stage has finished
+        """
+        if self.pipeline is None:
+            return super().__release_slot__(scheduler)
+        return self.pipeline.__release_slots__(scheduler)
+
+    async def put(self, item: Any) -> None:
+        """
+        Send item to the next stage, waiting while the queue of the next stage is full
+        """
+        if self.__output__ is not None:
+            await self.__output__.put(item)
+        self.items_sent += 1
+        self.parent.metrics.counter(f'{self.metric_name}_sent_total', f'Items sent by {self}').inc()
+
+    async def __run_stage__(self) -> None:
+        """
+        Send items to the next stage. This must be implemented in child class
+        """
+        raise NotImplementedError('Pipeline __run_stage__() must be implemented in child class')
+
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run pipeline stage until end of stream
+
+        If the stage fails or is cancelled, other running stages of the pipeline are cancelled
+        """
+        if self.pipeline is None:
+            raise ScriptError(f'Pipeline stage {self} is not linked to a pipeline')
+        self.pipeline.__start__()
+        if self.pipeline.cancelled:
+            raise asyncio.CancelledError()
+        self.__task__ = asyncio.current_task()
+        start = time.monotonic()
+        finished = False
+        try:
+            await self.__run_stage__()
+            if self.__output__ is not None:
+                await self.__output__.put(END_OF_STREAM)
+            finished = True
+        finally:
+            self.run_time += time.monotonic() - start
+            if not finished:
+                self.pipeline.cancel(self)
+
+
+class PipelineSource(BasePipelineStage):
+    """
+    Source stage of a task pipeline
+
+    The source stage implements produce() to yield items sent to the next stage.
+    """
+    async def produce(self) -> AsyncIterator[Any]:
+        """
+        Yield items to the pipeline. This must be implemented in child class
+        """
+        raise NotImplementedError('PipelineSource produce() must be implemented in child class')
+        # pylint: disable=unreachable
+        yield None
+
+    async def __run_stage__(self) -> None:
+        """
+        Send items yielded by produce() to the next stage
+        """
+        async for item in self.produce():
+            await self.put(item)
+
+
+class PipelineStage(BasePipelineStage):
+    """
+    Processing stage of a task pipeline
+
+    The stage implements process() to handle items received from the previous stage
+    in concurrency workers. Items returned by process() are sent to the next stage,
+    unless the value is None. Additional items can be sent with put(). Processing
+    times are recorded to pipeline_<stage>_process_seconds metric.
+
+    Items are received from a queue holding at most queue_size items, so faster
+    stages wait for slower stages to catch up.
+    """
+    concurrency: int = 1
+    queue_size: int = DEFAULT_PIPELINE_QUEUE_SIZE
+
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 parent: 'NestedCliCommand',
+                 concurrency: Optional[int] = None,
+                 queue_size: Optional[int] = None,
+                 **kwargs: Dict[Any, Any]) -> None:
+        super().__init__(parent, **kwargs)
+        if concurrency is not None:
+            self.concurrency = concurrency
+        if queue_size is not None:
+            self.queue_size = queue_size
+        if self.concurrency < 1:
+            raise ScriptError(f'Invalid pipeline stage {self} concurrency: {self.concurrency}')
+
+    async def process(self, item: Any) -> Any:
+        """
+        Process an item received from the previous stage. This must be implemented in child class
+        """
+        raise NotImplementedError('PipelineStage process() must be implemented in child class')
+
+    async def __work__(self) -> None:
+        """
+        Process items from the input queue until end of stream
+        """
+        received = self.parent.metrics.counter(f'{self.metric_name}_received_total', f'Items received by {self}')
+        timer = self.parent.metrics.timer(f'{self.metric_name}_process_seconds', f'Item processing time of {self}')
+        while True:
+            item = await self.__input__.get()
+            if item is END_OF_STREAM:
+                # Pass the marker to other workers of the stage
+                self.__input__.put_nowait(END_OF_STREAM)
+                return
+            self.items_received += 1
+            received.inc()
+            with timer:
+                result = await self.process(item)
+            if result is not None:
+                await self.put(result)
+
+    async def __run_stage__(self) -> None:
+        """
+        Run concurrency workers until end of stream, cancelling other workers when a worker fails
+        """
+        workers = [asyncio.ensure_future(self.__work__()) for _count in range(self.concurrency)]
+        try:
+            done, _pending = await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+            for worker in done:
+                if worker.exception() is not None:
+                    raise worker.exception()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+class Pipeline:
+    """
+    Pipeline of stages connected with bounded queues
+
+    Each stage is a task run by its parent. Concurrency slots of the parent for all
+    stages are reserved at once when the first stage is started and released when
+    all stages have finished, so stages of other pipelines can not take the slots
+    needed by the stages of this pipeline. The parent must allow all stages to run
+    at the same time. Stages are not retried, and failure or cancellation of a stage
+    cancels the other stages of the pipeline.
+    """
+    stages: List[BasePipelineStage]
+    cancelled: bool
+
+    def __init__(self, source: PipelineSource, *stages: PipelineStage) -> None:
+        if not isinstance(source, PipelineSource):
+            raise ScriptError(f'Pipeline must start with a PipelineSource, not {source}')
+        for stage in stages:
+            if not isinstance(stage, PipelineStage):
+                raise ScriptError(f'Pipeline stage {stage} is not a PipelineStage')
+        stages = (source,) + stages
+        for stage in stages:
+            if stage.pipeline is not None:
+                raise ScriptError(f'Pipeline stage {stage} is already linked to a pipeline')
+            if stage.retry_policy is not None:
+                raise ScriptError(f'Pipeline stage {stage} can not have a retry policy')
+            limit = stage.parent.max_concurrent_tasks
+            if limit is not None and limit < len(stages):
+                raise ScriptError(f'Pipeline of {len(stages)} stages can not run with max_concurrent_tasks {limit}')
+            limit = stage.parent.min_concurrent_tasks
+            if stage.parent.adaptive_concurrency and limit < len(stages):
+                raise ScriptError(f'Pipeline of {len(stages)} stages can not run with min_concurrent_tasks {limit}')
+        self.stages = list(stages)
+        self.cancelled = False
+        self.__loop__: Optional[asyncio.AbstractEventLoop] = None
+        self.__reservation__: Optional[asyncio.Future] = None
+        self.__slot_holders__ = 0
+        for stage in self.stages:
+            stage.pipeline = self
+
+    def __repr__(self) -> str:
+        """
+        Return stages of the pipeline
+        """
+        return ' | '.join(repr(stage) for stage in self.stages)
+
+    def __start__(self) -> None:
+        """
+        Connect stages with queues when the first stage is started in an event loop
+        """
+        loop = asyncio.get_running_loop()
+        if self.__loop__ is loop:
+            return
+        self.__loop__ = loop
+        self.cancelled = False
+        for index, stage in enumerate(self.stages):
+            stage.__connect__(self.stages[index + 1] if index + 1 < len(self.stages) else None)
+
+    async def __acquire_slots__(self, scheduler: 'TaskScheduler', sort_key: Any) -> None:
+        """
+        Wait for concurrency slots of all stages, reserved when the first stage is started
+        """
+        if self.__reservation__ is None:
+            self.__reservation__ = asyncio.ensure_future(scheduler.acquire(sort_key, len(self.stages)))
+        self.__slot_holders__ += 1
+        try:
+            await asyncio.shield(self.__reservation__)
+        except asyncio.CancelledError:
+            self.__release_slots__(scheduler)
+            raise
+
+    def __release_slots__(self, scheduler: 'TaskScheduler') -> None:
+        """
+        Release the reserved concurrency slots when no stage is holding them
+        """
+        self.__slot_holders__ -= 1
+        if self.__slot_holders__ > 0:
+            return
+        reservation = self.__reservation__
+        self.__reservation__ = None
+        if not reservation.done():
+            reservation.cancel()
+        elif not reservation.cancelled() and reservation.exception() is None:
+            scheduler.release(len(self.stages))
+
+    def cancel(self, failed_stage: Optional[BasePipelineStage] = None) -> None:
+        """
+        Cancel stages of the pipeline other than the failed stage
+
+        Stages not started yet are cancelled when they are started.
+        """
+        self.cancelled = True
+        for stage in self.stages:
+            if stage is not failed_stage and stage.running:
+                stage.__task__.cancel()
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """
+        Return stats of pipeline stages
+        """
+        return [stage.get_stats() for stage in self.stages]
@@ -0,0 +1,215 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Asynchronous child processes with resource usage accounting
+
+The asyncio child watcher reaps child processes without resource usage details.
+Processes started here are reaped with os.wait4() to get CPU time and maximum
+resident set size of each child process.
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ProcessResourceUsage:
+    """
+    Resource usage of a finished child process
+    """
+    user_time: float
+    system_time: float
+    max_rss: int
+
+    def __init__(self, user_time: float = 0.0, system_time: float = 0.0, max_rss: int = 0) -> None:
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss = max_rss
+
+    def __repr__(self) -> str:
+        """
+        Return resource usage as string
+        """
+        return f'user {self.user_time:.3f}s sys {self.system_time:.3f}s max rss {self.max_rss}'
+
+    @classmethod
+    def from_rusage(cls, rusage: Any) -> 'ProcessResourceUsage':
+        """
+        Create resource usage from os.wait4() rusage result
+
+        ru_maxrss is reported in kilobytes on Linux and in bytes on macOS.
+        """
+        max_rss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+        return cls(rusage.ru_utime, rusage.ru_stime, max_rss)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Return resource usage as dictionary
+        """
+        return {
+            'user_time': self.user_time,
+            'system_time': self.system_time,
+            'max_rss': self.max_rss,
+        }
+
+
+class AsyncProcess:
+    """
+    Child process with asyncio stream readers for stdout and stderr
+
+    The process is reaped with os.wait4() in wait(). Do not use methods of the
+    wrapped subprocess.Popen object that reap the process.
+    """
+    pid: int
+    returncode: Optional[int]
+    resource_usage: Optional[ProcessResourceUsage]
+    stdout: asyncio.StreamReader
+    stderr: asyncio.StreamReader
+
+    def __init__(self, popen: subprocess.Popen) -> None:
+        self.__popen__ = popen
+        self.pid = popen.pid
+        self.returncode = None
+        self.resource_usage = None
+        self.stdout = asyncio.StreamReader()
+        self.stderr = asyncio.StreamReader()
+        self.__wait_future__ = None
+        self.__transports__: List[asyncio.ReadTransport] = []
+
+    def __repr__(self) -> str:
+        """
+        Return process ID and arguments
+        """
+        return f'{self.pid} {self.__popen__.args}'
+
+    @classmethod
+    async def create(cls, *args: str, **kwargs: Dict[str, Any]) -> 'AsyncProcess':
+        """
+        Start process with arguments with stdout and stderr connected to stream readers
+
+        Extra keyword arguments are passed to subprocess.Popen
+        """
+        loop = asyncio.get_running_loop()
+        # pylint: disable=consider-using-with
+        popen = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        process = cls(popen)
+        for reader, pipe in ((process.stdout, popen.stdout), (process.stderr, popen.stderr)):
+            transport, _protocol = await loop.connect_read_pipe(
+                lambda reader=reader: asyncio.StreamReaderProtocol(reader),
+                pipe,
+            )
+            process.__transports__.append(transport)
+        return process
+
+    def close_pipes(self) -> None:
+        """
+        Close stdout and stderr pipes of the process
+
+        Output already read from the pipes can still be read from the stream readers,
+        after which the readers are at EOF. This is useful when child processes of a
+        terminated process keep the pipes open.
+        """
+        for transport in self.__transports__:
+            transport.close()
+
+    def __set_status__(self, result: Tuple[int, int, Any]) -> None:
+        """
+        Set return code and resource usage from os.wait4() result
+        """
+        _pid, status, rusage = result
+        self.returncode = os.waitstatus_to_exitcode(status)
+        self.resource_usage = ProcessResourceUsage.from_rusage(rusage)
+        # Prevent subprocess.Popen from trying to reap the process again
+        self.__popen__.returncode = self.returncode
+
+    async def __wait_pidfd__(self) -> Tuple[int, int, Any]:
+        """
+        Wait for process exit with pidfd, available on Linux
+        """
+        loop = asyncio.get_running_loop()
+        pidfd = os.pidfd_open(self.pid)
+        try:
+            future = loop.create_future()
+            loop.add_reader(pidfd, lambda: future.done() or future.set_result(None))
+            try:
+                await future
+            finally:
+                loop.remove_reader(pidfd)
+            return os.wait4(self.pid, 0)
+        finally:
+            os.close(pidfd)
+
+    async def __wait_thread__(self) -> Tuple[int, int, Any]:
+        """
+        Wait for process exit with a waiter thread
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wait_process() -> None:
+            try:
+                result = os.wait4(self.pid, 0)
+            except OSError as error:
+                loop.call_soon_threadsafe(lambda error=error: future.done() or future.set_exception(error))
+                return
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(result))
+
+        threading.Thread(target=wait_process, name=f'wait4-{self.pid}', daemon=True).start()
+        return await future
+
+    async def __wait__(self) -> None:
+        """
+        Reap the process and set returncode and resource usage
+        """
+        if hasattr(os, 'pidfd_open'):
+            try:
+                result = await self.__wait_pidfd__()
+            except OSError:
+                result = await self.__wait_thread__()
+        else:
+            result = await self.__wait_thread__()
+        self.__set_status__(result)
+
+    async def wait(self) -> int:
+        """
+        Wait for the process to exit and return the return code
+        """
+        if self.returncode is not None:
+            return self.returncode
+        # A waiter cancelled when the event loop was closed is started again
+        if self.__wait_future__ is None or self.__wait_future__.cancelled():
+            self.__wait_future__ = asyncio.ensure_future(self.__wait__())
+        await asyncio.shield(self.__wait_future__)
+        return self.returncode
+
+    def send_signal(self, signum: int, process_group: bool = False) -> None:
+        """
+        Send signal to the process if it has not been reaped
+
+        With process_group the signal is sent to the process group of the process,
+        if the process is a process group leader.
+        """
+        if self.returncode is None:
+            if process_group and os.getpgid(self.pid) == self.pid:
+                os.killpg(self.pid, signum)
+            else:
+                os.kill(self.pid, signum)
+
+    def terminate(self) -> None:
+        """
+        Send SIGTERM to the process
+        """
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        """
+        Send SIGKILL to the process
+        """
+        self.send_signal(signal.SIGKILL)
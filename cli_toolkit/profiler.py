@@ -0,0 +1,367 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Profilers for script subcommands
+
+Profilers are enabled by the script only while running the selected command and
+its async tasks, leaving script startup and argument parsing out of the profile.
+"""
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import tracemalloc
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from .exceptions import ScriptError
+
+DEFAULT_PROFILE_TOP_FUNCTIONS = 20
+DEFAULT_SAMPLING_INTERVAL = 0.005
+DEFAULT_MEMORY_TRACEBACK_FRAMES = 1
+DEFAULT_MEMORY_SNAPSHOT_GROWTH = 0.1
+DEFAULT_MEMORY_SNAPSHOT_LINES = 10
+
+
+def format_bytes(value: float) -> str:
+    """
+    Format number of bytes with binary unit suffix
+    """
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(value) < 1024 or unit == 'GiB':
+            break
+        value /= 1024
+    return f'{value:.1f} {unit}' if unit != 'B' else f'{value:.0f} {unit}'
+
+
+class Profiler:
+    """
+    Common base class for command profilers
+
+    Profiling contexts can be nested; the profiler runs from the first context
+    enter to the last context exit, or until stop() is called.
+    """
+    running: bool
+
+    def __init__(self) -> None:
+        self.running = False
+        self.__depth__ = 0
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        """
+        Profile code run in the context
+        """
+        if self.__depth__ == 0:
+            self.start()
+        self.__depth__ += 1
+        try:
+            yield
+        finally:
+            self.__depth__ -= 1
+            if self.__depth__ == 0:
+                self.stop()
+
+    def start(self) -> None:
+        """
+        Start profiling
+        """
+        self.running = True
+
+    def stop(self) -> None:
+        """
+        Stop profiling
+        """
+        self.running = False
+
+    def write(self, path: str) -> None:
+        """
+        Write profile data to file
+        """
+        raise NotImplementedError('Profiler write() must be implemented in child class')
+
+    def get_top_functions(self, limit: int = DEFAULT_PROFILE_TOP_FUNCTIONS) -> List[str]:
+        """
+        Return report of top functions as lines of text
+        """
+        raise NotImplementedError('Profiler get_top_functions() must be implemented in child class')
+
+
+class CProfileProfiler(Profiler):
+    """
+    Deterministic profiler using cProfile, writing pstats files
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.__profile__ = cProfile.Profile()
+
+    def start(self) -> None:
+        """
+        Start cProfile profiler
+        """
+        if not self.running:
+            self.__profile__.enable()
+        super().start()
+
+    def stop(self) -> None:
+        """
+        Stop cProfile profiler
+        """
+        if self.running:
+            self.__profile__.disable()
+        super().stop()
+
+    def write(self, path: str) -> None:
+        """
+        Write profile data as pstats file
+        """
+        try:
+            self.__profile__.dump_stats(path)
+        except OSError as error:
+            raise ScriptError(f'Error writing profile {path}: {error}') from error
+
+    def get_top_functions(self, limit: int = DEFAULT_PROFILE_TOP_FUNCTIONS) -> List[str]:
+        """
+        Return top functions by cumulative time as pstats report lines
+        """
+        stream = io.StringIO()
+        try:
+            stats = pstats.Stats(self.__profile__, stream=stream)
+        except TypeError:
+            return ['No profile data collected']
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        return [line for line in stream.getvalue().splitlines() if line.strip()]
+
+
+class SamplingProfiler(Profiler):
+    """
+    Statistical profiler sampling the stack of the profiled thread at intervals
+
+    Sampling runs in a background thread and has low overhead, making it usable on
+    production runs. Profile data is written as collapsed stacks, usable with
+    flamegraph tools and speedscope.
+    """
+    interval: float
+    samples: Counter
+
+    def __init__(self, interval: float = DEFAULT_SAMPLING_INTERVAL) -> None:
+        super().__init__()
+        self.interval = interval
+        self.samples = Counter()
+        self.__thread_id__ = None
+        self.__stop_event__ = threading.Event()
+        self.__sampler__: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start sampling the calling thread
+        """
+        if not self.running:
+            self.__thread_id__ = threading.get_ident()
+            self.__stop_event__.clear()
+            self.__sampler__ = threading.Thread(target=self.__sample__, name='profile-sampler', daemon=True)
+            self.__sampler__.start()
+        super().start()
+
+    def stop(self) -> None:
+        """
+        Stop sampling
+        """
+        if self.running:
+            self.__stop_event__.set()
+            self.__sampler__.join()
+        super().stop()
+
+    def __sample__(self) -> None:
+        """
+        Collect stack samples until stopped
+        """
+        while not self.__stop_event__.wait(self.interval):
+            # pylint: disable=protected-access
+            frame = sys._current_frames().get(self.__thread_id__, None)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def write(self, path: str) -> None:
+        """
+        Write samples as collapsed stacks, one stack per line with sample count
+        """
+        try:
+            with open(path, 'w', encoding='utf-8') as filedescriptor:
+                for stack, count in self.samples.most_common():
+                    frames = ';'.join(f'{name} ({filename})' for filename, _lineno, name in stack)
+                    filedescriptor.write(f'{frames} {count}\n')
+        except OSError as error:
+            raise ScriptError(f'Error writing profile {path}: {error}') from error
+
+    def get_top_functions(self, limit: int = DEFAULT_PROFILE_TOP_FUNCTIONS) -> List[str]:
+        """
+        Return top functions by samples in the function or its callees
+        """
+        total = sum(self.samples.values())
+        if not total:
+            return ['No profile samples collected']
+        own = Counter()
+        cumulative = Counter()
+        for stack, count in self.samples.items():
+            own[(stack[-1][0], stack[-1][2])] += count
+            for function in {(filename, name) for filename, _lineno, name in stack}:
+                cumulative[function] += count
+        lines = [
+            f'{total} samples at {self.interval * 1000:g}ms interval',
+            f'{"cumulative":>12} {"own":>12}  function',
+        ]
+        for function, count in cumulative.most_common(limit):
+            filename, name = function
+            lines.append(
+                f'{count:6d} {count / total:5.1%} {own[function]:6d} {own[function] / total:5.1%}  '
+                f'{name} ({filename})'
+            )
+        return lines
+
+
+class MemorySnapshot:
+    """
+    Traced memory usage at a named point of the run
+    """
+    label: str
+    current: int
+    peak: int
+
+    def __init__(self, label: str, current: int, peak: int) -> None:
+        self.label = label
+        self.current = current
+        self.peak = peak
+
+    def __repr__(self) -> str:
+        """
+        Return snapshot label with traced memory usage
+        """
+        return f'{self.label}: current {format_bytes(self.current)} peak {format_bytes(self.peak)}'
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Return snapshot as dictionary
+        """
+        return {
+            'label': self.label,
+            'current': self.current,
+            'peak': self.peak,
+        }
+
+
+class MemoryProfiler(Profiler):
+    """
+    Memory profiler tracing python allocations with tracemalloc
+
+    Snapshots are taken with snapshot() at points of interest and when profiling
+    stops. Traced memory of each snapshot is recorded, and allocations are kept
+    for the snapshot with largest traced memory to report top allocation sites.
+
+    Collecting allocations is slow with many traced blocks, so allocations are
+    collected again only when traced memory has grown by snapshot_growth fraction
+    from the snapshot with allocations kept. Only the first and last snapshot_lines
+    snapshots are shown in the report.
+    """
+    traceback_frames: int
+    snapshot_growth: float
+    snapshot_lines: int
+    snapshots: List[MemorySnapshot]
+    peak: int
+
+    def __init__(self,
+                 traceback_frames: int = DEFAULT_MEMORY_TRACEBACK_FRAMES,
+                 snapshot_growth: float = DEFAULT_MEMORY_SNAPSHOT_GROWTH,
+                 snapshot_lines: int = DEFAULT_MEMORY_SNAPSHOT_LINES) -> None:
+        super().__init__()
+        self.traceback_frames = traceback_frames
+        self.snapshot_growth = snapshot_growth
+        self.snapshot_lines = snapshot_lines
+        self.snapshots = []
+        self.peak = 0
+        self.__largest_snapshot__: Optional[MemorySnapshot] = None
+        self.__largest_allocations__: Optional[tracemalloc.Snapshot] = None
+
+    def start(self) -> None:
+        """
+        Start tracing memory allocations
+        """
+        if not self.running:
+            tracemalloc.start(self.traceback_frames)
+        super().start()
+
+    def stop(self) -> None:
+        """
+        Take final snapshot and stop tracing memory allocations
+        """
+        if self.running:
+            self.snapshot('stop')
+            tracemalloc.stop()
+        super().stop()
+
+    def snapshot(self, label: str) -> Optional[MemorySnapshot]:
+        """
+        Record traced memory usage with label, returning None if profiler is not running
+        """
+        if not self.running:
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        snapshot = MemorySnapshot(label, current, peak)
+        self.snapshots.append(snapshot)
+        largest = self.__largest_snapshot__
+        if largest is None or current > largest.current * (1 + self.snapshot_growth):
+            self.__largest_snapshot__ = snapshot
+            self.__largest_allocations__ = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            ))
+        return snapshot
+
+    def write(self, path: str) -> None:
+        """
+        Write allocations of the largest snapshot as tracemalloc snapshot file
+
+        The file can be loaded with tracemalloc.Snapshot.load()
+        """
+        if self.__largest_allocations__ is None:
+            raise ScriptError(f'Error writing memory profile {path}: no snapshots taken')
+        try:
+            self.__largest_allocations__.dump(path)
+        except OSError as error:
+            raise ScriptError(f'Error writing memory profile {path}: {error}') from error
+
+    def get_top_functions(self, limit: int = DEFAULT_PROFILE_TOP_FUNCTIONS) -> List[str]:
+        """
+        Return peak traced memory, first and last snapshots and top allocation sites of
+        the largest snapshot
+        """
+        if self.__largest_allocations__ is None:
+            return ['No memory snapshots taken']
+        lines = [f'Peak traced memory {format_bytes(self.peak)}']
+        hidden = len(self.snapshots) - 2 * self.snapshot_lines
+        if hidden > 0:
+            lines.extend(f'Snapshot {snapshot}' for snapshot in self.snapshots[:self.snapshot_lines])
+            lines.append(f'... {hidden} snapshots not shown')
+            lines.extend(f'Snapshot {snapshot}' for snapshot in self.snapshots[-self.snapshot_lines:])
+        else:
+            lines.extend(f'Snapshot {snapshot}' for snapshot in self.snapshots)
+        lines.append(f'Top allocation sites at snapshot {self.__largest_snapshot__.label}:')
+        for statistic in self.__largest_allocations__.statistics('lineno')[:limit]:
+            frame = statistic.traceback[0]
+            lines.append(
+                f'{format_bytes(statistic.size):>12} {statistic.count:8d} blocks  {frame.filename}:{frame.lineno}'
+            )
+        return lines
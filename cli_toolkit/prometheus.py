@@ -0,0 +1,142 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Prometheus text format exporter for script runs
+
+Metrics are written in the Prometheus text exposition format to files read by
+the node_exporter textfile collector. Files are written to a temporary file in
+the same directory and renamed, so the collector never reads partial files.
+"""
+import math
+import os
+import tempfile
+
+from typing import Dict, List, Optional, Tuple
+
+from .exceptions import ScriptError
+from .metrics import Histogram, Metric, MetricsRegistry
+
+TEXTFILE_MODE = 0o644
+
+
+def format_value(value: float) -> str:
+    """
+    Format sample value for Prometheus text format
+    """
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    """
+    Format labels for Prometheus text format, escaping label values
+    """
+    if not labels:
+        return ''
+    items = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        items.append(f'{name}="{value}"')
+    return '{' + ','.join(items) + '}'
+
+
+class PrometheusTextfile:
+    """
+    Collection of metric samples formatted in Prometheus text format
+
+    Labels given when creating the textfile are added to all samples.
+    """
+    labels: Dict[str, str]
+
+    def __init__(self, labels: Optional[Dict[str, str]] = None) -> None:
+        self.labels = labels if labels is not None else {}
+        self.__metrics__: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def add(self,
+            name: str,
+            metric_type: str,
+            description: str,
+            value: float,
+            labels: Optional[Dict[str, str]] = None,
+            suffix: str = '') -> None:
+        """
+        Add a sample for metric with name
+
+        Suffix is appended to the sample name, as in histogram _bucket, _sum and _count samples
+        """
+        if name not in self.__metrics__:
+            self.__metrics__[name] = (metric_type, description, [])
+        sample_labels = dict(self.labels)
+        if labels:
+            sample_labels.update(labels)
+        self.__metrics__[name][2].append(f'{name}{suffix}{format_labels(sample_labels)} {format_value(value)}')
+
+    def add_metric(self, metric: Metric) -> None:
+        """
+        Add samples of metric from metrics registry
+        """
+        if isinstance(metric, Histogram):
+            for bound, count in zip(metric.buckets, metric.bucket_counts):
+                self.add(metric.name, metric.metric_type, metric.description, count, {'le': format_value(bound)},
+                         suffix='_bucket')
+            self.add(metric.name, metric.metric_type, metric.description, metric.count, {'le': '+Inf'},
+                     suffix='_bucket')
+            self.add(metric.name, metric.metric_type, metric.description, metric.sum, suffix='_sum')
+            self.add(metric.name, metric.metric_type, metric.description, metric.count, suffix='_count')
+        else:
+            self.add(metric.name, metric.metric_type, metric.description, metric.value)
+
+    def add_registry(self, registry: MetricsRegistry) -> None:
+        """
+        Add samples of all metrics in metrics registry
+        """
+        for _name, metric in sorted(registry.metrics.items()):
+            self.add_metric(metric)
+
+    def format(self) -> str:
+        """
+        Return metric samples in Prometheus text format
+        """
+        lines = []
+        for name, (metric_type, description, samples) in self.__metrics__.items():
+            if description:
+                description = description.replace('\\', '\\\\').replace('\n', '\\n')
+                lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(samples)
+        return ''.join(f'{line}\n' for line in lines)
+
+    def write(self, path: str) -> None:
+        """
+        Write metrics to file atomically by writing a temporary file and renaming it
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            filedescriptor, tmpfile = tempfile.mkstemp(
+                dir=directory,
+                prefix=f'.{os.path.basename(path)}.',
+                suffix='.tmp',
+            )
+        except OSError as error:
+            raise ScriptError(f'Error writing prometheus textfile {path}: {error}') from error
+        try:
+            with os.fdopen(filedescriptor, 'w', encoding='utf-8') as handle:
+                handle.write(self.format())
+            os.chmod(tmpfile, TEXTFILE_MODE)
+            os.replace(tmpfile, path)
+        except OSError as error:
+            try:
+                os.unlink(tmpfile)
+            except OSError:
+                pass
+            raise ScriptError(f'Error writing prometheus textfile {path}: {error}') from error
@@ -0,0 +1,102 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Rate limiters for script task launches
+
+Rate limiters are token buckets registered by name to scripts and commands with
+add_rate_limiter(). Tasks linked to a rate limiter take a token from the bucket
+when each attempt is started.
+"""
+import asyncio
+import time
+
+from .exceptions import ScriptError
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter for async task launches
+
+    The bucket holds up to burst tokens and is refilled with rate tokens per second.
+    Waiting for a token sleeps until the next token is available instead of polling,
+    and waiters are served in order.
+    """
+    name: str
+    rate: float
+    burst: int
+    tokens: float
+
+    def __init__(self, name: str, rate: float, burst: int = 1) -> None:
+        if rate <= 0:
+            raise ScriptError(f'Invalid rate limiter {name} rate: {rate}')
+        if burst < 1:
+            raise ScriptError(f'Invalid rate limiter {name} burst: {burst}')
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.__updated__ = time.monotonic()
+        self.__lock__ = None
+        self.__loop__ = None
+
+    def __repr__(self) -> str:
+        """
+        Return rate limiter name and limits
+        """
+        return f'{self.name} {self.rate}/s burst {self.burst}'
+
+    def __refill__(self) -> None:
+        """
+        Add tokens to bucket based on time elapsed since last update
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.__updated__) * self.rate)
+        self.__updated__ = now
+
+    def __get_lock__(self) -> asyncio.Lock:
+        """
+        Return lock for waiters, bound to the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if self.__lock__ is None or self.__loop__ is not loop:
+            self.__lock__ = asyncio.Lock()
+            self.__loop__ = loop
+        return self.__lock__
+
+    def get_delay(self) -> float:
+        """
+        Return seconds until next token is available, 0 if a token is available now
+        """
+        self.__refill__()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def try_acquire(self) -> bool:
+        """
+        Take a token without waiting, returning False if no token is available
+        """
+        if self.get_delay() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def wait(self) -> None:
+        """
+        Wait until a token is available without taking it
+        """
+        delay = self.get_delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.get_delay()
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it
+        """
+        async with self.__get_lock__():
+            while not self.try_acquire():
+                await asyncio.sleep(self.get_delay())
@@ -0,0 +1,98 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Retry policies for script tasks
+
+Retry policies are attached to script tasks with the retry_policy attribute. Failed
+task attempts are retried with exponential backoff and jitter until the maximum
+number of attempts is reached or the failure is not retryable.
+"""
+import random
+
+from typing import Callable, Optional, Tuple, Type, TYPE_CHECKING
+
+from .exceptions import ScriptError, TaskError
+
+if TYPE_CHECKING:
+    from .task import BaseScriptTask
+
+DEFAULT_RETRY_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_BACKOFF_BASE = 1.0
+DEFAULT_RETRY_BACKOFF_CAP = 60.0
+DEFAULT_RETRY_JITTER = 1.0
+
+
+class RetryPolicy:
+    """
+    Retry policy for failed script tasks
+
+    Delay before attempt n + 1 is backoff_base * 2 ** (n - 1), limited to backoff_cap.
+    With jitter the delay is reduced by a random fraction of up to jitter, i.e. jitter
+    1.0 gives 'full jitter' and 0.0 gives plain exponential backoff.
+
+    Failures are retryable if:
+
+    - predicate is defined and returns True for task and exception, or
+    - retry_return_codes is defined, the task failed with TaskError and the
+      task returncode is in retry_return_codes, or
+    - the exception is an instance of one of retry_exceptions
+    """
+    max_attempts: int
+    backoff_base: float
+    backoff_cap: float
+    jitter: float
+    retry_exceptions: Tuple[Type[BaseException]]
+    retry_return_codes: Optional[Tuple[int]]
+    predicate: Optional[Callable[['BaseScriptTask', BaseException], bool]]
+
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 max_attempts: int = DEFAULT_RETRY_MAX_ATTEMPTS,
+                 backoff_base: float = DEFAULT_RETRY_BACKOFF_BASE,
+                 backoff_cap: float = DEFAULT_RETRY_BACKOFF_CAP,
+                 jitter: float = DEFAULT_RETRY_JITTER,
+                 retry_exceptions: Tuple[Type[BaseException]] = (Exception,),
+                 retry_return_codes: Optional[Tuple[int]] = None,
+                 predicate: Optional[Callable[['BaseScriptTask', BaseException], bool]] = None) -> None:
+        if max_attempts < 1:
+            raise ScriptError(f'Invalid retry max_attempts value: {max_attempts}')
+        if backoff_base < 0 or backoff_cap < 0:
+            raise ScriptError('Retry backoff values must not be negative')
+        if jitter < 0 or jitter > 1:
+            raise ScriptError(f'Invalid retry jitter value: {jitter}')
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.jitter = jitter
+        self.retry_exceptions = retry_exceptions
+        self.retry_return_codes = retry_return_codes
+        self.predicate = predicate
+
+    def is_retryable(self, task: Optional['BaseScriptTask'], error: BaseException) -> bool:
+        """
+        Check if the task failure is retryable
+        """
+        if self.predicate is not None:
+            return bool(self.predicate(task, error))
+        returncode = getattr(task, 'returncode', None)
+        if self.retry_return_codes is not None and isinstance(error, TaskError) and returncode is not None:
+            return returncode in self.retry_return_codes
+        return isinstance(error, self.retry_exceptions)
+
+    def should_retry(self, task: Optional['BaseScriptTask'], error: BaseException, attempt: int) -> bool:
+        """
+        Check if the task should be retried after failed attempt number attempt
+        """
+        return attempt < self.max_attempts and self.is_retryable(task, error)
+
+    def get_delay(self, attempt: int) -> float:
+        """
+        Return delay in seconds before retrying after failed attempt number attempt
+        """
+        delay = min(self.backoff_cap, self.backoff_base * 2 ** (attempt - 1))
+        if self.jitter:
+            delay -= random.uniform(0, delay * self.jitter)
+        return delay
@@ -0,0 +1,168 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Scheduling of concurrently running script tasks
+
+The scheduler hands out concurrency slots to waiting tasks from a priority heap
+instead of first come first served order. Task duration history is used to
+start the longest tasks first when requested.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .exceptions import ScriptError
+
+DEFAULT_DURATION_HISTORY_WEIGHT = 0.5
+
+
+class TaskScheduler:
+    """
+    Bounded scheduler for concurrently running tasks
+
+    Tasks call acquire() with a sort key before running and release() when done.
+    When all slots are in use, waiting tasks are dispatched in sort key order,
+    and in order of calling acquire() for tasks with same sort key. Multiple slots
+    can be acquired at once, and tasks with later sort key are not started while
+    the first waiting task does not fit in the free slots.
+
+    With max_concurrent None the number of running tasks is not limited.
+    """
+    max_concurrent: Optional[int]
+    running: int
+
+    def __init__(self, max_concurrent: Optional[int] = None) -> None:
+        if max_concurrent is not None and (not isinstance(max_concurrent, int) or max_concurrent < 1):
+            raise ScriptError(f'Invalid max_concurrent_tasks value: {max_concurrent}')
+        self.max_concurrent = max_concurrent
+        self.running = 0
+        self.__queue__: List[Tuple[Any, int, int, asyncio.Future]] = []
+        self.__counter__ = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        """
+        Return number of tasks waiting for a slot
+        """
+        return len([item for item in self.__queue__ if not item[3].done()])
+
+    def __has_free_slots__(self, slots: int) -> bool:
+        """
+        Check if a task holding specified number of slots can be started now
+        """
+        return self.max_concurrent is None or self.running + slots <= self.max_concurrent
+
+    def __dispatch__(self) -> None:
+        """
+        Hand out free slots to waiting tasks in priority order
+        """
+        while self.__queue__:
+            slots, future = self.__queue__[0][2:]
+            if not future.done() and not self.__has_free_slots__(slots):
+                break
+            heapq.heappop(self.__queue__)
+            if future.done():
+                continue
+            self.running += slots
+            future.set_result(None)
+
+    async def acquire(self, sort_key: Any = 0, slots: int = 1) -> None:
+        """
+        Wait for free slots. Lowest sort_key is dispatched first
+        """
+        if self.__has_free_slots__(slots) and not self.__queue__:
+            self.running += slots
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.__queue__, (sort_key, next(self.__counter__), slots, future))
+        self.__dispatch__()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(slots)
+            raise
+
+    def set_max_concurrent(self, max_concurrent: int) -> None:
+        """
+        Change the concurrency limit, starting waiting tasks if slots were added
+
+        Running tasks are not interrupted when the limit is lowered.
+        """
+        self.max_concurrent = max_concurrent
+        self.__dispatch__()
+
+    def release(self, slots: int = 1) -> None:
+        """
+        Release slots and dispatch next waiting task
+        """
+        self.running -= slots
+        self.__dispatch__()
+
+
+class TaskDurationHistory:
+    """
+    History of task durations for estimating expected task durations
+
+    Durations are stored by task key as exponentially weighted averages. If path
+    is given, the history is loaded from and saved to the JSON file.
+    """
+    path: Optional[Path]
+    weight: float
+    durations: Dict[str, float]
+
+    def __init__(self,
+                 path: Optional[Union[str, Path]] = None,
+                 weight: float = DEFAULT_DURATION_HISTORY_WEIGHT) -> None:
+        self.path = Path(path).expanduser() if path is not None else None
+        self.weight = weight
+        self.durations = {}
+
+    def load(self) -> None:
+        """
+        Load history from JSON file. Missing file is ignored
+        """
+        if self.path is None or not self.path.is_file():
+            return
+        try:
+            durations = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as error:
+            raise ScriptError(f'Error loading task duration history {self.path}: {error}') from error
+        if not isinstance(durations, dict):
+            raise ScriptError(f'Invalid task duration history file: {self.path}')
+        self.durations.update(durations)
+
+    def save(self) -> None:
+        """
+        Save history to JSON file
+        """
+        if self.path is None:
+            return
+        try:
+            self.path.write_text(json.dumps(self.durations, indent=2, sort_keys=True), encoding='utf-8')
+        except OSError as error:
+            raise ScriptError(f'Error saving task duration history {self.path}: {error}') from error
+
+    def get(self, key: str) -> Optional[float]:
+        """
+        Return expected duration for task key, None if not known
+        """
+        return self.durations.get(key, None)
+
+    def update(self, key: str, duration: float) -> None:
+        """
+        Add observed task duration to the history
+        """
+        previous = self.durations.get(key, None)
+        if previous is None:
+            self.durations[key] = duration
+        else:
+            self.durations[key] = previous * (1 - self.weight) + duration * self.weight
@@ -13,16 +13,57 @@ The Script class is usually used with cli_toolkit.command.Command to create
 CLI scripts with subcommands.
 """
 import argparse
+import asyncio
+import io
+import locale
+import os
 import signal
 import sys
+import time
+import traceback
+import weakref
 
 from pathlib import Path
 from types import FrameType
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, TextIO, Tuple
 
 from sys_toolkit.logger import Logger
 
+try:
+    import termios
+except ImportError:
+    termios = None
+
 from .base import NestedCliCommand
+from .batch import BatchLine, read_batch_lines
+from .exceptions import ScriptError
+from .metrics import MetricsRegistry
+from .output import (
+    ConsoleWriter,
+    DEFAULT_OUTPUT_BUFFER_SIZE,
+    DEFAULT_OUTPUT_FLUSH_INTERVAL,
+    INVOCATION_STREAMS,
+    InvocationStream,
+)
+from .prometheus import PrometheusTextfile
+from .profiler import (
+    CProfileProfiler,
+    MemoryProfiler,
+    Profiler,
+    SamplingProfiler,
+    DEFAULT_PROFILE_TOP_FUNCTIONS,
+)
+from .task import (
+    PROCESS_TERMINATE_TASKS,
+    TASK_STATUS_CANCELLED,
+    TASK_STATUS_FAILED,
+    TASK_STATUS_PENDING,
+    TASK_STATUS_RUNNING,
+    TASK_STATUS_SUCCEEDED,
+)
+from .trace import TraceRecorder
+
+STDERR_FILENO = 2
 
 
 class ScriptMetaClass(type):
@@ -31,17 +72,134 @@ class ScriptMetaClass(type):
     """
     def __call__(cls, *args: List[Any], **kwargs: Dict[Any, Any]) -> None:
         obj = type.__call__(cls, *args, **kwargs)
-        obj.initialize()
+        with obj.__trace_recorder__.span('initialize', 'startup'):
+            obj.initialize()
         return obj
 
 
+class Invocation:
+    """
+    Exit code and output of a command line run with Script.invoke()
+    """
+    exit_code: int
+    stdout: TextIO
+    stderr: TextIO
+
+    def __init__(self, exit_code: int, stdout: TextIO, stderr: TextIO) -> None:
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @staticmethod
+    def __get_output__(stream: TextIO) -> Optional[str]:
+        """
+        Return output captured to stream, or None if the output was not captured
+        """
+        getvalue = getattr(stream, 'getvalue', None)
+        return getvalue() if getvalue is not None else None
+
+    @property
+    def output(self) -> Optional[str]:
+        """
+        Return captured stdout output
+        """
+        return self.__get_output__(self.stdout)
+
+    @property
+    def errors(self) -> Optional[str]:
+        """
+        Return captured stderr output
+        """
+        return self.__get_output__(self.stderr)
+
+
+# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-public-methods
 class Script(NestedCliCommand, metaclass=ScriptMetaClass):
     """
     CLI script command main class
+
+    With --trace FILE startup phases, subcommand dispatch and async tasks are recorded
+    and written to FILE in Trace Event Format when the script exits.
+
+    With --profile FILE the selected command and its async tasks are profiled, and
+    the profile is written to FILE and top functions shown on stderr when the script
+    exits.
+
+    With --memprofile FILE python memory allocations of the selected command and its
+    async tasks are traced. Traced memory is recorded after each task completes and at
+    snapshots taken with memory_snapshot(). Peak usage and top allocation sites are
+    shown on stderr when the script exits.
+
+    Metrics registered to the metrics registry are collected when --debug or --metrics
+    FILE is given, and shown as debug messages and written to FILE as JSON when the
+    script exits.
+
+    With --prometheus-textfile FILE run duration, exit code, task outcomes and metrics
+    from the metrics registry are written to FILE in Prometheus text format for the
+    node_exporter textfile collector when the script exits.
+
+    Sending SIGUSR1 to the script shows task counts and the oldest running tasks on
+    stderr, or appends them to the file given with --status-file. With --status-stacks
+    stacks of the main thread and asyncio tasks are included.
+
+    With buffered_output, messages and errors are written to stdout and stderr in
+    batches when the streams are not connected to a terminal. Buffered output is
+    flushed when the script exits.
+
+    Async tasks and coroutine commands of the script are run in one event loop, created
+    when first needed and closed when the script exits. With use_uvloop the loop is
+    created with uvloop if it is installed.
+
+    With --batch FILE each line of FILE is parsed as a command line and run with
+    run_subcommand() in the same script process. Exit codes of the lines are collected
+    to batch_lines. With --batch-jobs N up to N lines are run at the same time in
+    processes forked from the script.
+
+    Scripts embedded in other programs can run command lines with invoke(), which
+    returns the exit code and output of the command instead of exiting. Set
+    signal_handlers to False to keep signal handlers of the program.
     """
+    prometheus_metric_prefix: str = 'cli_script'
+    """Prefix for names of run metrics written with --prometheus-textfile"""
+    status_running_tasks: int = 10
+    """Number of oldest running tasks shown in SIGUSR1 status"""
+    restore_terminal: bool = True
+    """Capture terminal attributes at start and restore them when the script exits"""
+    buffered_output: bool = False
+    """Buffer messages and errors written to stdout and stderr"""
+    output_buffer_size: int = DEFAULT_OUTPUT_BUFFER_SIZE
+    """Number of characters buffered before writing output with buffered_output"""
+    output_flush_interval: float = DEFAULT_OUTPUT_FLUSH_INTERVAL
+    """Maximum seconds output is kept in buffer with buffered_output"""
+    use_uvloop: bool = False
+    """Use uvloop event loop if uvloop is installed"""
+    signal_handlers: bool = True
+    """Install SIGINT, SIGTERM and SIGUSR1 handlers when the script is created"""
+
     name: str
     logger: Logger
     __parser__: argparse.ArgumentParser
+    __trace_recorder__: TraceRecorder
+    __trace_file__: Optional[str]
+    __profiler__: Optional[Profiler]
+    __profile_file__: Optional[str]
+    __profile_top__: int
+    __memory_profiler__: Optional[MemoryProfiler]
+    __memory_profile_file__: Optional[str]
+    __metrics__: MetricsRegistry
+    __metrics_file__: Optional[str]
+    __prometheus_textfile__: Optional[str]
+    __start_time__: float
+    __status_file__: Optional[str]
+    __status_stacks__: bool
+    __interrupt_signal__: Optional[int]
+    __terminal_attributes__: Optional[List[Any]]
+    __console_writer__: Optional[ConsoleWriter]
+    __event_loop__: Optional[asyncio.AbstractEventLoop]
+    __batch_running__: bool
+    __invocations__: int
+    batch_lines: List[BatchLine]
 
     subcommands: Tuple[NestedCliCommand] = ()
 
@@ -50,7 +208,35 @@ class Script(NestedCliCommand, metaclass=ScriptMetaClass):
                  description: str = None,
                  epilog: str = None,
                  formatter_class: argparse.HelpFormatter = None) -> None:
-        signal.signal(signal.SIGINT, self.SIGINT)
+        self.__start_time__ = time.monotonic()
+        self.__trace_recorder__ = TraceRecorder()
+        self.__trace_file__ = None
+        self.__profiler__ = None
+        self.__profile_file__ = None
+        self.__profile_top__ = DEFAULT_PROFILE_TOP_FUNCTIONS
+        self.__memory_profiler__ = None
+        self.__memory_profile_file__ = None
+        self.__metrics__ = MetricsRegistry(enabled=False)
+        self.__metrics_file__ = None
+        self.__prometheus_textfile__ = None
+        self.__status_file__ = None
+        self.__status_stacks__ = False
+        self.__interrupt_signal__ = None
+        self.__terminal_attributes__ = None
+        self.__console_writer__ = None
+        self.__event_loop__ = None
+        self.__batch_running__ = False
+        self.__invocations__ = 0
+        self.batch_lines = []
+        if self.buffered_output:
+            self.__console_writer__ = ConsoleWriter(self.output_buffer_size, self.output_flush_interval)
+        self.__capture_terminal_attributes__()
+        init_start = self.__trace_recorder__.timestamp()
+        if self.signal_handlers:
+            signal.signal(signal.SIGINT, self.SIGINT)
+            signal.signal(signal.SIGTERM, self.SIGINT)
+            if hasattr(signal, 'SIGUSR1'):
+                signal.signal(signal.SIGUSR1, self.SIGUSR1)
         self.name = Path(sys.argv[0]).name
         self.logger = Logger(self.name)
         super().__init__()
@@ -70,6 +256,76 @@ class Script(NestedCliCommand, metaclass=ScriptMetaClass):
 
         self.__parser__.add_argument('--debug', action='store_true', help='Enable debug messages')
         self.__parser__.add_argument('--quiet', action='store_true', help='Silent printed messages')
+        self.__parser__.add_argument(
+            '--trace',
+            metavar='FILE',
+            default=argparse.SUPPRESS,
+            help='Write Trace Event Format trace of the run to FILE'
+        )
+        self.__parser__.add_argument(
+            '--profile',
+            metavar='FILE',
+            default=argparse.SUPPRESS,
+            help='Profile the command and write pstats profile to FILE'
+        )
+        self.__parser__.add_argument(
+            '--profile-sampler',
+            action='store_true',
+            default=argparse.SUPPRESS,
+            help='Use low overhead sampling profiler, writing collapsed stacks to profile FILE'
+        )
+        self.__parser__.add_argument(
+            '--profile-top',
+            metavar='N',
+            type=int,
+            default=argparse.SUPPRESS,
+            help='Number of top functions or allocation sites to show with --profile and --memprofile '
+                 f'(default {DEFAULT_PROFILE_TOP_FUNCTIONS})'
+        )
+        self.__parser__.add_argument(
+            '--memprofile',
+            metavar='FILE',
+            default=argparse.SUPPRESS,
+            help='Trace memory allocations of the command and write tracemalloc snapshot to FILE'
+        )
+        self.__parser__.add_argument(
+            '--metrics',
+            metavar='FILE',
+            default=argparse.SUPPRESS,
+            help='Collect metrics and write them to FILE as JSON'
+        )
+        self.__parser__.add_argument(
+            '--prometheus-textfile',
+            metavar='FILE',
+            default=argparse.SUPPRESS,
+            help='Write run metrics to FILE in Prometheus text format'
+        )
+        self.__parser__.add_argument(
+            '--status-file',
+            metavar='FILE',
+            default=argparse.SUPPRESS,
+            help='Append status shown on SIGUSR1 to FILE instead of stderr'
+        )
+        self.__parser__.add_argument(
+            '--status-stacks',
+            action='store_true',
+            default=argparse.SUPPRESS,
+            help='Include python stacks of main thread and asyncio tasks in SIGUSR1 status'
+        )
+        self.__parser__.add_argument(
+            '--batch',
+            metavar='FILE',
+            default=argparse.SUPPRESS,
+            help='Run command lines from FILE, or from stdin with -, in one process'
+        )
+        self.__parser__.add_argument(
+            '--batch-jobs',
+            metavar='N',
+            type=int,
+            default=argparse.SUPPRESS,
+            help='Number of batch command lines run at the same time (default 1)'
+        )
+        self.__trace_recorder__.add_complete_event('init', 'startup', init_start)
 
     # pylint: disable=unused-argument
     def initialize(self, *args: List[Any], **kwargs: Dict[Any, Any]) -> None:
@@ -83,11 +339,394 @@ class Script(NestedCliCommand, metaclass=ScriptMetaClass):
     # pylint: disable=unused-argument
     def SIGINT(self, signum: int, frame: Optional[FrameType]) -> None:
         """
-        Parse SIGINT signal by quitting the program cleanly with exit code 1
+        Parse SIGINT and SIGTERM signals by quitting the program cleanly with exit code 1
+
+        If async tasks are running, the first signal drains the tasks: no new tasks
+        are started and running tasks are given their grace period to finish. A second
+        signal kills the processes of running tasks and exits immediately.
         """
-        self.reset_stty()
+        runners = [command for command in self.__iter_commands__() if command.__task_loop__ is not None]
+        if runners and self.__interrupt_signal__ is None:
+            self.__interrupt_signal__ = signum
+            grace_period = max(runner.drain_grace_period for runner in runners)
+            self.error(
+                f'Received {signal.Signals(signum).name}, waiting up to {grace_period:g}s for running '
+                'tasks to finish. Send signal again to stop immediately.'
+            )
+            for runner in runners:
+                runner.__task_loop__.call_soon_threadsafe(runner.drain_async_tasks, signum)
+            return
+        for runner in runners:
+            runner.kill_async_tasks()
+        # Stop the batch instead of the running batch line
+        self.__batch_running__ = False
         self.exit(1)
 
+    def __capture_terminal_attributes__(self) -> None:
+        """
+        Capture terminal attributes of stdin to be restored with reset_stty()
+        """
+        if termios is None or not self.restore_terminal:
+            return
+        try:
+            if sys.stdin.isatty():
+                self.__terminal_attributes__ = termios.tcgetattr(sys.stdin.fileno())
+        except (termios.error, OSError, ValueError):
+            self.__terminal_attributes__ = None
+
+    def __set_script_name__(self, name: str) -> None:
+        """
+        Set name of the script, used as logger name and as program name in usage of the
+        script and its subcommands
+        """
+        previous = self.name
+        self.name = name
+        self.logger = Logger(self.name)
+        for command in self.__iter_commands__():
+            prog = command.__parser__.prog
+            if prog == previous or prog.startswith(f'{previous} '):
+                command.__parser__.prog = f'{self.name}{prog[len(previous):]}'
+
+    def __reset_run_state__(self) -> None:
+        """
+        Reset script name from sys.argv, start time, terminal attributes and output
+        buffers for running a script created in advance, as in daemon mode
+        """
+        name = Path(sys.argv[0]).name
+        if name != self.name:
+            self.__set_script_name__(name)
+        self.__start_time__ = time.monotonic()
+        self.__interrupt_signal__ = None
+        self.__terminal_attributes__ = None
+        self.__capture_terminal_attributes__()
+        if self.buffered_output:
+            self.__console_writer__ = ConsoleWriter(self.output_buffer_size, self.output_flush_interval)
+
+    def reset_stty(self) -> None:
+        """
+        Restore terminal attributes of stdin captured when the script was started
+        """
+        if self.__terminal_attributes__ is None or self.__invocations__:
+            return
+        try:
+            termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, self.__terminal_attributes__)
+        except (termios.error, OSError, ValueError):
+            pass
+
+    # pylint: disable=invalid-name
+    def SIGUSR1(self, signum: int, frame: Optional[FrameType]) -> None:
+        """
+        Show status of running script on SIGUSR1 signal
+
+        The status is collected in the signal handler. It is written from the event loop
+        of the script when the loop is running, and immediately otherwise. Status is
+        written with unbuffered os.write(), because the signal may arrive while the
+        buffered output writer is in use.
+        """
+        lines = self.get_status_lines(frame if self.__status_stacks__ else None)
+        loop = self.__event_loop__
+        if loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(self.__write_status__, lines)
+        else:
+            self.__write_status__(lines)
+
+    def __write_status__(self, lines: List[str]) -> None:
+        """
+        Write status lines to status file, or unbuffered to stderr
+        """
+        data = ''.join(f'{line}\n' for line in lines)
+        if self.__status_file__ is not None:
+            try:
+                with open(self.__status_file__, 'a', encoding='utf-8') as filedescriptor:
+                    filedescriptor.write(data)
+                return
+            except OSError as error:
+                data = f'Error writing status file {self.__status_file__}: {error}\n'
+        try:
+            os.write(STDERR_FILENO, data.encode(locale.getpreferredencoding(False), errors='replace'))
+        except OSError:
+            pass
+
+    def get_status_lines(self, frame: Optional[FrameType] = None) -> List[str]:
+        """
+        Return task counts and oldest running tasks of the script as lines of text
+
+        If frame is given, stacks of the main thread from frame and of asyncio tasks
+        are included.
+        """
+        now = time.monotonic()
+        counts = {}
+        running = []
+        for command in self.__iter_commands__():
+            for callback, _kwargs in command.__async_task_callbacks__:
+                task = command.__get_script_task__(callback)
+                if task is None:
+                    continue
+                counts[task.status] = counts.get(task.status, 0) + 1
+                if task.start_time is not None:
+                    running.append(task)
+        finished = {
+            status: count for status, count in counts.items()
+            if status in (TASK_STATUS_SUCCEEDED, TASK_STATUS_FAILED, TASK_STATUS_CANCELLED)
+        }
+        finished_details = ', '.join(f'{count} {status}' for status, count in sorted(finished.items()))
+        lines = [
+            f'Status of {self.name} pid {os.getpid()} after {now - self.__start_time__:.3f}s: '
+            f'{counts.get(TASK_STATUS_RUNNING, 0)} running, {counts.get(TASK_STATUS_PENDING, 0)} queued, '
+            f'{sum(finished.values())} finished' + (f' ({finished_details})' if finished_details else '')
+        ]
+        if running:
+            lines.append('Oldest running tasks:')
+            for task in sorted(running, key=lambda task: task.start_time)[:self.status_running_tasks]:
+                process = getattr(task, 'process', None)
+                pid = f'pid {process.pid} ' if process is not None else ''
+                lines.append(f'{now - task.start_time:>10.3f}s attempt {task.attempts} {pid}{task}')
+        if frame is not None:
+            lines.extend(self.__get_stack_lines__(frame))
+        return lines
+
+    @staticmethod
+    def __get_stack_lines__(frame: FrameType) -> List[str]:
+        """
+        Return stacks of the main thread from frame and of running asyncio tasks as lines of text
+        """
+        lines = ['Main thread stack:']
+        lines.extend(line.rstrip() for line in traceback.format_stack(frame))
+        try:
+            tasks = asyncio.all_tasks()
+        except RuntimeError:
+            tasks = set()
+        for task in sorted(tasks, key=lambda task: task.get_name()):
+            stream = io.StringIO()
+            task.print_stack(file=stream)
+            lines.extend(stream.getvalue().splitlines())
+        return lines
+
+    def __get_trace_recorder__(self) -> Optional[TraceRecorder]:
+        """
+        Return trace recorder if tracing was enabled with --trace
+        """
+        if self.__trace_file__ is None:
+            return None
+        return self.__trace_recorder__
+
+    def __get_profiler__(self) -> Optional[Profiler]:
+        """
+        Return profiler if profiling was enabled with --profile
+        """
+        return self.__profiler__
+
+    def __get_memory_profiler__(self) -> Optional[MemoryProfiler]:
+        """
+        Return memory profiler if memory profiling was enabled with --memprofile
+        """
+        return self.__memory_profiler__
+
+    def __write_profiler__(self, profiler: Profiler, path: str) -> None:
+        """
+        Stop profiler, write profile to file and show top functions
+        """
+        profiler.stop()
+        try:
+            profiler.write(path)
+        except ScriptError as error:
+            self.error(error)
+        for line in profiler.get_top_functions(self.__profile_top__):
+            self.error(line)
+
+    def write_profile(self) -> None:
+        """
+        Write profiles to files specified with --profile and --memprofile
+        """
+        if self.__profiler__ is not None:
+            self.__write_profiler__(self.__profiler__, self.__profile_file__)
+            self.__profiler__ = None
+        if self.__memory_profiler__ is not None:
+            self.__write_profiler__(self.__memory_profiler__, self.__memory_profile_file__)
+            self.__memory_profiler__ = None
+
+    def write_metrics(self) -> None:
+        """
+        Show collected metrics as debug messages and write them to file specified with --metrics
+        """
+        if not self.__metrics__.enabled:
+            return
+        if self.__metrics__.metrics:
+            self.debug('Metrics:')
+            for line in self.__metrics__.get_lines():
+                self.debug(f'  {line}')
+        if self.__metrics_file__ is not None:
+            try:
+                self.__metrics__.write(self.__metrics_file__)
+            except ScriptError as error:
+                self.error(error)
+
+    def get_prometheus_textfile(self, exit_code: int) -> PrometheusTextfile:
+        """
+        Return run duration, exit code, task outcomes and registered metrics as Prometheus textfile
+        """
+        prefix = self.prometheus_metric_prefix
+        textfile = PrometheusTextfile({'script': self.name})
+        textfile.add(f'{prefix}_duration_seconds', 'gauge', 'Duration of the script run in seconds',
+                     time.monotonic() - self.__start_time__)
+        textfile.add(f'{prefix}_exit_code', 'gauge', 'Exit code of the script run', exit_code)
+        textfile.add(f'{prefix}_last_run_timestamp_seconds', 'gauge', 'Time the script run finished',
+                     time.time())
+
+        counts = {
+            status: 0
+            for status in (
+                TASK_STATUS_PENDING,
+                TASK_STATUS_RUNNING,
+                TASK_STATUS_SUCCEEDED,
+                TASK_STATUS_FAILED,
+                TASK_STATUS_CANCELLED,
+            )
+        }
+        attempts = 0
+        wall_time = 0.0
+        for command in self.__iter_commands__():
+            for item in command.get_task_stats():
+                counts[item['status']] = counts.get(item['status'], 0) + 1
+                attempts += item['attempts']
+                wall_time += item['wall_time']
+        for status, count in counts.items():
+            textfile.add(f'{prefix}_tasks', 'gauge', 'Number of tasks by final status', count, {'status': status})
+        textfile.add(f'{prefix}_task_attempts', 'gauge', 'Number of task attempts', attempts)
+        textfile.add(f'{prefix}_task_wall_seconds', 'gauge', 'Total seconds spent running tasks', wall_time)
+
+        textfile.add_registry(self.__metrics__)
+        return textfile
+
+    def write_prometheus_textfile(self, exit_code: int) -> None:
+        """
+        Write run metrics to file specified with --prometheus-textfile
+        """
+        if self.__prometheus_textfile__ is None:
+            return
+        try:
+            self.get_prometheus_textfile(exit_code).write(self.__prometheus_textfile__)
+        except ScriptError as error:
+            self.error(error)
+
+    def write_trace(self) -> None:
+        """
+        Write trace to file specified with --trace
+        """
+        if self.__trace_file__ is None:
+            return
+        try:
+            self.__trace_recorder__.write(self.__trace_file__)
+        except ScriptError as error:
+            self.error(error)
+
+    def create_event_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Create event loop for the script, using uvloop with use_uvloop if it is installed
+
+        Override to use a custom event loop
+        """
+        if self.use_uvloop:
+            try:
+                # pylint: disable=import-outside-toplevel
+                import uvloop
+                return uvloop.new_event_loop()
+            except ImportError:
+                pass
+        return asyncio.new_event_loop()
+
+    def __get_event_loop__(self) -> asyncio.AbstractEventLoop:
+        """
+        Return event loop of the script, creating the loop when first called
+        """
+        if self.__event_loop__ is None or self.__event_loop__.is_closed():
+            self.__event_loop__ = self.create_event_loop()
+            # Close loops of scripts not exited with exit()
+            weakref.finalize(self, self.__event_loop__.close)
+        return self.__event_loop__
+
+    def close_event_loop(self) -> None:
+        """
+        Cancel remaining tasks, shut down async generators and the default executor
+        and close the event loop of the script
+
+        Tasks started while cancelling tasks, like processes terminated and reaped by
+        cancelled command line tasks, are run or cancelled until no tasks remain. Tasks
+        terminating processes of cancelled command line tasks are not cancelled, so the
+        processes are killed and reaped before the loop is closed. The loop is not closed
+        while it is running.
+        """
+        loop = self.__event_loop__
+        if loop is None or loop.is_running():
+            return
+        self.__event_loop__ = None
+        try:
+            while True:
+                tasks = asyncio.all_tasks(loop)
+                if not tasks:
+                    break
+                for task in tasks:
+                    if task not in PROCESS_TERMINATE_TASKS:
+                        task.cancel()
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            loop.close()
+
+    def __running_command_line__(self) -> bool:
+        """
+        Check if the script is running a batch or invoked command line
+        """
+        return self.__batch_running__ or self.__invocations__ > 0
+
+    def exit(self, value: int = 0, message: Optional[str] = None) -> None:
+        """
+        Exit the script with given exit value, writing profile, metrics and trace files if enabled
+
+        When running a batch or an invocation, only the running command line is exited.
+        """
+        if self.__running_command_line__():
+            super().exit(value, message)
+            return
+        self.close_event_loop()
+        self.write_profile()
+        self.write_metrics()
+        self.write_prometheus_textfile(self.__get_exit_code__(value))
+        self.write_trace()
+        try:
+            super().exit(value, message)
+        finally:
+            self.flush_output()
+
+    def error(self, *args: List[Any]) -> None:
+        """
+        Send error message to stderr, buffered with buffered_output outside invocations
+        """
+        if self.__console_writer__ is None or INVOCATION_STREAMS.get() is not None:
+            super().error(*args)
+            return
+        self.__console_writer__.stderr.write(f'{self.__parse_string_args__(*args)}\n')
+
+    def message(self, *args: List[Any]) -> None:
+        """
+        Show message on stdout unless silent flag is set, buffered with buffered_output
+        outside invocations
+        """
+        if self.__console_writer__ is None or INVOCATION_STREAMS.get() is not None:
+            super().message(*args)
+            return
+        if self.__is_silent__:
+            return
+        self.__console_writer__.stdout.write(f'{self.__parse_string_args__(*args)}\n')
+
+    def flush_output(self) -> None:
+        """
+        Write buffered messages and errors to stdout and stderr
+        """
+        if self.__console_writer__ is not None:
+            self.__console_writer__.flush()
+
     def __process_args__(self, args: argparse.Namespace) -> argparse.Namespace:
         """
         Process args and run subcommand if detected
@@ -98,19 +737,49 @@ class Script(NestedCliCommand, metaclass=ScriptMetaClass):
         if getattr(args, 'quiet', None):
             self.__silent__ = True
 
+        self.__trace_file__ = getattr(args, 'trace', None)
+        if self.__trace_file__ is None:
+            self.__trace_recorder__.disable()
+
+        self.__profile_top__ = getattr(args, 'profile_top', DEFAULT_PROFILE_TOP_FUNCTIONS)
+        self.__profile_file__ = getattr(args, 'profile', None)
+        if self.__profile_file__ is not None:
+            if getattr(args, 'profile_sampler', False):
+                self.__profiler__ = SamplingProfiler()
+            else:
+                self.__profiler__ = CProfileProfiler()
+
+        self.__memory_profile_file__ = getattr(args, 'memprofile', None)
+        if self.__memory_profile_file__ is not None:
+            self.__memory_profiler__ = MemoryProfiler()
+
+        self.__status_file__ = getattr(args, 'status_file', None)
+        self.__status_stacks__ = getattr(args, 'status_stacks', False)
+
+        self.__metrics_file__ = getattr(args, 'metrics', None)
+        self.__prometheus_textfile__ = getattr(args, 'prometheus_textfile', None)
+        self.__metrics__.enabled = (
+            self.__metrics_file__ is not None or
+            self.__prometheus_textfile__ is not None or
+            self.__is_debug_enabled__
+        )
+
         return args
 
     def parse_args(self) -> argparse.Namespace:
         """
         Call parse_args for parser and check for default logging flags
         """
-        return self.__process_args__(self.__parser__.parse_args())
+        with self.__trace_recorder__.span('parse_args', 'startup'):
+            args = self.__parser__.parse_args()
+        return self.__process_args__(args)
 
     def parse_known_args(self) -> Tuple[argparse.Namespace, argparse.Namespace]:
         """
         Call parse_args for parser and check for default logging flags
         """
-        args, other_args = self.__parser__.parse_known_args()
+        with self.__trace_recorder__.span('parse_args', 'startup'):
+            args, other_args = self.__parser__.parse_known_args()
         args = self.__process_args__(args)
         return args, other_args
 
@@ -124,4 +793,200 @@ class Script(NestedCliCommand, metaclass=ScriptMetaClass):
         returned values since the subcommand is run.
         """
         args = self.parse_args()
+        if getattr(args, 'batch', None) is not None:
+            self.run_batch(args.batch, getattr(args, 'batch_jobs', 1))
         self.run_subcommand(args)
+
+    def __strip_script_name__(self, argv: List[str]) -> List[str]:
+        """
+        Remove script name from start of command line given as in shell, like tool subcmd --args
+
+        The first argument is removed if it is the script name or name of the script
+        executable and not a subcommand name.
+        """
+        if argv and argv[0] not in self.__subcommands__:
+            if Path(argv[0]).name in (self.name, Path(sys.argv[0]).name):
+                return argv[1:]
+        return argv
+
+    def __run_command_line__(self, argv: List[str], description: str) -> int:
+        """
+        Parse and run a command line in a batch or invocation, returning the exit code
+
+        Exits of the command, argument errors and exceptions stop the command line,
+        not the script. --debug and --quiet apply to the command line, other global
+        options are ignored. Tasks registered by previous command lines are removed
+        before running the command line.
+        """
+        argv = self.__strip_script_name__(argv)
+        for command in self.__iter_commands__():
+            command.__async_task_callbacks__ = []
+            command.__async_tasks__ = []
+        debug_enabled = self.__debug_enabled__
+        silent = self.__silent__
+        try:
+            args = self.__parser__.parse_args(argv)
+            if getattr(args, 'batch', None) is not None:
+                self.exit(2, f'{description} can not run a batch')
+            self.__debug_enabled__ = debug_enabled or args.debug
+            self.__silent__ = silent or args.quiet
+            self.run_subcommand(args)
+            exit_code = 0
+        except SystemExit as error:
+            if not self.__running_command_line__():
+                raise
+            exit_code = self.__get_exit_code__(error.code) if error.code is not None else 0
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.error(f'Error running {description}:\n{traceback.format_exc().rstrip()}')
+            exit_code = 1
+        finally:
+            self.__debug_enabled__ = debug_enabled
+            self.__silent__ = silent
+        return exit_code
+
+    def invoke(self,
+               argv: List[str],
+               stdout: Optional[TextIO] = None,
+               stderr: Optional[TextIO] = None) -> Invocation:
+        """
+        Run command line argv with the script and return exit code and output of the run
+
+        The script can be invoked repeatedly. Exit of the command does not raise
+        SystemExit and signal handlers are not changed. Output written to sys.stdout
+        and sys.stderr is captured while the command runs, or written to stdout and
+        stderr streams if given. Commands running async tasks can not be invoked from
+        a running event loop.
+
+        sys.stdout and sys.stderr are replaced with InvocationStream objects, which
+        write to the streams of the invocation running in the current thread or asyncio
+        task. Invocations can be nested and run in many threads at the same time, but
+        each thread should invoke its own script object.
+        """
+        stdout = stdout if stdout is not None else io.StringIO()
+        stderr = stderr if stderr is not None else io.StringIO()
+        InvocationStream.install()
+        token = INVOCATION_STREAMS.set({'stdout': stdout, 'stderr': stderr})
+        self.__invocations__ += 1
+        try:
+            exit_code = self.__run_command_line__(list(argv), ' '.join(argv))
+        finally:
+            self.__invocations__ -= 1
+            INVOCATION_STREAMS.reset(token)
+        return Invocation(exit_code, stdout, stderr)
+
+    def __run_batch_line__(self, batch_line: BatchLine) -> int:
+        """
+        Parse and run a batch command line, returning the exit code of the line
+        """
+        try:
+            argv = batch_line.argv
+        except ValueError as error:
+            self.error(f'Error parsing batch {batch_line}: {error}')
+            argv = None
+        batch_line.exit_code = self.__run_command_line__(argv, f'batch {batch_line}') if argv is not None else 2
+        return batch_line.exit_code
+
+    def __finish_batch_line__(self, batch_line: BatchLine) -> None:
+        """
+        Record exit code of a finished batch line and show failed lines
+        """
+        self.batch_lines.append(batch_line)
+        if batch_line.exit_code != 0:
+            self.error(f'Batch {batch_line} failed with exit code {batch_line.exit_code}')
+
+    def __wait_batch_process__(self, processes: Dict[int, BatchLine]) -> None:
+        """
+        Wait for a forked batch line process to finish
+        """
+        pid, status = os.waitpid(-1, 0)
+        batch_line = processes.pop(pid, None)
+        if batch_line is None:
+            return
+        exit_code = os.waitstatus_to_exitcode(status)
+        batch_line.exit_code = exit_code if exit_code >= 0 else 128 - exit_code
+        self.__finish_batch_line__(batch_line)
+
+    @staticmethod
+    def __stop_batch_processes__(processes: Dict[int, BatchLine]) -> None:
+        """
+        Terminate and reap forked batch line processes left running when the batch is stopped
+        """
+        for pid in processes:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in processes:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        processes.clear()
+
+    def __fork_batch_line__(self, batch_line: BatchLine) -> int:
+        """
+        Run batch line in a forked process, returning the pid of the process
+        """
+        self.flush_output()
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                exit_code = self.__run_batch_line__(batch_line)
+                self.flush_output()
+                for stream in (sys.stdout, sys.stderr):
+                    stream.flush()
+            finally:
+                os._exit(exit_code)  # pylint: disable=protected-access
+        return pid
+
+    def run_batch(self, path: str, jobs: int = 1) -> None:
+        """
+        Run command lines from file path, or from stdin if path is -, and exit
+
+        Lines are run one at a time in the script process, or with jobs larger than 1
+        in processes forked from the script. Exit codes of the lines are collected to
+        batch_lines. The script exits with code 1 if any line failed.
+
+        Interrupt signals stop the batch. If async tasks of a line are running, the
+        first signal drains the tasks and the batch is stopped when the line finishes.
+        Forked line processes still running when the script exits are terminated.
+        """
+        if not isinstance(jobs, int) or jobs < 1:
+            self.exit(1, f'Invalid number of batch jobs: {jobs}')
+        try:
+            # pylint: disable=consider-using-with
+            stream = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+        except OSError as error:
+            self.exit(1, f'Error reading batch file {path}: {error}')
+
+        self.batch_lines = []
+        processes = {}
+        self.__batch_running__ = True
+        try:
+            for batch_line in read_batch_lines(stream):
+                if self.__interrupt_signal__ is not None:
+                    break
+                if jobs == 1:
+                    self.__run_batch_line__(batch_line)
+                    self.__finish_batch_line__(batch_line)
+                    continue
+                while len(processes) >= jobs:
+                    self.__wait_batch_process__(processes)
+                processes[self.__fork_batch_line__(batch_line)] = batch_line
+            while processes:
+                self.__wait_batch_process__(processes)
+        finally:
+            self.__batch_running__ = False
+            self.__stop_batch_processes__(processes)
+            if stream is not sys.stdin:
+                stream.close()
+
+        failed = len([batch_line for batch_line in self.batch_lines if batch_line.exit_code != 0])
+        if self.__interrupt_signal__ is not None:
+            self.exit(1, f'Batch interrupted after {len(self.batch_lines)} lines')
+        if failed:
+            self.exit(1, f'{failed} of {len(self.batch_lines)} batch lines failed')
+        self.exit(0)
@@ -11,11 +11,29 @@ concurrently from script's run() method.
 """
 import asyncio
 import locale
+import signal
+import weakref
 
-from typing import Any, Awaitable, Dict, List, Tuple, TYPE_CHECKING
+from typing import Any, Awaitable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from .exceptions import TaskError
+from .output import TASK_OUTPUT_STDERR, TASK_OUTPUT_STDOUT
+from .process import AsyncProcess, ProcessResourceUsage
 
 if TYPE_CHECKING:
     from .base import NestedCliCommand
+    from .output import TaskOutputBuffer, TaskOutputWriter
+    from .retry import RetryPolicy
+    from .scheduler import TaskScheduler
+
+TASK_STATUS_PENDING = 'pending'
+TASK_STATUS_RUNNING = 'running'
+TASK_STATUS_SUCCEEDED = 'succeeded'
+TASK_STATUS_FAILED = 'failed'
+TASK_STATUS_CANCELLED = 'cancelled'
+
+# Tasks terminating processes of cancelled tasks, not cancelled when the event loop is closed
+PROCESS_TERMINATE_TASKS = weakref.WeakSet()
 
 
 class BaseScriptTask:
@@ -25,30 +43,160 @@ class BaseScriptTask:
     :param parent: Parent script or command
     :type parent: Script, Command
 
+    :param retry_policy: Policy for retrying failed task attempts
+    :type retry_policy: RetryPolicy
+
+    :param rate_limiter: Name of rate limiter for task launches
+    :type rate_limiter: str
+
+    :param priority: Scheduling priority, tasks with higher priority are started first
+    :type priority: int
+
+    :param history_key: Key for the task in task duration history
+    :type history_key: str
+
     :param kwargs: Arguments passed to the task when run
     :type kwargs: dict
+
+    Task runner updates status, attempts, queue_time (seconds waiting for rate limits and
+    concurrency slots) and wall_time (seconds running the task attempts). While an
+    attempt is running, start_time is the time.monotonic() value when it was started.
+
+    Messages and errors of the task are prefixed with the task name when parent has
+    task_output_prefix set, and buffered until the task finishes when parent groups
+    task output with task_output_mode.
     """
     parent: 'NestedCliCommand'
     messages: List[str]
     errors: List[str]
+    status: str
+    attempts: int
+    queue_time: float
+    wall_time: float
+    start_time: Optional[float]
+    __output_buffer__: Optional['TaskOutputBuffer']
+    retry_policy: Optional['RetryPolicy'] = None
+    rate_limiter: Optional[str] = None
+    priority: int = 0
+    expected_duration: Optional[float] = None
 
-    def __init__(self, parent: 'NestedCliCommand', **kwargs: Dict[Any, Any]) -> None:
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 parent: 'NestedCliCommand',
+                 retry_policy: Optional['RetryPolicy'] = None,
+                 rate_limiter: Optional[str] = None,
+                 priority: Optional[int] = None,
+                 history_key: Optional[str] = None,
+                 **kwargs: Dict[Any, Any]) -> None:
         self.parent = parent
         self.messages = []
         self.errors = []
+        self.status = TASK_STATUS_PENDING
+        self.attempts = 0
+        self.queue_time = 0.0
+        self.wall_time = 0.0
+        self.start_time = None
+        self.__output_buffer__ = None
+        self.__task_kwargs__ = kwargs
+        self.__history_key__ = history_key
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        if rate_limiter is not None:
+            self.rate_limiter = rate_limiter
+        if priority is not None:
+            self.priority = priority
         parent.add_async_task(self.run, **kwargs)
 
+    def __repr__(self) -> str:
+        """
+        Return task class name
+        """
+        return self.__class__.__name__
+
+    @staticmethod
+    def __format_history_value__(value: Any) -> str:
+        """
+        Format task argument value for history key
+
+        Values other than strings, numbers, booleans, None and sequences of these are
+        formatted as class name, because their repr() may change between runs.
+        """
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return repr(value)
+        if isinstance(value, (list, tuple)):
+            values = ', '.join(BaseScriptTask.__format_history_value__(item) for item in value)
+            return f'[{values}]'
+        return value.__class__.__name__
+
+    @property
+    def history_key(self) -> str:
+        """
+        Return key for the task in task duration history
+
+        The key given with history_key argument is used if set. Otherwise the key
+        contains the task name and arguments passed to the task, so tasks of the same
+        class run with different arguments have separate duration history.
+        """
+        if self.__history_key__ is not None:
+            return self.__history_key__
+        if not self.__task_kwargs__:
+            return repr(self)
+        args = ' '.join(
+            f'{key}={self.__format_history_value__(value)}'
+            for key, value in sorted(self.__task_kwargs__.items())
+        )
+        return f'{self!r} {args}'
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Return task status and resource usage as dictionary
+        """
+        return {
+            'task': repr(self),
+            'status': self.status,
+            'attempts': self.attempts,
+            'queue_time': self.queue_time,
+            'wall_time': self.wall_time,
+        }
+
+    async def __acquire_slot__(self, scheduler: 'TaskScheduler', sort_key: Any) -> None:
+        """
+        Wait for a concurrency slot of the task scheduler for a task attempt
+        """
+        await scheduler.acquire(sort_key)
+
+    def __release_slot__(self, scheduler: 'TaskScheduler') -> None:
+        """
+        Release concurrency slot of the task scheduler after a task attempt
+        """
+        scheduler.release()
+
+    def __format_output__(self, *args: List[Any]) -> str:
+        """
+        Format message arguments, prefixing lines with task name with task_output_prefix
+        """
+        text = self.parent.__parse_string_args__(*args)
+        if self.parent.task_output_prefix:
+            text = '\n'.join(f'{self}: {line}' for line in text.split('\n'))
+        return text
+
     def error(self, *args: List[Any]) -> None:
         """
         Send subtask errors to parent
         """
-        return self.parent.error(*args)
+        text = self.__format_output__(*args)
+        if self.__output_buffer__ is not None:
+            return self.__output_buffer__.write(TASK_OUTPUT_STDERR, text)
+        return self.parent.error(text)
 
     def message(self, *args: List[Any]) -> None:
         """
         Send subtask messages to arent
         """
-        return self.parent.message(*args)
+        text = self.__format_output__(*args)
+        if self.__output_buffer__ is not None:
+            return self.__output_buffer__.write(TASK_OUTPUT_STDOUT, text)
+        return self.parent.message(text)
 
     async def run(self, **kwargs: Dict[Any, Any]) -> None:
         """
@@ -62,15 +210,109 @@ class CommandLineTask(BaseScriptTask):
     Shell command task linked to CLI script or command
 
     Runs a non-interactive shell command with specified arguments
+
+    If expected_return_codes is set, the task fails with TaskError when the
+    command returns any other exit code. When the task is cancelled, the
+    running process is terminated and killed if it does not exit within
+    terminate_timeout seconds.
+
+    CPU time and maximum resident set size of the processes are summed over
+    task attempts to resource_usage. The running child process is available as process.
+
+    With new_process_group the command is started in a new session and process group,
+    and signals sent by the task are sent to the whole process group.
+
+    When the parent runs tasks with task_output_thread, output of the command is read
+    in chunks of output_chunk_size bytes and passed to the task output writer thread
+    instead of process_stdout() and process_stderr().
     """
     command: Tuple[str]
+    returncode: Optional[int]
+    process: Optional[AsyncProcess]
+    resource_usage: Optional[ProcessResourceUsage]
+    expected_return_codes: Optional[Tuple[int]] = None
+    terminate_timeout: float = 5.0
+    new_process_group: bool = False
+    output_chunk_size: int = 65536
 
     def __init__(self,
                  parent: 'NestedCliCommand',
                  command: Tuple[str],
+                 expected_return_codes: Optional[Tuple[int]] = None,
                  **kwargs: Dict[Any, Any]) -> None:
         super().__init__(parent, **kwargs)
         self.command = command
+        self.returncode = None
+        self.resource_usage = None
+        self.process = None
+        if expected_return_codes is not None:
+            self.expected_return_codes = expected_return_codes
+
+    def __repr__(self) -> str:
+        """
+        Return the shell command run by task
+        """
+        return ' '.join(str(arg) for arg in self.command)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Return task status and resource usage including process CPU time and memory
+        """
+        stats = super().get_stats()
+        stats['returncode'] = self.returncode
+        if self.resource_usage is not None:
+            stats.update(self.resource_usage.as_dict())
+        return stats
+
+    def __add_resource_usage__(self, process: AsyncProcess) -> None:
+        """
+        Add resource usage of finished process to task resource usage
+        """
+        if process.resource_usage is None:
+            return
+        if self.resource_usage is None:
+            self.resource_usage = ProcessResourceUsage()
+        self.resource_usage.user_time += process.resource_usage.user_time
+        self.resource_usage.system_time += process.resource_usage.system_time
+        self.resource_usage.max_rss = max(self.resource_usage.max_rss, process.resource_usage.max_rss)
+
+    def send_signal(self, signum: int) -> None:
+        """
+        Send signal to running process, or its process group with new_process_group
+        """
+        if self.process is not None:
+            self.process.send_signal(signum, process_group=self.new_process_group)
+
+    async def terminate_process(self, process: AsyncProcess) -> None:
+        """
+        Terminate running process, killing it if it does not exit in terminate_timeout
+        """
+        try:
+            process.send_signal(signal.SIGTERM, process_group=self.new_process_group)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=self.terminate_timeout)
+            except asyncio.TimeoutError:
+                process.send_signal(signal.SIGKILL, process_group=self.new_process_group)
+                await process.wait()
+        except ProcessLookupError:
+            pass
+
+    async def __stop_process__(self, process: AsyncProcess) -> None:
+        """
+        Terminate process of cancelled task and process output already read from the process
+
+        This is run in a task that is not cancelled. Cancelling the process waiter when the
+        event loop is closed does not stop terminating and reaping the process.
+        """
+        while True:
+            try:
+                await self.terminate_process(process)
+                break
+            except asyncio.CancelledError:
+                if process.returncode is not None:
+                    break
+        process.close_pipes()
+        await self.__process_output__(process)
 
     async def process_stderr(self, stderr: List[bytes]) -> None:
         """
@@ -90,18 +332,62 @@ class CommandLineTask(BaseScriptTask):
             self.messages.append(message)
             self.message(message)
 
+    async def write_output(self, stream: asyncio.StreamReader, name: str, writer: 'TaskOutputWriter') -> None:
+        """
+        Pass output of the process stream to task output writer in chunks
+        """
+        while True:
+            chunk = await stream.read(self.output_chunk_size)
+            if not chunk:
+                break
+            await writer.write(self, name, chunk)
+        await writer.close(self, name)
+
+    async def __process_output__(self, process: AsyncProcess) -> None:
+        """
+        Process stdout and stderr of the process
+        """
+        writer = self.parent.__get_task_output_writer__()
+        if writer is None:
+            await self.process_stdout(process.stdout)
+            await self.process_stderr(process.stderr)
+            return
+        await asyncio.gather(
+            self.write_output(process.stdout, TASK_OUTPUT_STDOUT, writer),
+            self.write_output(process.stderr, TASK_OUTPUT_STDERR, writer),
+        )
+
     async def run(self, **kwargs: Dict[Any, Any]) -> Awaitable[None]:
         """
         Run specified shell command with asyncio
         """
-        process = await asyncio.create_subprocess_exec(
-            *self.command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        await self.process_stdout(process.stdout)
-        await self.process_stderr(process.stderr)
-        return await process.wait()
+        process = await AsyncProcess.create(*self.command, start_new_session=self.new_process_group)
+        self.process = process
+        trace_recorder = self.parent.__get_trace_recorder__()
+        if trace_recorder is not None:
+            trace_recorder.begin_async(repr(self), 'process', process.pid, {'pid': process.pid})
+        try:
+            await self.__process_output__(process)
+            self.returncode = await process.wait()
+        except asyncio.CancelledError:
+            # Keep waiting if cancelled again, for example when the event loop is closed
+            terminate = asyncio.ensure_future(self.__stop_process__(process))
+            PROCESS_TERMINATE_TASKS.add(terminate)
+            while not terminate.done():
+                try:
+                    await asyncio.shield(terminate)
+                except asyncio.CancelledError:
+                    pass
+            raise
+        finally:
+            self.process = None
+            self.__add_resource_usage__(process)
+            if trace_recorder is not None:
+                trace_recorder.end_async(repr(self), 'process', process.pid, {'returncode': process.returncode})
+
+        if self.expected_return_codes is not None and self.returncode not in self.expected_return_codes:
+            raise TaskError(f'Error running {self}: returns {self.returncode}')
+        return self.returncode
 
 
 class Task(BaseScriptTask):
@@ -0,0 +1,190 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Trace Event Format recorder for scripts and tasks
+
+Recorded traces are written as JSON files that can be opened with chrome://tracing,
+Perfetto UI and other trace viewers supporting the Trace Event Format.
+"""
+import itertools
+import json
+import os
+import time
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from .exceptions import ScriptError
+
+TRACE_MAIN_THREAD_ID = 0
+TRACE_LANE_THREAD_ID_OFFSET = 1
+
+
+class TraceRecorder:
+    """
+    Recorder for trace events
+
+    Synchronous spans are recorded as complete events on a thread ID. Task attempts
+    are recorded on 'lanes', each lane showing one concurrently running task at a
+    time. Overlapping spans such as task lifetimes and queue waits are recorded as
+    async events.
+    """
+    enabled: bool
+    events: List[Dict[str, Any]]
+    pid: int
+
+    def __init__(self) -> None:
+        self.enabled = True
+        self.events = []
+        self.pid = os.getpid()
+        self.__start__ = time.perf_counter()
+        self.__open_spans__: Dict[int, Dict[str, Any]] = {}
+        self.__span_ids__ = itertools.count(1)
+        self.__lanes__: List[bool] = []
+
+    def timestamp(self) -> float:
+        """
+        Return current trace timestamp in microseconds
+        """
+        return (time.perf_counter() - self.__start__) * 1000000
+
+    def disable(self) -> None:
+        """
+        Disable recording and discard recorded events
+        """
+        self.enabled = False
+        self.events = []
+        self.__open_spans__ = {}
+
+    def get_span_id(self) -> int:
+        """
+        Return unique ID for async spans
+        """
+        return next(self.__span_ids__)
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        """
+        Add trace event if recording is enabled
+        """
+        if self.enabled:
+            event.setdefault('pid', self.pid)
+            event.setdefault('tid', TRACE_MAIN_THREAD_ID)
+            self.events.append(event)
+
+    def add_complete_event(self,
+                           name: str,
+                           category: str,
+                           start: float,
+                           end: Optional[float] = None,
+                           tid: int = TRACE_MAIN_THREAD_ID,
+                           args: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Add complete event with start timestamp and end timestamp, by default now
+        """
+        if end is None:
+            end = self.timestamp()
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start, 'dur': end - start, 'tid': tid}
+        if args:
+            event['args'] = args
+        self.add_event(event)
+
+    @contextmanager
+    def span(self,
+             name: str,
+             category: str,
+             tid: int = TRACE_MAIN_THREAD_ID,
+             args: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+        """
+        Record a complete event for the duration of the context
+
+        Spans still open when the trace is written are closed at write time
+        """
+        if not self.enabled:
+            yield
+            return
+        span_id = self.get_span_id()
+        start = self.timestamp()
+        self.__open_spans__[span_id] = {'name': name, 'category': category, 'start': start, 'tid': tid, 'args': args}
+        try:
+            yield
+        finally:
+            if self.__open_spans__.pop(span_id, None) is not None:
+                self.add_complete_event(name, category, start, tid=tid, args=args)
+
+    def begin_async(self,
+                    name: str,
+                    category: str,
+                    span_id: int,
+                    args: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Record start of async span
+        """
+        event = {'name': name, 'cat': category, 'ph': 'b', 'id': span_id, 'ts': self.timestamp()}
+        if args:
+            event['args'] = args
+        self.add_event(event)
+
+    def end_async(self,
+                  name: str,
+                  category: str,
+                  span_id: int,
+                  args: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Record end of async span
+        """
+        event = {'name': name, 'cat': category, 'ph': 'e', 'id': span_id, 'ts': self.timestamp()}
+        if args:
+            event['args'] = args
+        self.add_event(event)
+
+    def acquire_lane(self) -> int:
+        """
+        Reserve first free lane for a running task and return lane thread ID
+        """
+        for index, in_use in enumerate(self.__lanes__):
+            if not in_use:
+                self.__lanes__[index] = True
+                return index + TRACE_LANE_THREAD_ID_OFFSET
+        self.__lanes__.append(True)
+        lane = len(self.__lanes__) - 1 + TRACE_LANE_THREAD_ID_OFFSET
+        self.add_event({'name': 'thread_name', 'ph': 'M', 'tid': lane, 'args': {'name': f'task lane {lane}'}})
+        return lane
+
+    def release_lane(self, lane: int) -> None:
+        """
+        Release lane reserved with acquire_lane
+        """
+        self.__lanes__[lane - TRACE_LANE_THREAD_ID_OFFSET] = False
+
+    def get_trace(self) -> Dict[str, Any]:
+        """
+        Return recorded events as Trace Event Format dictionary, closing open spans
+        """
+        end = self.timestamp()
+        events = list(self.events)
+        events.append({
+            'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': TRACE_MAIN_THREAD_ID,
+            'args': {'name': 'main'},
+        })
+        for span in self.__open_spans__.values():
+            event = {
+                'name': span['name'], 'cat': span['category'], 'ph': 'X', 'pid': self.pid, 'tid': span['tid'],
+                'ts': span['start'], 'dur': end - span['start'],
+            }
+            if span['args']:
+                event['args'] = span['args']
+            events.append(event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path: str) -> None:
+        """
+        Write recorded trace to JSON file
+        """
+        try:
+            with open(path, 'w', encoding='utf-8') as filedescriptor:
+                json.dump(self.get_trace(), filedescriptor)
+        except OSError as error:
+            raise ScriptError(f'Error writing trace file {path}: {error}') from error
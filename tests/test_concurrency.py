@@ -0,0 +1,181 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.concurrency module
+"""
+import asyncio
+
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+
+from cli_toolkit.concurrency import (
+    AdaptiveConcurrencyController,
+    get_available_memory,
+    get_cpu_count,
+    get_load_per_cpu,
+)
+from cli_toolkit.exceptions import ScriptError
+from cli_toolkit.script import Script
+from cli_toolkit.task import Task
+
+MEMINFO = """MemTotal:       16000000 kB
+MemFree:         1000000 kB
+MemAvailable:    4000000 kB
+"""
+
+
+class FastController(AdaptiveConcurrencyController):
+    """
+    Adaptive concurrency controller with short update interval
+    """
+    interval = 0.05
+
+
+class AdaptiveScript(Script):
+    """
+    Script with adaptive concurrency
+    """
+    adaptive_concurrency = True
+    min_concurrent_tasks = 1
+    max_concurrent_tasks = 4
+
+    def create_concurrency_controller(self) -> AdaptiveConcurrencyController:
+        controller = FastController(self.min_concurrent_tasks, self.max_concurrent_tasks)
+        controller.limit = 1
+        return controller
+
+
+class SleepTask(Task):
+    """
+    Test task sleeping for a while
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        await asyncio.sleep(0.1)
+
+
+def mock_system_state(monkeypatch, load: float = 0.1, memory: float = 0.5) -> None:
+    """
+    Mock system load and available memory
+    """
+    monkeypatch.setattr('cli_toolkit.concurrency.get_load_per_cpu', lambda: load)
+    monkeypatch.setattr('cli_toolkit.concurrency.get_available_memory', lambda: memory)
+
+
+def test_concurrency_system_state(monkeypatch, tmpdir) -> None:
+    """
+    Test reading system state values
+    """
+    assert get_cpu_count() >= 1
+    load = get_load_per_cpu()
+    assert load is None or load >= 0
+
+    meminfo = Path(tmpdir.strpath, 'meminfo')
+    meminfo.write_text(MEMINFO, encoding='utf-8')
+    monkeypatch.setattr('cli_toolkit.concurrency.MEMINFO_PATH', meminfo)
+    assert get_available_memory() == 0.25
+    monkeypatch.setattr('cli_toolkit.concurrency.MEMINFO_PATH', Path(tmpdir.strpath, 'missing'))
+    assert get_available_memory() is None
+
+
+def test_concurrency_controller_invalid_bounds() -> None:
+    """
+    Test creating controller with invalid bounds
+    """
+    with pytest.raises(ScriptError):
+        AdaptiveConcurrencyController(0, 4)
+    with pytest.raises(ScriptError):
+        AdaptiveConcurrencyController(4, 2)
+
+
+def test_concurrency_controller_increase(monkeypatch) -> None:
+    """
+    Test controller increases limit when tasks are waiting
+    """
+    mock_system_state(monkeypatch)
+    controller = AdaptiveConcurrencyController(1, 3)
+    controller.limit = 2
+    assert controller.update(running=2, queued=0) == (2, None)
+    assert controller.update(running=2, queued=5) == (3, '5 tasks queued')
+    assert controller.update(running=3, queued=5) == (3, None)
+
+
+def test_concurrency_controller_decrease_load(monkeypatch) -> None:
+    """
+    Test controller decreases limit on high load with cooldown
+    """
+    mock_system_state(monkeypatch, load=4)
+    controller = AdaptiveConcurrencyController(2, 16)
+    controller.limit = 16
+    limit, reason = controller.update(running=16, queued=5)
+    assert limit == 8
+    assert 'load 4.00/cpu' in reason
+    assert controller.update(running=16, queued=5) == (8, None)
+
+
+def test_concurrency_controller_decrease_memory(monkeypatch) -> None:
+    """
+    Test controller decreases limit on low memory down to minimum
+    """
+    mock_system_state(monkeypatch, memory=0.01)
+    controller = AdaptiveConcurrencyController(2, 16)
+    controller.limit = 3
+    limit, reason = controller.update(running=3, queued=0)
+    assert limit == 2
+    assert 'available memory' in reason
+
+
+def test_concurrency_controller_decrease_latency(monkeypatch) -> None:
+    """
+    Test controller decreases limit when task latency increases
+    """
+    mock_system_state(monkeypatch)
+    controller = AdaptiveConcurrencyController(1, 16)
+    controller.limit = 8
+    controller.record_latency(1)
+    assert controller.update(running=8, queued=0) == (8, None)
+    controller.record_latency(3)
+    limit, reason = controller.update(running=8, queued=0)
+    assert limit == 4
+    assert 'latency 3.0x baseline' in reason
+
+
+def test_concurrency_controller_mixed_latency(monkeypatch) -> None:
+    """
+    Test controller does not decrease limit for tasks with different durations
+    """
+    mock_system_state(monkeypatch)
+    controller = AdaptiveConcurrencyController(1, 16)
+    controller.limit = 8
+    for _count in range(5):
+        for _index in range(10):
+            controller.record_latency(0.01, 'short')
+        assert controller.update(running=8, queued=0) == (8, None)
+        controller.record_latency(1, 'long')
+        assert controller.update(running=8, queued=0) == (8, None)
+    controller.record_latency(3, 'long')
+    limit, reason = controller.update(running=8, queued=0)
+    assert limit == 4
+    assert 'latency 3.0x baseline' in reason
+
+
+def test_concurrency_adaptive_script(monkeypatch, capsys) -> None:
+    """
+    Test running tasks with adaptive concurrency logs limit changes with debug
+    """
+    mock_system_state(monkeypatch)
+    script = AdaptiveScript()
+    script.__debug_enabled__ = True
+    for _ in range(10):
+        SleepTask(script)
+    script.run_async_tasks()
+    errors = capsys.readouterr().err.splitlines()
+    assert 'Adaptive concurrency initial limit 1' in errors
+    assert 'Adaptive concurrency 1 -> 2: 9 tasks queued' in errors
@@ -0,0 +1,201 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.daemon module
+"""
+import os
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import pytest
+
+from cli_toolkit.daemon import DaemonClient, ScriptDaemon, get_daemon_socket_path, load_script_class, run_script
+from cli_toolkit.exceptions import ScriptError
+
+SCRIPT_MODULE = """
+import os
+import sys
+
+from cli_toolkit.script import Script
+
+VERSION = '{version}'
+
+
+class DaemonTestScript(Script):
+    def register_parser_arguments(self, parser):
+        parser.add_argument('--exit-code', type=int, default=0)
+        parser.add_argument('words', nargs='*')
+        return parser
+
+    def run(self):
+        args = self.parse_args()
+        stdin = sys.stdin.read().strip()
+        self.message(VERSION, os.getcwd(), os.environ.get('DAEMON_TEST', ''), stdin, *args.words)
+        self.exit(args.exit_code)
+"""
+SCRIPT = 'daemon_test_script:DaemonTestScript'
+
+
+def write_script_module(directory: str, version: str) -> None:
+    """
+    Write test script module with version string
+    """
+    path = Path(directory, 'daemon_test_script.py')
+    mtime = path.stat().st_mtime_ns if path.exists() else None
+    path.write_text(SCRIPT_MODULE.format(version=version), encoding='utf-8')
+    if mtime is not None:
+        # Make sure the modification is detected with coarse file timestamps
+        os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+
+def run_client(tmpdir, socket_path: str, *args: str) -> Tuple[Optional[int], str]:
+    """
+    Run test script with daemon client, returning exit code and output
+    """
+    output_path = os.path.join(tmpdir.strpath, 'output.txt')
+    with open(os.path.join(tmpdir.strpath, 'input.txt'), 'w', encoding='utf-8') as stdin:
+        stdin.write('input\n')
+    with open(os.path.join(tmpdir.strpath, 'input.txt'), 'rb') as stdin:
+        with open(output_path, 'wb') as stdout:
+            exit_code = DaemonClient(socket_path).run(
+                argv=['daemon-test'] + list(args),
+                env={'DAEMON_TEST': 'env'},
+                cwd=tmpdir.strpath,
+                stdio=(stdin.fileno(), stdout.fileno(), stdout.fileno()),
+            )
+    with open(output_path, 'r', encoding='utf-8') as output:
+        return exit_code, output.read()
+
+
+@pytest.fixture(name='daemon')
+def daemon_fixture(tmpdir) -> Iterator[str]:
+    """
+    Run daemon for test script module in a subprocess, returning the socket path
+    """
+    write_script_module(tmpdir.strpath, 'v1')
+    socket_path = os.path.join(tmpdir.strpath, 'daemon.sock')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([tmpdir.strpath, os.getcwd()])
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, '-m', 'cli_toolkit.daemon', '--socket', socket_path, '--reload-interval', '0.1', SCRIPT],
+        env=env,
+        stdin=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_socket(socket_path)
+        yield socket_path
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def wait_for_socket(socket_path: str, timeout: float = 10) -> None:
+    """
+    Wait for the daemon to listen on the socket
+    """
+    start = time.monotonic()
+    while not os.path.exists(socket_path):
+        assert time.monotonic() - start < timeout
+        time.sleep(0.05)
+
+
+def test_daemon_socket_path(monkeypatch) -> None:
+    """
+    Test default daemon socket paths
+    """
+    monkeypatch.setenv('XDG_RUNTIME_DIR', '/run/user/1000')
+    assert get_daemon_socket_path('tool.cli:Script') == '/run/user/1000/cli-toolkit-tool.cli-Script.sock'
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    assert get_daemon_socket_path('tool:Script').endswith(f'cli-toolkit-{os.getuid()}/cli-toolkit-tool-Script.sock')
+
+
+def test_daemon_load_script_class_errors() -> None:
+    """
+    Test errors loading script classes
+    """
+    assert load_script_class('cli_toolkit.script:Script').__name__ == 'Script'
+    for script in ('cli_toolkit.script', 'cli_toolkit.missing:Script', 'cli_toolkit.script:Missing'):
+        with pytest.raises(ScriptError):
+            load_script_class(script)
+
+
+def test_daemon_client_no_daemon(tmpdir) -> None:
+    """
+    Test daemon client returns None when no daemon is listening
+    """
+    socket_path = os.path.join(tmpdir.strpath, 'daemon.sock')
+    assert DaemonClient(socket_path).run() is None
+    Path(socket_path).touch()
+    assert DaemonClient(socket_path).run() is None
+
+
+def test_daemon_run_script_in_process(monkeypatch, tmpdir, capsys) -> None:
+    """
+    Test running script in process when no daemon is listening
+    """
+    write_script_module(tmpdir.strpath, 'v1')
+    monkeypatch.syspath_prepend(tmpdir.strpath)
+    monkeypatch.setattr(sys, 'argv', ['daemon-test', 'word'])
+    monkeypatch.setattr(sys, 'stdin', open(os.devnull, 'r', encoding='utf-8'))  # pylint: disable=consider-using-with
+    with pytest.raises(SystemExit) as exit_status:
+        run_script(SCRIPT, os.path.join(tmpdir.strpath, 'daemon.sock'))
+    sys.stdin.close()
+    sys.modules.pop('daemon_test_script', None)
+    assert exit_status.value.code == 0
+    assert capsys.readouterr().out.split() == ['v1', os.getcwd(), 'word']
+
+
+def test_daemon_run(daemon, tmpdir) -> None:
+    """
+    Test running script in daemon with arguments, environment, working directory and stdio of client
+    """
+    assert run_client(tmpdir, daemon, 'first', 'second') == (0, f'v1 {tmpdir.strpath} env input first second\n')
+    assert run_client(tmpdir, daemon, '--exit-code', '3') == (3, f'v1 {tmpdir.strpath} env input\n')
+    exit_code, output = run_client(tmpdir, daemon, '--invalid')
+    assert exit_code == 2
+    assert 'unrecognized arguments' in output
+
+
+@pytest.mark.parametrize('args', (['--help'], ['--invalid']))
+def test_daemon_run_output_matches_in_process(daemon, tmpdir, monkeypatch, capsys, args) -> None:
+    """
+    Test usage and errors of the script run in daemon match the script run in process
+    """
+    monkeypatch.delenv('COLUMNS', raising=False)
+    monkeypatch.syspath_prepend(tmpdir.strpath)
+    monkeypatch.setattr(sys, 'argv', ['daemon-test'] + args)
+    with pytest.raises(SystemExit) as exit_status:
+        run_script(SCRIPT, os.path.join(tmpdir.strpath, 'missing.sock'))
+    sys.modules.pop('daemon_test_script', None)
+    output = capsys.readouterr()
+    assert run_client(tmpdir, daemon, *args) == (exit_status.value.code, output.out + output.err)
+
+
+def test_daemon_already_running(daemon) -> None:
+    """
+    Test starting daemon on socket of a running daemon
+    """
+    with pytest.raises(ScriptError):
+        ScriptDaemon('cli_toolkit.script:Script', daemon).__bind__()
+
+
+def test_daemon_reload(daemon, tmpdir) -> None:
+    """
+    Test daemon is restarted when the script module changes
+    """
+    assert run_client(tmpdir, daemon)[1].startswith('v1 ')
+    write_script_module(tmpdir.strpath, 'v2')
+    start = time.monotonic()
+    while True:
+        assert time.monotonic() - start < 10
+        exit_code, output = run_client(tmpdir, daemon)
+        if exit_code is not None and output.startswith('v2 '):
+            break
+        time.sleep(0.1)
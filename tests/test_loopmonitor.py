@@ -0,0 +1,124 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.loopmonitor module
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from typing import Any, Dict
+
+import pytest
+
+from cli_toolkit.command import Command
+from cli_toolkit.loopmonitor import EventLoopMonitor, SlowCallback
+from cli_toolkit.script import Script
+from cli_toolkit.task import Task
+
+
+class BlockingTask(Task):
+    """
+    Test task blocking the event loop
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        await asyncio.sleep(0.1)
+        time.sleep(0.3)
+
+
+class MonitoredCommand(Command):
+    """
+    Test command running tasks with event loop monitor
+    """
+    name = 'tasks'
+    task_summary = True
+    event_loop_monitor = True
+    event_loop_monitor_interval = 0.02
+    event_loop_lag_threshold = 0.1
+
+    def run(self, args: argparse.Namespace) -> None:
+        BlockingTask(self)
+        self.run_subcommand(args)
+
+
+class MonitorScript(Script):
+    """
+    Test script with subcommand running tasks with event loop monitor
+    """
+    subcommands = (
+        MonitoredCommand,
+    )
+
+
+def test_slow_callback() -> None:
+    """
+    Test formatting slow callbacks
+    """
+    assert repr(SlowCallback(0.5)) == 'event loop lag 0.500s'
+    slow_callback = SlowCallback(0.5, 'task', 'test.py:1 in run')
+    assert repr(slow_callback) == 'event loop blocked for 0.500s by task task at test.py:1 in run'
+    assert slow_callback.as_dict() == {'lag': 0.5, 'task': 'task', 'location': 'test.py:1 in run'}
+
+
+def test_event_loop_monitor_percentiles() -> None:
+    """
+    Test lag percentiles with nearest rank method
+    """
+    monitor = EventLoopMonitor()
+    assert monitor.get_percentiles() == {}
+    monitor.lags = [value / 100 for value in range(100, 0, -1)]
+    assert monitor.get_percentiles() == {'p50': 0.5, 'p90': 0.9, 'p99': 0.99, 'max': 1.0}
+    assert monitor.get_percentiles((0,)) == {'p0': 0.01, 'max': 1.0}
+
+
+def test_event_loop_monitor_blocking() -> None:
+    """
+    Test monitor attributes blocking callback to the blocking task
+    """
+    reported = []
+
+    async def blocking() -> None:
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)
+
+    async def monitored() -> EventLoopMonitor:
+        monitor = EventLoopMonitor(interval=0.01, threshold=0.1, callback=reported.append)
+        monitor.start()
+        await asyncio.create_task(blocking(), name='blocking task')
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        return monitor
+
+    monitor = asyncio.run(monitored())
+    assert len(monitor.lags) > 5
+    assert monitor.slow_callbacks == reported
+    assert len(reported) == 1
+    assert reported[0].lag >= 0.1
+    assert reported[0].task == 'blocking task'
+    assert 'in blocking' in reported[0].location
+
+
+def test_event_loop_monitor_script(monkeypatch, capsys) -> None:
+    """
+    Test reporting slow callbacks and lag percentiles when running script tasks
+    """
+    script = MonitorScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--debug', 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+
+    errors = capsys.readouterr().err.splitlines()
+    slow_callbacks = [line for line in errors if line.startswith('Slow callback: ')]
+    assert len(slow_callbacks) == 1, errors
+    assert 'by task BlockingTask' in slow_callbacks[0]
+    assert 'in run' in slow_callbacks[0]
+    assert any(line.startswith('Event loop lag: ') and '1 slow callbacks' in line for line in errors)
+    assert script.metrics.histogram('event_loop_lag_seconds').count > 0
@@ -0,0 +1,189 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.metrics module
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from typing import Any, Dict
+
+import pytest
+
+from cli_toolkit.command import Command
+from cli_toolkit.exceptions import ScriptError
+from cli_toolkit.metrics import MetricsRegistry
+from cli_toolkit.script import Script
+from cli_toolkit.task import Task
+
+
+class CountingTask(Task):
+    """
+    Test task updating metrics
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        with self.parent.metrics.timer('task_seconds'):
+            self.parent.metrics.counter('items_processed').inc(10)
+
+
+class MetricsCommand(Command):
+    """
+    Test command running tasks updating metrics
+    """
+    name = 'tasks'
+
+    def run(self, args: argparse.Namespace) -> None:
+        self.metrics.gauge('queue_length').set(2)
+        CountingTask(self)
+        CountingTask(self)
+        self.run_subcommand(args)
+
+
+class MetricsScript(Script):
+    """
+    Test script with subcommand updating metrics
+    """
+    subcommands = (
+        MetricsCommand,
+    )
+
+
+def test_metrics_registry() -> None:
+    """
+    Test counters, gauges and histograms of metrics registry
+    """
+    registry = MetricsRegistry()
+    counter = registry.counter('items', 'Processed items')
+    counter.inc()
+    counter.inc(2)
+    assert registry.counter('items') is counter
+    assert counter.value == 3
+    with pytest.raises(ScriptError):
+        counter.inc(-1)
+
+    gauge = registry.gauge('queue')
+    gauge.set(5)
+    gauge.inc()
+    gauge.dec(3)
+    assert gauge.value == 3
+
+    histogram = registry.histogram('duration', buckets=(1, 0.1))
+    assert histogram.mean is None
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    assert histogram.buckets == (0.1, 1)
+    assert histogram.bucket_counts == [1, 2]
+    assert histogram.as_dict()['buckets'] == {'0.1': 1, '1': 2, 'inf': 3}
+    assert histogram.min == 0.05
+    assert histogram.max == 5
+
+    with pytest.raises(ScriptError):
+        registry.gauge('items')
+    with pytest.raises(ScriptError):
+        registry.counter('invalid name')
+
+    data = registry.as_dict()
+    assert data['counters'] == {'items': 3}
+    assert data['gauges'] == {'queue': 3}
+    assert data['histograms']['duration']['count'] == 3
+    assert 'counter items 3' in registry.get_lines()
+
+
+def test_metrics_timer() -> None:
+    """
+    Test timer as context manager and as decorator of functions and coroutines
+    """
+    registry = MetricsRegistry()
+
+    @registry.timer('function_seconds')
+    def function(value: int) -> int:
+        return value * 2
+
+    @registry.timer('coroutine_seconds')
+    async def coroutine(value: int) -> int:
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    with registry.timer('context_seconds'):
+        pass
+    assert function(1) == 2
+    assert function(2) == 4
+    assert asyncio.run(coroutine(3)) == 6
+
+    assert registry.histogram('context_seconds').count == 1
+    assert registry.histogram('function_seconds').count == 2
+    assert registry.histogram('coroutine_seconds').count == 1
+    assert registry.histogram('coroutine_seconds').min >= 0.01
+
+
+def test_metrics_registry_disabled() -> None:
+    """
+    Test disabled metrics registry does not record values
+    """
+    registry = MetricsRegistry(enabled=False)
+    registry.counter('items').inc()
+    registry.gauge('queue').set(1)
+    with registry.timer('duration'):
+        pass
+    assert registry.as_dict() == {
+        'counters': {'items': 0},
+        'gauges': {'queue': 0},
+        'histograms': {'duration': registry.histogram('duration').as_dict()},
+    }
+    assert registry.histogram('duration').count == 0
+    assert registry.get_lines()[0] == 'histogram duration count 0'
+
+
+def test_metrics_write(tmpdir) -> None:
+    """
+    Test writing metrics to JSON file
+    """
+    registry = MetricsRegistry()
+    registry.counter('items').inc()
+    metrics_file = os.path.join(tmpdir.strpath, 'metrics.json')
+    registry.write(metrics_file)
+    with open(metrics_file, encoding='utf-8') as filedescriptor:
+        assert json.load(filedescriptor)['counters'] == {'items': 1}
+    with pytest.raises(ScriptError):
+        registry.write(os.path.join(tmpdir.strpath, 'missing', 'metrics.json'))
+
+
+def test_metrics_script_disabled(monkeypatch) -> None:
+    """
+    Test metrics are not collected without --metrics or --debug
+    """
+    script = MetricsScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+    assert not script.metrics.enabled
+    assert script.metrics.counter('items_processed').value == 0
+
+
+def test_metrics_script_run(monkeypatch, capsys, tmpdir) -> None:
+    """
+    Test metrics shared by script, commands and tasks are written at exit
+    """
+    metrics_file = os.path.join(tmpdir.strpath, 'metrics.json')
+    script = MetricsScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--debug', '--metrics', metrics_file, 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+
+    with open(metrics_file, encoding='utf-8') as filedescriptor:
+        data = json.load(filedescriptor)
+    assert data['counters'] == {'items_processed': 20}
+    assert data['gauges'] == {'queue_length': 2}
+    assert data['histograms']['task_seconds']['count'] == 2
+    assert 'counter items_processed 20' in capsys.readouterr().err
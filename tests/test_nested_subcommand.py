@@ -84,59 +84,80 @@ def test_nested_subcommands_create(monkeypatch) -> None:
     assert third.result is True
 
 
+def mock_terminal(monkeypatch, isatty: bool) -> MockCalledMethod:
+    """
+    Mock terminal attribute calls, returning mock for restoring terminal attributes
+    """
+    mock_tcsetattr = MockCalledMethod()
+    monkeypatch.setattr('sys.stdin.isatty', MockReturnTrue() if isatty else MockReturnFalse())
+    monkeypatch.setattr('sys.stdin.fileno', lambda: 0)
+    monkeypatch.setattr('termios.tcgetattr', MockCalledMethod(return_value=['attributes']))
+    monkeypatch.setattr('termios.tcsetattr', mock_tcsetattr)
+    return mock_tcsetattr
+
+
 def test_nested_subcommand_stty_flush_with_tty(monkeypatch) -> None:
     """
-    Test using nested_subcommand  with stty flush after command finishes
+    Test using nested_subcommand with terminal attributes restored after command finishes
     """
+    mock_tcsetattr = mock_terminal(monkeypatch, True)
     script = Script()
     command = FirstLevelCommand(script)
     script.add_subcommand(command)
 
-    mock_system_command = MockCalledMethod()
-    mock_return_true = MockReturnTrue()
-    monkeypatch.setattr('os.system', mock_system_command)
-    monkeypatch.setattr('sys.platform', 'bsd')
-    monkeypatch.setattr('sys.stdin.isatty', mock_return_true)
     argv = ['test', 'firstlevel', 'secondlevel', 'thirdlevel']
     monkeypatch.setattr(sys, 'argv', argv)
     with pytest.raises(SystemExit):
         script.run()
-    assert mock_system_command.call_count == 1
+    assert mock_tcsetattr.call_count == 1
+    assert mock_tcsetattr.args[0][2] == ['attributes']
 
 
 def test_nested_subcommand_stty_flush_no_tty(monkeypatch) -> None:
     """
-    Test using nested_subcommand  with stty flush after command finishes
+    Test using nested_subcommand without terminal attributes restored when stdin is not a TTY
+    """
+    mock_tcsetattr = mock_terminal(monkeypatch, False)
+    script = Script()
+    command = FirstLevelCommand(script)
+    script.add_subcommand(command)
+
+    argv = ['test', 'firstlevel', 'secondlevel', 'thirdlevel']
+    monkeypatch.setattr(sys, 'argv', argv)
+    with pytest.raises(SystemExit):
+        script.run()
+    assert mock_tcsetattr.call_count == 0
+
+
+def test_nested_subcommand_no_termios_no_stty_flush(monkeypatch) -> None:
+    """
+    Test using nested_subcommand without terminal attributes restored when termios is not available
     """
+    mock_tcsetattr = mock_terminal(monkeypatch, True)
+    monkeypatch.setattr('cli_toolkit.script.termios', None)
     script = Script()
     command = FirstLevelCommand(script)
     script.add_subcommand(command)
 
-    mock_system_command = MockCalledMethod()
-    mock_return_false = MockReturnFalse()
-    monkeypatch.setattr('os.system', mock_system_command)
-    monkeypatch.setattr('sys.platform', 'bsd')
-    monkeypatch.setattr('sys.stdin.isatty', mock_return_false)
     argv = ['test', 'firstlevel', 'secondlevel', 'thirdlevel']
     monkeypatch.setattr(sys, 'argv', argv)
     with pytest.raises(SystemExit):
         script.run()
-    assert mock_system_command.call_count == 0
+    assert mock_tcsetattr.call_count == 0
 
 
-def test_nested_subcommand_win32_no_stty_flush(monkeypatch) -> None:
+def test_nested_subcommand_restore_terminal_disabled(monkeypatch) -> None:
     """
-    Test using nested_subcommand wihtout stty flush after command finishes
+    Test using nested_subcommand with script opting out of restoring terminal attributes
     """
+    mock_tcsetattr = mock_terminal(monkeypatch, True)
+    monkeypatch.setattr(Script, 'restore_terminal', False)
     script = Script()
     command = FirstLevelCommand(script)
     script.add_subcommand(command)
 
-    mock_system_command = MockCalledMethod()
-    monkeypatch.setattr('os.system', mock_system_command)
-    monkeypatch.setattr('sys.platform', 'win32')
     argv = ['test', 'firstlevel', 'secondlevel', 'thirdlevel']
     monkeypatch.setattr(sys, 'argv', argv)
     with pytest.raises(SystemExit):
         script.run()
-    assert mock_system_command.call_count == 0
+    assert mock_tcsetattr.call_count == 0
@@ -0,0 +1,403 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.output module
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from typing import Any, Dict
+
+import pytest
+
+from cli_toolkit.command import Command
+from cli_toolkit.exceptions import ScriptError, TaskError
+from cli_toolkit.output import (
+    BufferedStreamWriter,
+    ConsoleWriter,
+    TaskOutputBuffer,
+    TaskOutputWriter,
+    TASK_OUTPUT_MODE_GROUP,
+    TASK_OUTPUT_MODE_KEEP_ORDER,
+    TASK_OUTPUT_STDERR,
+    TASK_OUTPUT_STDOUT,
+    flush_console_writers,
+)
+from cli_toolkit.script import Script
+from cli_toolkit.task import CommandLineTask, Task
+
+
+class PrintCommand(Command):
+    """
+    Test command printing messages
+    """
+    name = 'print'
+
+    def run(self, args: argparse.Namespace) -> None:
+        for index in range(1000):
+            self.message(f'line {index}')
+        self.error('done')
+
+
+class BufferedScript(Script):
+    """
+    Test script with buffered output
+    """
+    buffered_output = True
+    output_flush_interval = 10.0
+    subcommands = (
+        PrintCommand,
+    )
+
+
+def test_buffered_stream_writer_size(capsys) -> None:
+    """
+    Test buffered writer flushing when buffer is full
+    """
+    writer = BufferedStreamWriter('stdout', buffer_size=10, flush_interval=10.0, line_buffered=False)
+    writer.write('12345\n')
+    assert capsys.readouterr().out == ''
+    writer.write('67890\n')
+    assert capsys.readouterr().out == '12345\n67890\n'
+    writer.write('last\n')
+    writer.flush()
+    assert capsys.readouterr().out == 'last\n'
+
+
+def test_buffered_stream_writer_interval(capsys) -> None:
+    """
+    Test buffered writer flushing periodically
+    """
+    writer = BufferedStreamWriter('stderr', flush_interval=0.05, line_buffered=False)
+    writer.write('message\n')
+    assert capsys.readouterr().err == ''
+    time.sleep(0.3)
+    assert capsys.readouterr().err == 'message\n'
+
+
+def test_buffered_stream_writer_line_buffered(capsys) -> None:
+    """
+    Test line buffered writer writing immediately
+    """
+    writer = BufferedStreamWriter('stdout', line_buffered=True)
+    writer.write('message\n')
+    assert capsys.readouterr().out == 'message\n'
+
+
+def test_buffered_stream_writer_terminal(monkeypatch) -> None:
+    """
+    Test writer is line buffered when stream is a terminal
+    """
+    monkeypatch.setattr('sys.stdout.isatty', lambda: True)
+    assert BufferedStreamWriter('stdout').line_buffered
+    monkeypatch.setattr('sys.stdout.isatty', lambda: False)
+    assert not BufferedStreamWriter('stdout').line_buffered
+
+
+def test_console_writer_flush_at_exit(capsys) -> None:
+    """
+    Test flushing all console writers when python exits
+    """
+    writer = ConsoleWriter()
+    writer.stdout.line_buffered = False
+    writer.stderr.line_buffered = False
+    writer.stdout.write('message\n')
+    writer.stderr.write('error\n')
+    assert capsys.readouterr() == ('', '')
+    flush_console_writers()
+    assert capsys.readouterr() == ('message\n', 'error\n')
+
+
+def test_script_buffered_output(monkeypatch, capsys) -> None:
+    """
+    Test script buffering messages and errors until exit
+    """
+    script = BufferedScript()
+    script.message('first')
+    script.error('error')
+    assert capsys.readouterr() == ('', '')
+
+    monkeypatch.setattr(sys, 'argv', ['test-cli', 'print'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+
+    out, err = capsys.readouterr()
+    assert out.splitlines() == ['first'] + [f'line {index}' for index in range(1000)]
+    assert err.splitlines() == ['error', 'done']
+
+
+def test_script_buffered_output_silent(monkeypatch, capsys) -> None:
+    """
+    Test buffered script output with --quiet
+    """
+    script = BufferedScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--quiet', 'print'])
+    with pytest.raises(SystemExit):
+        script.run()
+    assert capsys.readouterr() == ('', 'done\n')
+
+
+class OutputThreadScript(Script):
+    """
+    Test script writing task output in writer thread
+    """
+    task_output_thread = True
+    task_output_queue_size = 2
+
+
+class OutputTask(Task):
+    """
+    Test task collecting messages written by writer thread
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.threads = set()
+
+    def message(self, *args) -> None:
+        self.threads.add(threading.get_ident())
+        return super().message(*args)
+
+    async def run(self, **kwargs) -> None:
+        """
+        Run test task
+        """
+
+
+def test_task_output_writer_lines(capsys) -> None:
+    """
+    Test task output writer decoding chunks to lines in writer thread
+    """
+    script = Script()
+    script.task_output_prefix = True
+    task = OutputTask(script)
+
+    async def write_output() -> None:
+        writer = TaskOutputWriter(queue_size=1, encoding='utf-8')
+        writer.start()
+        for chunk in (b'first\nsec', b'ond \xc3', b'\xa4\nlast'):
+            await writer.write(task, TASK_OUTPUT_STDOUT, chunk)
+        await writer.write(task, TASK_OUTPUT_STDERR, b'error\n')
+        await writer.close(task, TASK_OUTPUT_STDOUT)
+        await writer.close(task, TASK_OUTPUT_STDERR)
+        await writer.stop()
+
+    asyncio.run(write_output())
+    assert task.messages == ['first', 'second \xe4', 'last']
+    assert task.errors == ['error']
+    assert threading.get_ident() not in task.threads
+    assert capsys.readouterr() == (
+        'OutputTask: first\nOutputTask: second \xe4\nOutputTask: last\n',
+        'OutputTask: error\n',
+    )
+
+
+def test_task_output_writer_backpressure() -> None:
+    """
+    Test task output writer blocking writes when the queue is full
+    """
+    script = Script()
+    task = OutputTask(script)
+    writing = threading.Event()
+    release = threading.Event()
+
+    def message(*_args) -> None:
+        writing.set()
+        release.wait()
+
+    task.message = message
+
+    async def write_output() -> int:
+        writer = TaskOutputWriter(queue_size=2)
+        writer.start()
+        await writer.write(task, TASK_OUTPUT_STDOUT, b'first\n')
+        await asyncio.get_running_loop().run_in_executor(None, writing.wait)
+        await writer.write(task, TASK_OUTPUT_STDOUT, b'second\n')
+        blocked = asyncio.create_task(writer.write(task, TASK_OUTPUT_STDOUT, b'third\n'))
+        await asyncio.sleep(0.1)
+        queued = writer.queued
+        assert not blocked.done()
+        release.set()
+        await blocked
+        await writer.stop()
+        return queued
+
+    assert asyncio.run(write_output()) == 1
+    assert task.messages == ['first', 'second', 'third']
+
+
+def test_script_task_output_thread(capsys) -> None:
+    """
+    Test script running command line tasks with task output thread
+    """
+    script = OutputThreadScript()
+    task = CommandLineTask(script, ('sh', '-c', 'seq 1 1000; echo error >&2; printf last'))
+    script.run_async_tasks()
+    assert task.returncode == 0
+    assert task.messages == [str(index) for index in range(1, 1001)] + ['last']
+    assert task.errors == ['error']
+    assert script.__get_task_output_writer__() is None
+    out, err = capsys.readouterr()
+    assert out.splitlines()[-1] == 'last'
+    assert err == 'error\n'
+
+
+class LinesTask(Task):
+    """
+    Test task printing lines with delays
+    """
+    def __init__(self, parent, name: str, delay: float) -> None:
+        super().__init__(parent)
+        self.name = name
+        self.delay = delay
+
+    def __repr__(self) -> str:
+        return self.name
+
+    async def run(self, **kwargs) -> None:
+        """
+        Run test task
+        """
+        for index in range(3):
+            self.message(f'{self.name} {index}')
+            await asyncio.sleep(self.delay)
+        self.error(f'{self.name} done')
+
+
+def run_lines_tasks(mode: str) -> None:
+    """
+    Run lines tasks with task output mode
+    """
+    script = Script()
+    script.task_output_mode = mode
+    LinesTask(script, 'slow', 0.2)
+    LinesTask(script, 'fast', 0.01)
+    script.run_async_tasks()
+
+
+def test_task_output_buffer_spill() -> None:
+    """
+    Test task output buffer moving output to temporary file
+    """
+    buffer = TaskOutputBuffer(spool_size=10)
+    buffer.write(TASK_OUTPUT_STDOUT, 'first')
+    assert not buffer.spilled
+    buffer.write(TASK_OUTPUT_STDERR, 'second\nline')
+    assert buffer.spilled
+    buffer.write(TASK_OUTPUT_STDOUT, 'third')
+    assert list(buffer) == [
+        (TASK_OUTPUT_STDOUT, 'first'),
+        (TASK_OUTPUT_STDERR, 'second\nline'),
+        (TASK_OUTPUT_STDOUT, 'third'),
+    ]
+    buffer.close()
+    assert not buffer.spilled
+    assert not list(buffer)
+
+
+def test_task_output_ungrouped(capsys) -> None:
+    """
+    Test output of tasks is interleaved by default
+    """
+    run_lines_tasks('ungrouped')
+    assert capsys.readouterr().out.splitlines() == [
+        'slow 0', 'fast 0', 'fast 1', 'fast 2', 'slow 1', 'slow 2',
+    ]
+
+
+def test_task_output_group(capsys) -> None:
+    """
+    Test output of tasks is grouped in order the tasks finished
+    """
+    run_lines_tasks(TASK_OUTPUT_MODE_GROUP)
+    assert capsys.readouterr() == (
+        'fast 0\nfast 1\nfast 2\nslow 0\nslow 1\nslow 2\n',
+        'fast done\nslow done\n',
+    )
+
+
+def test_task_output_keep_order(capsys) -> None:
+    """
+    Test output of tasks is grouped in order the tasks were added
+    """
+    run_lines_tasks(TASK_OUTPUT_MODE_KEEP_ORDER)
+    assert capsys.readouterr() == (
+        'slow 0\nslow 1\nslow 2\nfast 0\nfast 1\nfast 2\n',
+        'slow done\nfast done\n',
+    )
+
+
+class UnreadOutputTask(CommandLineTask):
+    """
+    Test command line task reading process output only after the process has been terminated
+    """
+    async def process_stdout(self, stdout: asyncio.StreamReader) -> None:
+        while self.process.returncode is None:
+            await asyncio.sleep(0.01)
+        await super().process_stdout(stdout)
+
+
+class WaitFileTask(Task):
+    """
+    Test task failing after a file has been created
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        while not os.path.exists(kwargs['path']):
+            await asyncio.sleep(0.01)
+        # Let the event loop read output written before the file was created
+        await asyncio.sleep(0.05)
+        self.message('second')
+        raise TaskError('failed')
+
+
+@pytest.mark.parametrize('task_class', (CommandLineTask, UnreadOutputTask))
+def test_task_output_keep_order_failed(task_class, tmpdir, capsys) -> None:
+    """
+    Test grouped output of tasks cancelled after a failure is written, including output
+    read from the process but not processed when the task was cancelled
+    """
+    path = os.path.join(tmpdir.strpath, 'ready')
+    script = Script()
+    script.task_output_mode = TASK_OUTPUT_MODE_KEEP_ORDER
+    task = task_class(script, ('sh', '-c', 'echo first; touch "$0"; sleep 10', path))
+    WaitFileTask(script, path=path)
+    start = time.monotonic()
+    with pytest.raises(TaskError):
+        script.run_async_tasks()
+    assert time.monotonic() - start < 5
+    assert capsys.readouterr().out == 'first\nsecond\n'
+    assert task.messages == ['first']
+    assert task.__output_buffer__ is None
+
+
+def test_task_output_prefix(capsys) -> None:
+    """
+    Test prefixing lines of task output with task name
+    """
+    script = Script()
+    script.task_output_prefix = True
+    task = OutputTask(script)
+    task.message('first\nsecond')
+    task.error('error')
+    assert capsys.readouterr() == ('OutputTask: first\nOutputTask: second\n', 'OutputTask: error\n')
+
+
+def test_task_output_invalid_mode() -> None:
+    """
+    Test running tasks with invalid task output mode
+    """
+    script = Script()
+    script.task_output_mode = 'invalid'
+    OutputTask(script)
+    with pytest.raises(ScriptError):
+        script.run_async_tasks()
@@ -0,0 +1,222 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.pipeline module
+"""
+import asyncio
+
+from typing import Any, AsyncIterator, Dict, List
+
+import pytest
+
+from cli_toolkit.base import TASK_FAILURE_POLICY_KEEP_GOING
+from cli_toolkit.exceptions import ScriptError, TaskError
+from cli_toolkit.pipeline import Pipeline, PipelineSource, PipelineStage
+from cli_toolkit.retry import RetryPolicy
+from cli_toolkit.script import Script
+from cli_toolkit.task import TASK_STATUS_CANCELLED, TASK_STATUS_FAILED, TASK_STATUS_SUCCEEDED, Task
+
+
+class ListStage(PipelineSource):
+    """
+    Test stage producing numbers
+    """
+    async def produce(self) -> AsyncIterator[int]:
+        for value in range(self.count):
+            yield value
+
+    def __init__(self, *args: List[Any], count: int = 20, **kwargs: Dict[Any, Any]) -> None:
+        super().__init__(*args, **kwargs)
+        self.count = count
+
+
+class FetchStage(PipelineStage):
+    """
+    Test stage processing items concurrently
+    """
+    concurrency = 4
+    queue_size = 2
+
+    def __init__(self, *args: List[Any], **kwargs: Dict[Any, Any]) -> None:
+        super().__init__(*args, **kwargs)
+        self.running_workers = 0
+        self.max_running_workers = 0
+
+    async def process(self, item: Any) -> Any:
+        self.running_workers += 1
+        self.max_running_workers = max(self.max_running_workers, self.running_workers)
+        await asyncio.sleep(0.01)
+        self.running_workers -= 1
+        if item % 2:
+            return None
+        return item * 10
+
+
+class WriteStage(PipelineStage):
+    """
+    Test stage collecting items
+    """
+    def __init__(self, *args: List[Any], **kwargs: Dict[Any, Any]) -> None:
+        super().__init__(*args, **kwargs)
+        self.items = []
+
+    async def process(self, item: Any) -> Any:
+        self.items.append(item)
+
+
+class SleepTask(Task):
+    """
+    Test task holding a concurrency slot while pipelines are started
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        await asyncio.sleep(0.05)
+
+
+class FailStage(PipelineStage):
+    """
+    Test stage failing on item
+    """
+    async def process(self, item: Any) -> Any:
+        if item == 5:
+            raise ValueError(f'Invalid item {item}')
+        return item
+
+
+def test_pipeline_stages() -> None:
+    """
+    Test running pipeline stages as script tasks
+    """
+    script = Script()
+    script.metrics.enabled = True
+    list_stage = ListStage(script)
+    fetch_stage = FetchStage(script)
+    write_stage = WriteStage(script)
+    pipeline = Pipeline(list_stage, fetch_stage, write_stage)
+    assert repr(pipeline) == 'ListStage | FetchStage | WriteStage'
+
+    script.run_async_tasks()
+    assert sorted(write_stage.items) == [value * 10 for value in range(0, 20, 2)]
+    assert fetch_stage.max_running_workers == 4
+    assert [stage.status for stage in pipeline.stages] == [TASK_STATUS_SUCCEEDED] * 3
+
+    stats = pipeline.get_stats()
+    assert [(item['items_received'], item['items_sent']) for item in stats] == [(0, 20), (20, 10), (10, 0)]
+    assert stats[1]['items_per_second'] > 0
+    metrics = script.metrics.as_dict()
+    assert metrics['counters']['pipeline_fetch_stage_received_total'] == 20
+    assert metrics['counters']['pipeline_fetch_stage_sent_total'] == 10
+    assert metrics['histograms']['pipeline_fetch_stage_process_seconds']['count'] == 20
+
+
+def test_pipeline_stage_failure() -> None:
+    """
+    Test failing pipeline stage cancels other stages
+    """
+    script = Script()
+    script.task_failure_policy = TASK_FAILURE_POLICY_KEEP_GOING
+    pipeline = Pipeline(ListStage(script, count=1000), FailStage(script), WriteStage(script))
+    with pytest.raises(TaskError):
+        script.run_async_tasks()
+    assert [stage.status for stage in pipeline.stages] == [
+        TASK_STATUS_CANCELLED,
+        TASK_STATUS_FAILED,
+        TASK_STATUS_CANCELLED,
+    ]
+
+
+def test_pipeline_fail_fast() -> None:
+    """
+    Test failing pipeline stage raises the error with fail-fast policy
+    """
+    script = Script()
+    Pipeline(ListStage(script), FailStage(script, concurrency=2), WriteStage(script))
+    with pytest.raises(ValueError):
+        script.run_async_tasks()
+
+
+def test_pipeline_errors() -> None:
+    """
+    Test errors creating pipelines
+    """
+    script = Script()
+    with pytest.raises(ScriptError):
+        Pipeline(WriteStage(script))
+    with pytest.raises(ScriptError):
+        Pipeline(ListStage(script), ListStage(script))
+    with pytest.raises(ScriptError):
+        WriteStage(script, concurrency=0)
+    with pytest.raises(ScriptError):
+        Pipeline(ListStage(script, retry_policy=RetryPolicy()))
+    stage = ListStage(script)
+    Pipeline(stage)
+    with pytest.raises(ScriptError):
+        Pipeline(stage)
+    script.max_concurrent_tasks = 1
+    with pytest.raises(ScriptError):
+        Pipeline(ListStage(script), WriteStage(script))
+    script.max_concurrent_tasks = None
+    script.adaptive_concurrency = True
+    with pytest.raises(ScriptError):
+        Pipeline(ListStage(script), WriteStage(script))
+
+
+async def run_pipelines(script: Script) -> List[Any]:
+    """
+    Run tasks of the script, failing if pipelines do not finish
+    """
+    async def run_tasks() -> List[Any]:
+        return [result async for result in script.as_completed_async_tasks()]
+    return await asyncio.wait_for(run_tasks(), 10)
+
+
+def test_pipeline_concurrent_pipelines() -> None:
+    """
+    Test pipelines sharing the concurrency limit of the parent do not take slots from each other
+    """
+    script = Script()
+    script.max_concurrent_tasks = 3
+    SleepTask(script)
+    pipelines = [
+        Pipeline(ListStage(script), FetchStage(script), WriteStage(script, queue_size=2)),
+        Pipeline(ListStage(script, priority=1), FetchStage(script), WriteStage(script, queue_size=2)),
+    ]
+    script.run_coroutine(run_pipelines(script))
+    for pipeline in pipelines:
+        assert [stage.status for stage in pipeline.stages] == [TASK_STATUS_SUCCEEDED] * 3
+        assert len(pipeline.stages[-1].items) == 10
+    assert script.__task_scheduler__.running == 0
+    script.close_event_loop()
+
+
+def test_pipeline_adaptive_concurrency(monkeypatch) -> None:
+    """
+    Test pipeline with adaptive concurrency when the initial limit is below the number of stages
+    """
+    monkeypatch.setattr('cli_toolkit.concurrency.get_cpu_count', lambda: 1)
+    script = Script()
+    script.adaptive_concurrency = True
+    with pytest.raises(ScriptError):
+        Pipeline(ListStage(script), FetchStage(script), WriteStage(script))
+
+    script = Script()
+    script.adaptive_concurrency = True
+    script.min_concurrent_tasks = 3
+    script.max_concurrent_tasks = 4
+    pipeline = Pipeline(ListStage(script), FetchStage(script), WriteStage(script))
+    script.run_coroutine(run_pipelines(script))
+    assert [stage.status for stage in pipeline.stages] == [TASK_STATUS_SUCCEEDED] * 3
+    assert len(pipeline.stages[-1].items) == 10
+    script.close_event_loop()
+
+
+def test_pipeline_stage_without_pipeline() -> None:
+    """
+    Test running pipeline stage not linked to a pipeline
+    """
+    script = Script()
+    WriteStage(script)
+    with pytest.raises(ScriptError):
+        script.run_async_tasks()
@@ -0,0 +1,86 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.process module
+"""
+import asyncio
+import os
+import signal
+import sys
+
+from cli_toolkit.process import AsyncProcess, ProcessResourceUsage
+
+CPU_LOOP_COMMAND = (sys.executable, '-c', 'sum(range(2000000)); print("done")')
+
+
+def test_process_resource_usage() -> None:
+    """
+    Test process resource usage is collected when process is reaped
+    """
+    async def run_process() -> AsyncProcess:
+        process = await AsyncProcess.create(*CPU_LOOP_COMMAND)
+        output = await process.stdout.read()
+        assert output.strip() == b'done'
+        assert await process.wait() == 0
+        return process
+
+    process = asyncio.run(run_process())
+    assert process.returncode == 0
+    assert isinstance(process.resource_usage, ProcessResourceUsage)
+    assert process.resource_usage.user_time + process.resource_usage.system_time > 0
+    assert process.resource_usage.max_rss > 1024 * 1024
+    assert sorted(process.resource_usage.as_dict().keys()) == ['max_rss', 'system_time', 'user_time']
+
+
+def test_process_return_code_and_signal() -> None:
+    """
+    Test return codes of failed and killed processes
+    """
+    async def run_processes() -> None:
+        process = await AsyncProcess.create('false')
+        assert await process.wait() == 1
+
+        process = await AsyncProcess.create('sleep', '10')
+        process.terminate()
+        assert await process.wait() == -signal.SIGTERM
+        # Signals are not sent to reaped processes
+        process.kill()
+
+    asyncio.run(run_processes())
+
+
+def test_process_wait_thread(monkeypatch) -> None:
+    """
+    Test reaping process with waiter thread when pidfd is not available
+    """
+    monkeypatch.delattr(os, 'pidfd_open', raising=False)
+
+    async def run_process() -> AsyncProcess:
+        process = await AsyncProcess.create('true')
+        assert await process.wait() == 0
+        return process
+
+    process = asyncio.run(run_process())
+    assert process.resource_usage is not None
+
+
+def test_process_wait_after_cancelled_waiter() -> None:
+    """
+    Test process is reaped by wait() after the previous waiter was cancelled
+    """
+    async def run_process() -> AsyncProcess:
+        process = await AsyncProcess.create('sleep', '10')
+        waiter = asyncio.ensure_future(process.wait())
+        await asyncio.sleep(0.1)
+        process.__wait_future__.cancel()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        process.kill()
+        assert await process.wait() == -signal.SIGKILL
+        return process
+
+    process = asyncio.run(run_process())
+    assert process.resource_usage is not None
@@ -0,0 +1,252 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.profiler module
+"""
+import argparse
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+from typing import Any, Dict
+
+import pytest
+
+from cli_toolkit.command import Command
+from cli_toolkit.exceptions import ScriptError
+from cli_toolkit.profiler import CProfileProfiler, MemoryProfiler, SamplingProfiler, format_bytes
+from cli_toolkit.script import Script
+from cli_toolkit.task import Task
+
+
+def busy_loop(duration: float) -> None:
+    """
+    Keep the CPU busy for duration seconds
+    """
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        pass
+
+
+class ProfiledTask(Task):
+    """
+    Test task for profiling
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        busy_loop(0.05)
+
+
+class ProfiledCommand(Command):
+    """
+    Test command running tasks
+    """
+    name = 'tasks'
+
+    def run(self, args: argparse.Namespace) -> None:
+        ProfiledTask(self)
+        self.run_subcommand(args)
+
+
+class ProfileScript(Script):
+    """
+    Test script with subcommand running tasks
+    """
+    subcommands = (
+        ProfiledCommand,
+    )
+
+
+def test_cprofile_profiler_nested(tmpdir) -> None:
+    """
+    Test nested cProfile profiler contexts and writing pstats file
+    """
+    profiler = CProfileProfiler()
+    assert profiler.get_top_functions() == ['No profile data collected']
+    with profiler.profile():
+        with profiler.profile():
+            busy_loop(0.01)
+        assert profiler.running
+    assert not profiler.running
+
+    profile_file = os.path.join(tmpdir.strpath, 'profile.pstats')
+    profiler.write(profile_file)
+    stats = pstats.Stats(profile_file)
+    assert any(name == 'busy_loop' for _filename, _lineno, name in stats.stats)
+    assert any('busy_loop' in line for line in profiler.get_top_functions(50))
+
+    with pytest.raises(ScriptError):
+        profiler.write(os.path.join(tmpdir.strpath, 'missing', 'profile.pstats'))
+
+
+def test_sampling_profiler(tmpdir) -> None:
+    """
+    Test sampling profiler collects stacks of the profiled thread
+    """
+    profiler = SamplingProfiler(interval=0.001)
+    assert profiler.get_top_functions() == ['No profile samples collected']
+    with profiler.profile():
+        busy_loop(0.1)
+    assert not profiler.running
+    assert profiler.samples
+
+    profile_file = os.path.join(tmpdir.strpath, 'profile.txt')
+    profiler.write(profile_file)
+    with open(profile_file, encoding='utf-8') as filedescriptor:
+        lines = filedescriptor.read().splitlines()
+    assert lines
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('busy_loop' in line for line in lines)
+    assert any('busy_loop' in line for line in profiler.get_top_functions(50))
+
+    with pytest.raises(ScriptError):
+        profiler.write(os.path.join(tmpdir.strpath, 'missing', 'profile.txt'))
+
+
+def test_profile_script_disabled(monkeypatch) -> None:
+    """
+    Test script without --profile does not enable profiling
+    """
+    script = ProfileScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+    assert script.__get_profiler__() is None
+
+
+def test_profile_script_run(monkeypatch, capsys, tmpdir) -> None:
+    """
+    Test profiling script run with cProfile
+    """
+    profile_file = os.path.join(tmpdir.strpath, 'profile.pstats')
+    script = ProfileScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--profile', profile_file, '--profile-top', '50', 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+
+    stats = pstats.Stats(profile_file)
+    assert any(name == 'busy_loop' for _filename, _lineno, name in stats.stats)
+    assert 'busy_loop' in capsys.readouterr().err
+
+
+def test_profile_script_sampler(monkeypatch, capsys, tmpdir) -> None:
+    """
+    Test profiling script run with sampling profiler
+    """
+    profile_file = os.path.join(tmpdir.strpath, 'profile.txt')
+    script = ProfileScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--profile', profile_file, '--profile-sampler', 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+
+    with open(profile_file, encoding='utf-8') as filedescriptor:
+        assert 'busy_loop' in filedescriptor.read()
+    assert 'samples at 5ms interval' in capsys.readouterr().err
+
+
+def test_format_bytes() -> None:
+    """
+    Test formatting byte counts
+    """
+    assert format_bytes(100) == '100 B'
+    assert format_bytes(2048) == '2.0 KiB'
+    assert format_bytes(3 * 1024 * 1024) == '3.0 MiB'
+    assert format_bytes(1024 ** 4) == '1024.0 GiB'
+
+
+def test_memory_profiler(tmpdir) -> None:
+    """
+    Test memory profiler snapshots and writing tracemalloc snapshot file
+    """
+    profiler = MemoryProfiler()
+    assert profiler.snapshot('not running') is None
+    assert profiler.get_top_functions() == ['No memory snapshots taken']
+    with pytest.raises(ScriptError):
+        profiler.write(os.path.join(tmpdir.strpath, 'memory.snapshot'))
+
+    with profiler.profile():
+        data = [bytearray(1024) for _index in range(1000)]
+        snapshot = profiler.snapshot('allocated')
+        del data
+    assert not profiler.running
+    assert snapshot.current >= 1000 * 1024
+    assert snapshot.as_dict()['label'] == 'allocated'
+    assert [snapshot.label for snapshot in profiler.snapshots] == ['allocated', 'stop']
+    assert profiler.peak >= snapshot.current
+
+    lines = profiler.get_top_functions(5)
+    assert lines[0].startswith('Peak traced memory')
+    assert 'Top allocation sites at snapshot allocated:' in lines
+    assert any('test_profiler.py' in line for line in lines)
+
+    snapshot_file = os.path.join(tmpdir.strpath, 'memory.snapshot')
+    profiler.write(snapshot_file)
+    assert tracemalloc.Snapshot.load(snapshot_file).traces
+    with pytest.raises(ScriptError):
+        profiler.write(os.path.join(tmpdir.strpath, 'missing', 'memory.snapshot'))
+
+
+def test_memory_profiler_snapshot_growth(monkeypatch) -> None:
+    """
+    Test memory profiler collecting allocations only when traced memory has grown
+    """
+    taken = []
+    take_snapshot = tracemalloc.take_snapshot
+
+    def count_snapshots() -> tracemalloc.Snapshot:
+        taken.append(True)
+        return take_snapshot()
+
+    monkeypatch.setattr(tracemalloc, 'take_snapshot', count_snapshots)
+    profiler = MemoryProfiler(snapshot_growth=0.5, snapshot_lines=2)
+    with profiler.profile():
+        data = [bytearray(1024) for _index in range(1000)]
+        profiler.snapshot('allocated')
+        data.extend(bytearray(1024) for _index in range(100))
+        profiler.snapshot('small growth')
+        data.extend(bytearray(1024) for _index in range(2000))
+        profiler.snapshot('large growth')
+        for index in range(3):
+            profiler.snapshot(f'extra {index}')
+        del data
+    assert len(taken) == 2
+    assert len(profiler.snapshots) == 7
+
+    lines = profiler.get_top_functions(5)
+    assert [line.split(':')[0] for line in lines[1:6]] == [
+        'Snapshot allocated',
+        'Snapshot small growth',
+        '... 3 snapshots not shown',
+        'Snapshot extra 2',
+        'Snapshot stop',
+    ]
+    assert 'Top allocation sites at snapshot large growth:' in lines
+
+
+def test_memprofile_script_run(monkeypatch, capsys, tmpdir) -> None:
+    """
+    Test memory profiling script run with snapshots after tasks
+    """
+    snapshot_file = os.path.join(tmpdir.strpath, 'memory.snapshot')
+    script = ProfileScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--memprofile', snapshot_file, 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+    assert script.__get_memory_profiler__() is None
+    assert not tracemalloc.is_tracing()
+
+    errors = capsys.readouterr().err
+    assert 'Peak traced memory' in errors
+    assert 'Snapshot task ProfiledTask succeeded' in errors
+    assert os.path.isfile(snapshot_file)
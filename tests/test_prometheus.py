@@ -0,0 +1,149 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.prometheus module
+"""
+import argparse
+import os
+import stat
+import sys
+
+from typing import Any, Dict
+
+import pytest
+
+from cli_toolkit.command import Command
+from cli_toolkit.exceptions import ScriptError, TaskError
+from cli_toolkit.metrics import MetricsRegistry
+from cli_toolkit.prometheus import PrometheusTextfile, format_labels, format_value
+from cli_toolkit.script import Script
+from cli_toolkit.task import Task
+
+
+class SucceedingTask(Task):
+    """
+    Test task updating metrics
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        self.parent.metrics.counter('items_processed', 'Processed items').inc(5)
+
+
+class FailingTask(Task):
+    """
+    Test task failing
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        raise TaskError('failed')
+
+
+class ExportCommand(Command):
+    """
+    Test command running tasks
+    """
+    name = 'tasks'
+    task_failure_policy = 'keep-going'
+
+    def run(self, args: argparse.Namespace) -> None:
+        SucceedingTask(self)
+        SucceedingTask(self)
+        FailingTask(self)
+        self.run_subcommand(args)
+
+
+class ExportScript(Script):
+    """
+    Test script with subcommand running tasks
+    """
+    subcommands = (
+        ExportCommand,
+    )
+
+
+def test_prometheus_format_value() -> None:
+    """
+    Test formatting sample values and labels
+    """
+    assert format_value(True) == '1'
+    assert format_value(3) == '3'
+    assert format_value(0.5) == '0.5'
+    assert format_value(float('inf')) == '+Inf'
+    assert format_value(float('-inf')) == '-Inf'
+    assert format_value(float('nan')) == 'NaN'
+    assert format_labels({}) == ''
+    assert format_labels({'a': 'x"y\\z\n'}) == '{a="x\\"y\\\\z\\n"}'
+
+
+def test_prometheus_textfile_registry() -> None:
+    """
+    Test formatting metrics registry in Prometheus text format
+    """
+    registry = MetricsRegistry()
+    registry.counter('items', 'Processed items').inc(2)
+    registry.gauge('queue').set(1.5)
+    registry.histogram('duration', buckets=(0.1, 1)).observe(0.5)
+
+    textfile = PrometheusTextfile({'script': 'test'})
+    textfile.add_registry(registry)
+    lines = textfile.format().splitlines()
+    assert lines == [
+        '# TYPE duration histogram',
+        'duration_bucket{script="test",le="0.1"} 0',
+        'duration_bucket{script="test",le="1"} 1',
+        'duration_bucket{script="test",le="+Inf"} 1',
+        'duration_sum{script="test"} 0.5',
+        'duration_count{script="test"} 1',
+        '# HELP items Processed items',
+        '# TYPE items counter',
+        'items{script="test"} 2',
+        '# TYPE queue gauge',
+        'queue{script="test"} 1.5',
+    ]
+
+
+def test_prometheus_textfile_write(tmpdir) -> None:
+    """
+    Test writing textfile atomically
+    """
+    textfile = PrometheusTextfile()
+    textfile.add('value', 'gauge', 'Test value', 1)
+    path = os.path.join(tmpdir.strpath, 'test.prom')
+    textfile.write(path)
+    with open(path, encoding='utf-8') as filedescriptor:
+        assert filedescriptor.read() == '# HELP value Test value\n# TYPE value gauge\nvalue 1\n'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    assert os.listdir(tmpdir.strpath) == ['test.prom']
+
+    with pytest.raises(ScriptError):
+        textfile.write(os.path.join(tmpdir.strpath, 'missing', 'test.prom'))
+
+
+def test_prometheus_script_run(monkeypatch, tmpdir) -> None:
+    """
+    Test writing run metrics with --prometheus-textfile
+    """
+    path = os.path.join(tmpdir.strpath, 'script.prom')
+    script = ExportScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--prometheus-textfile', path, 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 1
+
+    with open(path, encoding='utf-8') as filedescriptor:
+        lines = filedescriptor.read().splitlines()
+    assert 'cli_script_exit_code{script="test-cli"} 1' in lines
+    assert 'cli_script_tasks{script="test-cli",status="succeeded"} 2' in lines
+    assert 'cli_script_tasks{script="test-cli",status="failed"} 1' in lines
+    assert 'cli_script_tasks{script="test-cli",status="cancelled"} 0' in lines
+    assert 'cli_script_task_attempts{script="test-cli"} 3' in lines
+    assert 'items_processed{script="test-cli"} 10' in lines
+    assert any(line.startswith('cli_script_duration_seconds{script="test-cli"} ') for line in lines)
+    assert any(line.startswith('cli_script_last_run_timestamp_seconds{script="test-cli"} ') for line in lines)
@@ -0,0 +1,126 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.ratelimit module
+"""
+import asyncio
+import time
+
+from typing import Any, Dict, List
+
+import pytest
+
+from cli_toolkit.command import Command
+from cli_toolkit.exceptions import ScriptError
+from cli_toolkit.ratelimit import RateLimiter
+from cli_toolkit.script import Script
+from cli_toolkit.task import Task
+
+
+class StartTimeTask(Task):
+    """
+    Test task recording start times
+    """
+    start_times: List[float] = []
+
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        StartTimeTask.start_times.append(time.monotonic())
+        await asyncio.sleep(kwargs.get('sleep', 0))
+
+
+class RateLimitCommand(Command):
+    """
+    Test command for rate limiters
+    """
+    name = 'ratelimit'
+
+
+def test_rate_limiter_invalid_values() -> None:
+    """
+    Test creating rate limiters with invalid values
+    """
+    with pytest.raises(ScriptError):
+        RateLimiter('test', rate=0)
+    with pytest.raises(ScriptError):
+        RateLimiter('test', rate=1, burst=0)
+
+
+def test_rate_limiter_try_acquire() -> None:
+    """
+    Test taking tokens from rate limiter without waiting
+    """
+    rate_limiter = RateLimiter('test', rate=1, burst=2)
+    assert repr(rate_limiter) == 'test 1/s burst 2'
+    assert rate_limiter.try_acquire()
+    assert rate_limiter.try_acquire()
+    assert not rate_limiter.try_acquire()
+    assert 0 < rate_limiter.get_delay() <= 1
+
+
+def test_rate_limiter_acquire() -> None:
+    """
+    Test waiting for rate limiter tokens
+    """
+    rate_limiter = RateLimiter('test', rate=20, burst=2)
+
+    async def acquire_tokens() -> None:
+        for _ in range(6):
+            await rate_limiter.acquire()
+
+    start = time.monotonic()
+    asyncio.run(acquire_tokens())
+    assert 0.15 <= time.monotonic() - start < 0.5
+
+
+def test_rate_limiter_registry() -> None:
+    """
+    Test registering rate limiters and looking them up from child commands
+    """
+    script = Script()
+    command = RateLimitCommand(script)
+    rate_limiter = script.add_rate_limiter('api', rate=10)
+    assert command.get_rate_limiter('api') == rate_limiter
+    with pytest.raises(ScriptError):
+        script.add_rate_limiter('api', rate=10)
+    with pytest.raises(ScriptError):
+        command.get_rate_limiter('missing')
+
+
+def test_rate_limiter_task_launches() -> None:
+    """
+    Test rate limiter limits task launches
+    """
+    script = Script()
+    script.add_rate_limiter('api', rate=20, burst=2)
+    StartTimeTask.start_times = []
+    for _ in range(6):
+        StartTimeTask(script, rate_limiter='api')
+    script.run_async_tasks()
+    start_times = sorted(StartTimeTask.start_times)
+    assert len(start_times) == 6
+    assert start_times[1] - start_times[0] < 0.04
+    assert start_times[-1] - start_times[0] >= 0.15
+
+
+def test_rate_limiter_tasks_waiting_for_slot() -> None:
+    """
+    Test tasks waiting for a concurrency slot do not collect rate limiter tokens
+    """
+    script = Script()
+    script.max_concurrent_tasks = 1
+    script.add_rate_limiter('api', rate=10, burst=1)
+    StartTimeTask.start_times = []
+    StartTimeTask(script, rate_limiter='api', sleep=0.3)
+    for _ in range(3):
+        StartTimeTask(script, rate_limiter='api')
+    script.run_async_tasks()
+    start_times = StartTimeTask.start_times
+    assert len(start_times) == 4
+    for previous, start_time in zip(start_times[1:], start_times[2:]):
+        assert start_time - previous >= 0.09
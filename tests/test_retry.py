@@ -0,0 +1,76 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.retry module
+"""
+import pytest
+
+from cli_toolkit.exceptions import ScriptError, TaskError
+from cli_toolkit.retry import RetryPolicy
+from cli_toolkit.script import Script
+from cli_toolkit.task import CommandLineTask
+
+
+def test_retry_policy_invalid_values() -> None:
+    """
+    Test creating retry policy with invalid values
+    """
+    with pytest.raises(ScriptError):
+        RetryPolicy(max_attempts=0)
+    with pytest.raises(ScriptError):
+        RetryPolicy(backoff_base=-1)
+    with pytest.raises(ScriptError):
+        RetryPolicy(jitter=2)
+
+
+def test_retry_policy_delay_no_jitter() -> None:
+    """
+    Test exponential backoff delays without jitter
+    """
+    policy = RetryPolicy(backoff_base=0.5, backoff_cap=3, jitter=0)
+    assert [policy.get_delay(attempt) for attempt in range(1, 6)] == [0.5, 1, 2, 3, 3]
+
+
+def test_retry_policy_delay_jitter() -> None:
+    """
+    Test backoff delays with jitter are within expected range
+    """
+    policy = RetryPolicy(backoff_base=1, backoff_cap=10, jitter=0.5)
+    for _ in range(100):
+        delay = policy.get_delay(3)
+        assert 2 <= delay <= 4
+
+
+def test_retry_policy_should_retry() -> None:
+    """
+    Test checking if failures should be retried
+    """
+    policy = RetryPolicy(max_attempts=2, retry_exceptions=(OSError,))
+    assert policy.should_retry(None, OSError('test'), 1)
+    assert not policy.should_retry(None, OSError('test'), 2)
+    assert not policy.should_retry(None, ValueError('test'), 1)
+
+
+def test_retry_policy_predicate() -> None:
+    """
+    Test retry policy with custom predicate
+    """
+    policy = RetryPolicy(predicate=lambda task, error: str(error) == 'retry')
+    assert policy.is_retryable(None, ValueError('retry'))
+    assert not policy.is_retryable(None, ValueError('fail'))
+
+
+def test_retry_policy_return_codes() -> None:
+    """
+    Test retry policy matching shell command return codes
+    """
+    script = Script()
+    task = CommandLineTask(script, ('false',))
+    policy = RetryPolicy(retry_return_codes=(75,))
+    task.returncode = 1
+    assert not policy.is_retryable(task, TaskError('test'))
+    task.returncode = 75
+    assert policy.is_retryable(task, TaskError('test'))
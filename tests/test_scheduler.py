@@ -0,0 +1,227 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.scheduler module
+"""
+import asyncio
+import json
+
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+from cli_toolkit.exceptions import ScriptError
+from cli_toolkit.scheduler import TaskDurationHistory, TaskScheduler
+from cli_toolkit.script import Script
+from cli_toolkit.task import Task
+
+
+class OrderTask(Task):
+    """
+    Test task recording start order
+    """
+    started: List[str] = []
+
+    def __init__(self, parent: Script, label: str, **kwargs: Dict[Any, Any]) -> None:
+        super().__init__(parent, **kwargs)
+        self.label = label
+
+    def __repr__(self) -> str:
+        return self.label
+
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        OrderTask.started.append(self.label)
+        await asyncio.sleep(kwargs.get('sleep', 0.01))
+
+
+class SerialScript(Script):
+    """
+    Script running one task at a time
+    """
+    max_concurrent_tasks = 1
+
+
+def test_task_scheduler_invalid_limit() -> None:
+    """
+    Test creating scheduler with invalid concurrency limit
+    """
+    with pytest.raises(ScriptError):
+        TaskScheduler(0)
+
+
+def test_task_scheduler_dispatch_order() -> None:
+    """
+    Test waiting tasks are dispatched in sort key order
+    """
+    scheduler = TaskScheduler(1)
+    started = []
+
+    async def run(key: int) -> None:
+        await scheduler.acquire(key)
+        started.append(key)
+        await asyncio.sleep(0.01)
+        scheduler.release()
+
+    async def run_all() -> None:
+        await scheduler.acquire(0)
+        tasks = [asyncio.create_task(run(key)) for key in (3, 1, 2)]
+        await asyncio.sleep(0.01)
+        assert scheduler.queued == 3
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run_all())
+    assert started == [1, 2, 3]
+    assert scheduler.running == 0
+
+
+def test_task_scheduler_cancel_waiting() -> None:
+    """
+    Test cancelling a task waiting for a slot does not leak slots
+    """
+    scheduler = TaskScheduler(1)
+
+    async def run_all() -> None:
+        await scheduler.acquire()
+        waiting = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        scheduler.release()
+        assert scheduler.running == 0
+        await scheduler.acquire()
+        assert scheduler.running == 1
+
+    asyncio.run(run_all())
+
+
+def test_task_scheduler_multiple_slots() -> None:
+    """
+    Test acquiring multiple slots at once blocks tasks queued after it
+    """
+    scheduler = TaskScheduler(3)
+    started = []
+
+    async def run(key: int, slots: int) -> None:
+        await scheduler.acquire(key, slots)
+        started.append(key)
+        await asyncio.sleep(0.01)
+        scheduler.release(slots)
+
+    async def run_all() -> None:
+        await scheduler.acquire(0)
+        tasks = [asyncio.create_task(run(key, slots)) for key, slots in ((1, 3), (2, 1))]
+        await asyncio.sleep(0.01)
+        assert scheduler.queued == 2
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run_all())
+    assert started == [1, 2]
+    assert scheduler.running == 0
+
+
+def test_task_priority_order() -> None:
+    """
+    Test tasks with higher priority are started first
+    """
+    script = SerialScript()
+    OrderTask.started = []
+    OrderTask(script, 'cleanup', priority=-1)
+    OrderTask(script, 'default')
+    OrderTask(script, 'check', priority=10)
+    script.run_async_tasks()
+    assert OrderTask.started == ['check', 'default', 'cleanup']
+
+
+def test_task_longest_first_order(monkeypatch, tmpdir) -> None:
+    """
+    Test tasks with longest expected duration are started first
+    """
+    history_file = Path(tmpdir.strpath, 'history.json')
+    history_file.write_text(json.dumps({'short': 1, 'long': 10}), encoding='utf-8')
+
+    script = SerialScript()
+    monkeypatch.setattr(script, 'longest_tasks_first', True)
+    monkeypatch.setattr(script, 'task_duration_history_file', str(history_file))
+    OrderTask.started = []
+    OrderTask(script, 'short')
+    OrderTask(script, 'unknown')
+    OrderTask(script, 'long')
+    expected = OrderTask(script, 'expected')
+    expected.expected_duration = 5
+    script.run_async_tasks()
+    assert OrderTask.started == ['long', 'expected', 'short', 'unknown']
+
+    durations = json.loads(history_file.read_text(encoding='utf-8'))
+    assert sorted(durations.keys()) == ['expected', 'long', 'short', 'unknown']
+    assert durations['long'] < 10
+
+
+def test_task_longest_first_history_key(monkeypatch) -> None:
+    """
+    Test task duration history is kept separately for task arguments
+    """
+    script = SerialScript()
+    monkeypatch.setattr(script, 'longest_tasks_first', True)
+    OrderTask.started = []
+    OrderTask(script, 'task', sleep=0.01)
+    OrderTask(script, 'task', sleep=0.1)
+    script.run_async_tasks()
+    history = script.__get_task_duration_history__()
+    durations = history.durations
+    assert sorted(durations.keys()) == ['task sleep=0.01', 'task sleep=0.1']
+    assert durations['task sleep=0.1'] > durations['task sleep=0.01']
+
+    script = SerialScript()
+    script.__task_duration_history__ = history
+    assert script.get_task_expected_duration(OrderTask(script, 'task', sleep=0.1)) == durations['task sleep=0.1']
+    assert script.get_task_expected_duration(OrderTask(script, 'task')) is None
+
+
+def test_task_history_key_stable() -> None:
+    """
+    Test task history key does not depend on repr() of object arguments
+    """
+    # pylint: disable=too-few-public-methods
+    class Target:
+        """
+        Test object without stable repr()
+        """
+
+    script = SerialScript()
+    assert OrderTask(script, 'task', target=Target()).history_key == 'task target=Target'
+    assert OrderTask(script, 'task', hosts=('a', 1), limit=None).history_key == "task hosts=['a', 1] limit=None"
+    assert OrderTask(script, 'task', targets=[Target()]).history_key == 'task targets=[Target]'
+    assert OrderTask(script, 'task', targets=[Target()], history_key='custom').history_key == 'custom'
+
+
+def test_task_duration_history_update() -> None:
+    """
+    Test updating task duration history
+    """
+    history = TaskDurationHistory(weight=0.5)
+    assert history.get('test') is None
+    history.update('test', 2)
+    history.update('test', 4)
+    assert history.get('test') == 3
+
+
+def test_task_duration_history_invalid_file(tmpdir) -> None:
+    """
+    Test loading invalid task duration history file
+    """
+    history_file = Path(tmpdir.strpath, 'history.json')
+    history_file.write_text('[]', encoding='utf-8')
+    with pytest.raises(ScriptError):
+        TaskDurationHistory(history_file).load()
+    history_file.write_text('invalid', encoding='utf-8')
+    with pytest.raises(ScriptError):
+        TaskDurationHistory(history_file).load()
@@ -16,7 +16,7 @@ from unittest.mock import patch
 
 import pytest
 
-from sys_toolkit.tests.mock import MockReturnTrue
+from sys_toolkit.tests.mock import MockCalledMethod, MockReturnTrue
 
 from cli_toolkit.script import Script
 from cli_toolkit.tests.script import (
@@ -97,13 +97,15 @@ def test_script_no_subcommand_run() -> None:
 
 def test_script_reset_error(monkeypatch) -> None:
     """
-    Test script running with error running stty reset
+    Test script running with error restoring terminal attributes
     """
-    script = Script()
     mock_method = MockOsError()
     mock_return_true = MockReturnTrue()
-    monkeypatch.setattr('os.system', mock_method)
     monkeypatch.setattr('sys.stdin.isatty', mock_return_true)
+    monkeypatch.setattr('sys.stdin.fileno', lambda: 0)
+    monkeypatch.setattr('termios.tcgetattr', MockCalledMethod(return_value=['attributes']))
+    monkeypatch.setattr('termios.tcsetattr', mock_method)
+    script = Script()
     script.reset_stty()
     assert mock_method.call_count > 0
 
@@ -0,0 +1,261 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for running script command lines in batch mode
+"""
+import argparse
+import asyncio
+import io
+import os
+import signal
+import sys
+import threading
+import time
+
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from cli_toolkit.batch import BatchLine, read_batch_lines
+from cli_toolkit.command import Command
+from cli_toolkit.script import Script
+from cli_toolkit.task import Task
+
+
+class CountTask(Task):
+    """
+    Test task counting runs
+    """
+    runs = 0
+
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        await asyncio.sleep(0)
+        CountTask.runs += 1
+
+
+class EchoCommand(Command):
+    """
+    Test command showing arguments
+    """
+    name = 'echo'
+
+    def register_parser_arguments(self, parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+        parser.add_argument('words', nargs='*')
+        return parser
+
+    def run(self, args: argparse.Namespace) -> None:
+        self.message(' '.join(args.words))
+
+
+class FailCommand(Command):
+    """
+    Test command exiting with exit code
+    """
+    name = 'fail'
+
+    def register_parser_arguments(self, parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+        parser.add_argument('--code', type=int, default=1)
+        return parser
+
+    def run(self, args: argparse.Namespace) -> None:
+        self.exit(args.code, f'failed with {args.code}')
+
+
+class ErrorCommand(Command):
+    """
+    Test command raising an exception
+    """
+    name = 'error'
+
+    def run(self, args: argparse.Namespace) -> None:
+        raise ValueError('Error in command')
+
+
+class SleepCommand(Command):
+    """
+    Test command sleeping for some time
+    """
+    name = 'sleep'
+
+    def register_parser_arguments(self, parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+        parser.add_argument('seconds', nargs='?', type=float, default=0.5)
+        return parser
+
+    def run(self, args: argparse.Namespace) -> None:
+        time.sleep(args.seconds)
+
+
+class TasksCommand(Command):
+    """
+    Test command running tasks
+    """
+    name = 'tasks'
+
+    def run(self, args: argparse.Namespace) -> None:
+        CountTask(self)
+        CountTask(self)
+        self.run_subcommand(args)
+
+
+class BatchScript(Script):
+    """
+    Test script with subcommands run in batch
+    """
+    subcommands = (
+        EchoCommand,
+        FailCommand,
+        ErrorCommand,
+        SleepCommand,
+        TasksCommand,
+    )
+
+
+def run_batch(monkeypatch, tmpdir, lines: List[str], *args: str) -> Tuple[BatchScript, int]:
+    """
+    Run batch test script with batch file lines, returning the script and exit code
+    """
+    path = os.path.join(tmpdir.strpath, 'batch.txt')
+    with open(path, 'w', encoding='utf-8') as handle:
+        handle.write(''.join(f'{line}\n' for line in lines))
+    script = BatchScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--batch', path] + list(args))
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    return script, exit_status.value.code
+
+
+def get_exit_codes(script: BatchScript) -> List[Tuple[int, int]]:
+    """
+    Return line numbers and exit codes of batch lines
+    """
+    return [(batch_line.number, batch_line.exit_code) for batch_line in script.batch_lines]
+
+
+def test_batch_read_lines() -> None:
+    """
+    Test reading batch lines skipping empty lines and comments
+    """
+    lines = list(read_batch_lines(io.StringIO('echo a\n\n  # comment\necho "b c" # comment\n')))
+    assert [repr(line) for line in lines] == ['line 1: echo a', 'line 4: echo "b c" # comment']
+    assert lines[1].argv == ['echo', 'b c']
+    with pytest.raises(ValueError):
+        BatchLine(1, 'echo "a').argv  # pylint: disable=expression-not-assigned
+
+
+def test_script_batch(monkeypatch, tmpdir, capsys) -> None:
+    """
+    Test running batch lines with failing lines
+    """
+    lines = [
+        'echo a',
+        '# comment',
+        '',
+        'fail --code 3',
+        'echo "b c"',
+        'missing',
+        'echo "d',
+        'error',
+        '--batch other.txt',
+        'echo e',
+    ]
+    script, exit_code = run_batch(monkeypatch, tmpdir, lines)
+    assert exit_code == 1
+    assert get_exit_codes(script) == [(1, 0), (4, 3), (5, 0), (6, 2), (7, 2), (8, 1), (9, 2), (10, 0)]
+    captured = capsys.readouterr()
+    assert captured.out.splitlines() == ['a', 'b c', 'e']
+    assert 'failed with 3' in captured.err
+    assert 'Batch line 4: fail --code 3 failed with exit code 3' in captured.err
+    assert 'ValueError: Error in command' in captured.err
+    assert '5 of 8 batch lines failed' in captured.err
+
+
+def test_script_batch_script_name(monkeypatch, tmpdir, capsys) -> None:
+    """
+    Test running batch lines starting with the script name
+    """
+    script, exit_code = run_batch(monkeypatch, tmpdir, ['test-cli echo a', '/usr/bin/test-cli echo b', 'echo c'])
+    assert exit_code == 0
+    assert get_exit_codes(script) == [(1, 0), (2, 0), (3, 0)]
+    assert capsys.readouterr().out.splitlines() == ['a', 'b', 'c']
+
+
+def test_script_batch_stdin_tasks(monkeypatch) -> None:
+    """
+    Test running batch lines with tasks from stdin
+    """
+    CountTask.runs = 0
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('tasks\ntasks\n'))
+    script = BatchScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--batch', '-'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+    assert get_exit_codes(script) == [(1, 0), (2, 0)]
+    assert CountTask.runs == 4
+
+
+def test_script_batch_jobs(monkeypatch, tmpdir) -> None:
+    """
+    Test running batch lines in parallel processes
+    """
+    start = time.monotonic()
+    script, exit_code = run_batch(
+        monkeypatch,
+        tmpdir,
+        ['sleep', 'sleep', 'fail --code 4', 'sleep', 'sleep'],
+        '--batch-jobs', '4',
+    )
+    assert time.monotonic() - start < 1.8
+    assert exit_code == 1
+    assert sorted(get_exit_codes(script)) == [(1, 0), (2, 0), (3, 4), (4, 0), (5, 0)]
+
+
+def test_script_batch_jobs_interrupted(monkeypatch, tmpdir) -> None:
+    """
+    Test forked batch line processes are terminated and reaped when the script exits
+    """
+    path = os.path.join(tmpdir.strpath, 'batch.txt')
+    with open(path, 'w', encoding='utf-8') as handle:
+        handle.write('sleep 10\nsleep 10\n')
+    script = BatchScript()
+    pids = []
+    fork_batch_line = script.__fork_batch_line__
+
+    def fork(batch_line: BatchLine) -> int:
+        pids.append(fork_batch_line(batch_line))
+        return pids[-1]
+
+    monkeypatch.setattr(script, '__fork_batch_line__', fork)
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--batch', path, '--batch-jobs', '2'])
+    timer = threading.Timer(0.3, os.kill, (os.getpid(), signal.SIGTERM))
+    start = time.monotonic()
+    timer.start()
+    try:
+        with pytest.raises(SystemExit) as exit_status:
+            script.run()
+    finally:
+        timer.cancel()
+    assert exit_status.value.code == 1
+    assert time.monotonic() - start < 5
+    assert len(pids) == 2
+    for pid in pids:
+        with pytest.raises(ChildProcessError):
+            os.waitpid(pid, os.WNOHANG)
+
+
+def test_script_batch_errors(monkeypatch, tmpdir) -> None:
+    """
+    Test invalid batch file and number of jobs
+    """
+    assert run_batch(monkeypatch, tmpdir, ['echo'], '--batch-jobs', '0')[1] == 1
+    script = BatchScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--batch', os.path.join(tmpdir.strpath, 'missing.txt')])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 1
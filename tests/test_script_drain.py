@@ -0,0 +1,198 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for draining script tasks on interrupt signals
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+
+from typing import Any, Dict
+
+import pytest
+
+from cli_toolkit.command import Command
+from cli_toolkit.script import Script
+from cli_toolkit.task import (
+    CommandLineTask,
+    Task,
+    TASK_STATUS_CANCELLED,
+    TASK_STATUS_SUCCEEDED,
+)
+
+
+class SignalTask(Task):
+    """
+    Test task sending signals to the script
+    """
+    priority = 1
+
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        for _count in range(kwargs.get('count', 1)):
+            await asyncio.sleep(0.2)
+            os.kill(os.getpid(), kwargs.get('signum', signal.SIGTERM))
+
+
+class DrainCommand(Command):
+    """
+    Test command running tasks
+    """
+    name = 'tasks'
+    max_concurrent_tasks = 2
+    sleep = '0.5'
+    signals = 1
+
+    def run(self, args: argparse.Namespace) -> None:
+        CommandLineTask(self, ('sleep', self.sleep), priority=1)
+        SignalTask(self, count=self.signals)
+        CommandLineTask(self, ('true',))
+        CommandLineTask(self, ('true',))
+        self.run_subcommand(args)
+
+
+class GraceCommand(DrainCommand):
+    """
+    Test command with running task exceeding the grace period
+    """
+    name = 'grace'
+    sleep = '10'
+    drain_grace_period = 0.3
+
+
+class ForwardCommand(DrainCommand):
+    """
+    Test command forwarding signal to processes
+    """
+    name = 'forward'
+    sleep = '10'
+    drain_forward_signal = True
+
+
+class KillCommand(DrainCommand):
+    """
+    Test command receiving two signals
+    """
+    name = 'kill'
+    sleep = '10'
+    signals = 2
+
+
+class DrainScript(Script):
+    """
+    Test script with subcommands running tasks
+    """
+    subcommands = (
+        DrainCommand,
+        GraceCommand,
+        ForwardCommand,
+        KillCommand,
+    )
+
+
+def run_script(monkeypatch, command: str) -> DrainScript:
+    """
+    Run drain test script with command, returning the script
+    """
+    script = DrainScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', command])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 1
+    return script
+
+
+def get_tasks(script: DrainScript, command: str) -> Dict[str, Any]:
+    """
+    Return script tasks of command by name
+    """
+    command = script.__subcommands__[command]
+    return {
+        repr(callback.__self__): callback.__self__
+        for callback, _kwargs in command.__async_task_callbacks__
+    }
+
+
+def test_script_drain_running_tasks_finish(monkeypatch, capsys) -> None:
+    """
+    Test first signal cancels queued tasks and lets running tasks finish
+    """
+    script = run_script(monkeypatch, 'tasks')
+    tasks = get_tasks(script, 'tasks')
+    assert tasks['sleep 0.5'].status == TASK_STATUS_SUCCEEDED
+    assert tasks['sleep 0.5'].returncode == 0
+    assert tasks['SignalTask'].status == TASK_STATUS_SUCCEEDED
+    assert tasks['true'].status == TASK_STATUS_CANCELLED
+
+    errors = capsys.readouterr().err
+    assert 'Received SIGTERM, waiting up to 10s for running tasks to finish' in errors
+    assert 'Interrupted by SIGTERM: 2 of 4 tasks cancelled' in errors
+
+
+def test_script_drain_grace_period(monkeypatch, capsys) -> None:
+    """
+    Test running tasks are cancelled and processes reaped when grace period expires
+    """
+    start = time.monotonic()
+    script = run_script(monkeypatch, 'grace')
+    assert time.monotonic() - start < 5
+    task = get_tasks(script, 'grace')['sleep 10']
+    assert task.status == TASK_STATUS_CANCELLED
+    assert task.returncode is None
+    assert task.resource_usage is not None
+    assert 'Drain grace period expired, cancelling 1 running tasks' in capsys.readouterr().err
+
+
+def test_script_drain_forward_signal(monkeypatch) -> None:
+    """
+    Test forwarding signal to processes of running tasks
+    """
+    start = time.monotonic()
+    script = run_script(monkeypatch, 'forward')
+    assert time.monotonic() - start < 5
+    task = get_tasks(script, 'forward')['sleep 10']
+    assert task.status == TASK_STATUS_SUCCEEDED
+    assert task.returncode == -signal.SIGTERM
+
+
+def test_script_drain_second_signal_kills(monkeypatch) -> None:
+    """
+    Test second signal kills processes of running tasks and exits
+    """
+    start = time.monotonic()
+    script = run_script(monkeypatch, 'kill')
+    assert time.monotonic() - start < 5
+    task = get_tasks(script, 'kill')['sleep 10']
+    assert task.status == TASK_STATUS_CANCELLED
+    assert task.process is None
+    assert task.resource_usage is not None
+
+
+def test_command_line_task_process_group() -> None:
+    """
+    Test signals are sent to process group of tasks with new_process_group
+    """
+    class GroupTask(CommandLineTask):
+        """
+        Test task running a shell with child process in new process group
+        """
+        new_process_group = True
+
+        async def run(self, **kwargs: Dict[Any, Any]) -> None:
+            asyncio.get_running_loop().call_later(0.2, self.send_signal, signal.SIGTERM)
+            return await super().run(**kwargs)
+
+    script = Script()
+    task = GroupTask(script, ('sh', '-c', 'sleep 10; true'))
+    start = time.monotonic()
+    script.run_async_tasks()
+    assert time.monotonic() - start < 5
+    assert task.returncode == -signal.SIGTERM
@@ -0,0 +1,305 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for invoking scripts embedded in other programs
+"""
+import argparse
+import asyncio
+import io
+import os
+import signal
+import threading
+
+from typing import Any, Dict
+
+from cli_toolkit.command import Command
+from cli_toolkit.script import Script
+from cli_toolkit.task import CommandLineTask, Task
+
+
+class LoopTask(Task):
+    """
+    Test task returning the running event loop
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        return asyncio.get_running_loop()
+
+
+class ExitTask(Task):
+    """
+    Test task exiting the command
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        self.parent.exit(3, 'task exited')
+
+
+class EchoCommand(Command):
+    """
+    Test command showing arguments
+    """
+    name = 'echo'
+
+    def register_parser_arguments(self, parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+        parser.add_argument('words', nargs='*')
+        return parser
+
+    def run(self, args: argparse.Namespace) -> None:
+        self.message(' '.join(args.words))
+        self.debug('debug message')
+
+
+class FailCommand(Command):
+    """
+    Test command exiting with exit code
+    """
+    name = 'fail'
+
+    def register_parser_arguments(self, parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+        parser.add_argument('--code', type=int, default=1)
+        return parser
+
+    def run(self, args: argparse.Namespace) -> None:
+        self.exit(args.code, f'failed with {args.code}')
+
+
+class ErrorCommand(Command):
+    """
+    Test command raising an exception
+    """
+    name = 'error'
+
+    def run(self, args: argparse.Namespace) -> None:
+        raise ValueError('Error in command')
+
+
+class TasksCommand(Command):
+    """
+    Test command running async tasks
+    """
+    name = 'tasks'
+
+    def run(self, args: argparse.Namespace) -> None:
+        LoopTask(self)
+        loops = self.run_async_tasks()
+        self.message(id(loops[0]))
+
+
+class ProcessCommand(Command):
+    """
+    Test command running a command line task
+    """
+    name = 'process'
+    task_output_thread = True
+
+    def run(self, args: argparse.Namespace) -> None:
+        CommandLineTask(self, ('echo', 'process output'))
+        self.run_async_tasks()
+
+
+class ExitTasksCommand(Command):
+    """
+    Test command exiting from an async task
+    """
+    name = 'exit-tasks'
+
+    def run(self, args: argparse.Namespace) -> None:
+        LoopTask(self)
+        ExitTask(self)
+        self.run_async_tasks()
+
+
+class BlockCommand(Command):
+    """
+    Test command blocking until released
+    """
+    name = 'block'
+    started = threading.Event()
+    release = threading.Event()
+
+    def run(self, args: argparse.Namespace) -> None:
+        BlockCommand.started.set()
+        BlockCommand.release.wait(10)
+        self.message('released')
+
+
+class InvokeCommand(Command):
+    """
+    Test command invoking the script again
+    """
+    name = 'invoke'
+
+    def run(self, args: argparse.Namespace) -> None:
+        invocation = self.__parent__.invoke(['echo', 'nested'])
+        self.message(f'nested output: {invocation.exit_code} {invocation.output.strip()}')
+
+
+class EmbeddedScript(Script):
+    """
+    Test script embedded in a program
+    """
+    signal_handlers = False
+    subcommands = (
+        EchoCommand,
+        FailCommand,
+        ErrorCommand,
+        TasksCommand,
+        ProcessCommand,
+        ExitTasksCommand,
+        BlockCommand,
+        InvokeCommand,
+    )
+
+
+def test_script_invoke() -> None:
+    """
+    Test invoking script repeatedly with output and exit codes
+    """
+    handler = signal.getsignal(signal.SIGINT)
+    script = EmbeddedScript()
+    for count in range(3):
+        invocation = script.invoke(['echo', 'a', str(count)])
+        assert invocation.exit_code == 0
+        assert invocation.output == f'a {count}\n'
+        assert invocation.errors == ''
+
+    invocation = script.invoke(['fail', '--code', '3'])
+    assert invocation.exit_code == 3
+    assert invocation.output == ''
+    assert invocation.errors == 'failed with 3\n'
+
+    invocation = script.invoke(['echo', '--invalid'])
+    assert invocation.exit_code == 2
+    assert 'unrecognized arguments: --invalid' in invocation.errors
+
+    invocation = script.invoke(['error'])
+    assert invocation.exit_code == 1
+    assert 'ValueError: Error in command' in invocation.errors
+
+    assert signal.getsignal(signal.SIGINT) is handler
+
+
+def test_script_invoke_global_options() -> None:
+    """
+    Test --debug and --quiet apply only to the invocation
+    """
+    script = EmbeddedScript()
+    invocation = script.invoke(['--debug', '--quiet', 'echo', 'a'])
+    assert invocation.exit_code == 0
+    assert invocation.output == ''
+    assert invocation.errors == 'debug message\n'
+    invocation = script.invoke(['echo', 'a'])
+    assert (invocation.output, invocation.errors) == ('a\n', '')
+    assert not script.__debug_enabled__
+    assert not script.__silent__
+
+
+def test_script_invoke_script_name() -> None:
+    """
+    Test invoking command line starting with the script name
+    """
+    script = EmbeddedScript()
+    invocation = script.invoke([script.name, 'echo', 'a'])
+    assert (invocation.exit_code, invocation.output) == (0, 'a\n')
+    invocation = script.invoke([f'/usr/local/bin/{script.name}', '--quiet', 'echo', 'a'])
+    assert (invocation.exit_code, invocation.output) == (0, '')
+    invocation = script.invoke(['other', 'echo', 'a'])
+    assert invocation.exit_code == 2
+
+
+def test_script_invoke_streams(tmpdir) -> None:
+    """
+    Test invoking script with output streams
+    """
+    script = EmbeddedScript()
+    stdout = io.StringIO()
+    invocation = script.invoke(['echo', 'a'], stdout=stdout)
+    assert invocation.stdout is stdout
+    assert stdout.getvalue() == 'a\n'
+
+    path = os.path.join(tmpdir.strpath, 'output.txt')
+    with open(path, 'w', encoding='utf-8') as handle:
+        invocation = script.invoke(['echo', 'b'], stdout=handle)
+    assert invocation.output is None
+    with open(path, 'r', encoding='utf-8') as handle:
+        assert handle.read() == 'b\n'
+
+
+def test_script_invoke_tasks() -> None:
+    """
+    Test invoking commands running async tasks in the script event loop
+    """
+    script = EmbeddedScript()
+    first = script.invoke(['tasks'])
+    second = script.invoke(['tasks'])
+    assert (first.exit_code, second.exit_code) == (0, 0)
+    assert first.output == second.output
+    assert script.__event_loop__ is not None
+    script.close_event_loop()
+
+
+def test_script_invoke_process_output() -> None:
+    """
+    Test output of command line tasks written by the task output writer thread is captured
+    """
+    script = EmbeddedScript()
+    invocation = script.invoke(['process'])
+    assert (invocation.exit_code, invocation.output) == (0, 'process output\n')
+    script.close_event_loop()
+
+
+def test_script_invoke_tasks_exit() -> None:
+    """
+    Test exiting from async tasks of an invoked command keeps the script event loop
+    """
+    script = EmbeddedScript()
+    first = script.invoke(['tasks'])
+    loop = script.__event_loop__
+    invocation = script.invoke(['exit-tasks'])
+    assert invocation.exit_code == 3
+    assert invocation.errors == 'task exited\n'
+    assert script.__event_loop__ is loop
+    assert not loop.is_closed()
+    assert not asyncio.all_tasks(loop)
+    second = script.invoke(['tasks'])
+    assert second.output == first.output
+    script.close_event_loop()
+
+
+def test_script_invoke_nested() -> None:
+    """
+    Test invoking script from a command of an invoked script
+    """
+    script = EmbeddedScript()
+    invocation = script.invoke(['invoke'])
+    assert invocation.exit_code == 0
+    assert invocation.output == 'nested output: 0 nested\n'
+    assert invocation.errors == ''
+
+
+def test_script_invoke_threads() -> None:
+    """
+    Test output of invocations running in other threads is captured separately
+    """
+    BlockCommand.started.clear()
+    BlockCommand.release.clear()
+    invocations = []
+    thread = threading.Thread(target=lambda: invocations.append(EmbeddedScript().invoke(['block'])))
+    thread.start()
+    try:
+        assert BlockCommand.started.wait(10)
+        invocation = EmbeddedScript().invoke(['echo', 'a'])
+    finally:
+        BlockCommand.release.set()
+        thread.join(10)
+    assert (invocation.exit_code, invocation.output) == (0, 'a\n')
+    assert len(invocations) == 1
+    assert (invocations[0].exit_code, invocations[0].output) == (0, 'released\n')
@@ -0,0 +1,142 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for SIGUSR1 status of cli_toolkit.script.Script
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import threading
+
+from typing import Any, Dict
+
+import pytest
+
+from cli_toolkit.command import Command
+from cli_toolkit.script import Script
+from cli_toolkit.task import CommandLineTask, Task
+
+
+class SignalTask(Task):
+    """
+    Test task sending SIGUSR1 to the script while other tasks are running
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        await asyncio.sleep(0.2)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        await asyncio.sleep(0.1)
+
+
+class StatusCommand(Command):
+    """
+    Test command running tasks
+    """
+    name = 'tasks'
+    max_concurrent_tasks = 2
+
+    def run(self, args: argparse.Namespace) -> None:
+        CommandLineTask(self, ('sleep', '0.5'), priority=1)
+        SignalTask(self)
+        CommandLineTask(self, ('true',))
+        self.run_subcommand(args)
+
+
+class StatusScript(Script):
+    """
+    Test script with subcommand running tasks
+    """
+    subcommands = (
+        StatusCommand,
+    )
+
+
+def test_script_status_stderr(monkeypatch, capfd) -> None:
+    """
+    Test showing status on stderr with SIGUSR1
+    """
+    script = StatusScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+
+    errors = capfd.readouterr().err.splitlines()
+    assert errors[0].startswith(f'Status of test-cli pid {os.getpid()} after ')
+    assert errors[0].endswith('2 running, 1 queued, 0 finished')
+    assert errors[1] == 'Oldest running tasks:'
+    assert errors[2].endswith('sleep 0.5')
+    assert ' pid ' in errors[2]
+    assert errors[3].endswith('SignalTask')
+    assert 'Main thread stack:' not in errors
+
+
+def test_script_status_file_stacks(monkeypatch, tmpdir) -> None:
+    """
+    Test writing status with stacks to status file
+    """
+    status_file = os.path.join(tmpdir.strpath, 'status.txt')
+    script = StatusScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--status-file', status_file, '--status-stacks', 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+
+    with open(status_file, encoding='utf-8') as filedescriptor:
+        lines = filedescriptor.read().splitlines()
+    assert lines[0].endswith('2 running, 1 queued, 0 finished')
+    assert 'Main thread stack:' in lines
+    assert any(line.startswith("Stack for <Task pending name='SignalTask'") for line in lines)
+
+
+def test_script_status_finished(capfd) -> None:
+    """
+    Test status after tasks have finished
+    """
+    script = StatusScript()
+    command = script.__subcommands__['tasks']
+    CommandLineTask(command, ('true',))
+    command.run_async_tasks()
+    script.SIGUSR1(signal.SIGUSR1, None)
+    assert capfd.readouterr().err.rstrip().endswith('0 running, 0 queued, 1 finished (1 succeeded)')
+
+
+def test_script_status_output_lock_held(capfd) -> None:
+    """
+    Test status is written while another thread holds the buffered output writer lock
+    """
+    class BufferedStatusScript(StatusScript):
+        """
+        Test script with buffered output
+        """
+        buffered_output = True
+
+    script = BufferedStatusScript()
+    lock = script.__console_writer__.stderr.__lock__
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold_lock() -> None:
+        with lock:
+            locked.set()
+            release.wait(10)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    try:
+        assert locked.wait(10)
+        handler = threading.Thread(target=script.SIGUSR1, args=(signal.SIGUSR1, None), daemon=True)
+        handler.start()
+        handler.join(5)
+        assert not handler.is_alive()
+    finally:
+        release.set()
+        holder.join(10)
+    assert 'Status of ' in capfd.readouterr().err
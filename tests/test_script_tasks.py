@@ -7,19 +7,34 @@
 Unit tests for cli_toolkit.task module
 """
 import asyncio
+import json
 import os
 import signal
 import sys
+import time
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import pytest
 
 from sys_toolkit.tests.mock import MockCalledMethod
 
-from cli_toolkit.base import NestedCliCommand
+from cli_toolkit.base import (
+    NestedCliCommand,
+    TASK_FAILURE_POLICY_KEEP_GOING,
+    TASK_FAILURE_POLICY_MAX_FAILURES,
+)
+from cli_toolkit.exceptions import ScriptError, TaskError
+from cli_toolkit.retry import RetryPolicy
 from cli_toolkit.script import Script
-from cli_toolkit.task import Task, CommandLineTask
+from cli_toolkit.task import (
+    Task,
+    CommandLineTask,
+    TASK_STATUS_CANCELLED,
+    TASK_STATUS_FAILED,
+    TASK_STATUS_RUNNING,
+    TASK_STATUS_SUCCEEDED,
+)
 
 
 # pylint: disable=too-few-public-methods
@@ -89,6 +104,75 @@ class CancelTask(Task):
         os.kill(pid, signal.SIGINT)
 
 
+class SlowFailTask(Task):
+    """
+    Test task failing after waiting for some time
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        await asyncio.sleep(kwargs.get('sleep', 0.1))
+        raise ValueError('Failure after sleep')
+
+
+class FlakyTask(Task):
+    """
+    Test task failing until specified attempt
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        if self.attempts < kwargs['succeed_attempt']:
+            raise OSError(f'Flaky failure {self.attempts}')
+        return self.attempts
+
+
+class ResultTask(Task):
+    """
+    Test task returning result after waiting for some time
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        await asyncio.sleep(kwargs['sleep'])
+        return kwargs['result']
+
+
+class ConcurrencyTask(Task):
+    """
+    Test task recording number of concurrently running tasks
+    """
+    running = 0
+    max_running = 0
+
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        ConcurrencyTask.running += 1
+        ConcurrencyTask.max_running = max(ConcurrencyTask.running, ConcurrencyTask.max_running)
+        await asyncio.sleep(0.05)
+        ConcurrencyTask.running -= 1
+
+
+class KeepGoingScript(Script):
+    """
+    Script running all tasks regardless of failures
+    """
+    task_failure_policy = TASK_FAILURE_POLICY_KEEP_GOING
+
+
+class MaxFailuresScript(Script):
+    """
+    Script cancelling tasks after two failures
+    """
+    task_failure_policy = TASK_FAILURE_POLICY_MAX_FAILURES
+    max_task_failures = 2
+
+
 def test_script_tasks_cli_ls(monkeypatch) -> None:
     """
     Test running trivial command from script CLI task
@@ -181,3 +265,491 @@ def test_script_tasks_with_multiple_tasks() -> None:
     assert dummy.message is None
     assert isinstance(task.message, str)
     assert task.message == kwargs['message']
+
+
+def test_script_tasks_fail_fast_cancels_tasks() -> None:
+    """
+    Test default fail-fast policy cancels remaining tasks on first failure
+    """
+    script = Script()
+    FailTask(script)
+    task = MessageTask(script, sleep=10, message='Not set')
+    start = time.monotonic()
+    with pytest.raises(ValueError):
+        script.run()
+    assert time.monotonic() - start < 5
+    assert task.message is None
+
+
+def test_script_tasks_fail_fast_terminates_process() -> None:
+    """
+    Test fail-fast policy terminates running shell command processes
+    """
+    script = Script()
+    SlowFailTask(script)
+    task = CommandLineTask(script, ('sleep', '10'))
+    start = time.monotonic()
+    with pytest.raises(ValueError):
+        script.run()
+    assert time.monotonic() - start < 5
+    assert task.returncode is None
+
+
+def test_script_tasks_keep_going(capsys) -> None:
+    """
+    Test keep-going policy runs all tasks and exits with error
+    """
+    script = KeepGoingScript()
+    FailTask(script)
+    FailTask(script)
+    task = MessageTask(script, sleep=0.2, message='Test message')
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 1
+    assert task.message == 'Test message'
+    errors = capsys.readouterr().err.splitlines()
+    assert 'Task FailTask failed: Failure is an option' in errors
+    assert '2 of 3 tasks failed' in errors
+
+
+def test_script_tasks_max_failures() -> None:
+    """
+    Test max-failures policy cancels remaining tasks after allowed failures
+    """
+    script = MaxFailuresScript()
+    FailTask(script)
+    SlowFailTask(script, sleep=0.1)
+    task = MessageTask(script, sleep=10, message='Not set')
+    with pytest.raises(TaskError):
+        script.run_async_tasks()
+    assert task.message is None
+
+
+def test_script_tasks_max_failures_not_reached() -> None:
+    """
+    Test max-failures policy runs all tasks when failure limit is not reached
+    """
+    script = MaxFailuresScript()
+    FailTask(script)
+    task = MessageTask(script, sleep=0.1, message='Test message')
+    with pytest.raises(TaskError):
+        script.run_async_tasks()
+    assert task.message == 'Test message'
+
+
+def test_script_tasks_invalid_failure_policy(monkeypatch) -> None:
+    """
+    Test running tasks with invalid failure policy settings
+    """
+    script = Script()
+    MessageTask(script)
+    monkeypatch.setattr(script, 'task_failure_policy', 'invalid')
+    with pytest.raises(ScriptError):
+        script.run_async_tasks()
+
+    monkeypatch.setattr(script, 'task_failure_policy', TASK_FAILURE_POLICY_MAX_FAILURES)
+    with pytest.raises(ScriptError):
+        script.run_async_tasks()
+
+
+def test_script_tasks_cli_expected_return_codes() -> None:
+    """
+    Test shell command task with unexpected return code fails
+    """
+    script = Script()
+    task = CommandLineTask(script, ('false',), expected_return_codes=(0,))
+    with pytest.raises(TaskError):
+        script.run_async_tasks()
+    assert task.returncode == 1
+    assert repr(task) == 'false'
+
+
+def test_script_tasks_results() -> None:
+    """
+    Test run_async_tasks returns results of tasks in order
+    """
+    script = Script()
+    CommandLineTask(script, ('false',))
+    CommandLineTask(script, ('true',))
+    assert script.run_async_tasks() == [1, 0]
+
+
+def test_script_tasks_retry_success() -> None:
+    """
+    Test retrying flaky task until it succeeds
+    """
+    script = Script()
+    policy = RetryPolicy(max_attempts=3, backoff_base=0.01, jitter=0)
+    task = FlakyTask(script, retry_policy=policy, succeed_attempt=3)
+    assert script.run_async_tasks() == [3]
+    assert task.attempts == 3
+
+
+def test_script_tasks_retry_attempts_exhausted() -> None:
+    """
+    Test retrying flaky task fails when attempts are exhausted
+    """
+    script = Script()
+    policy = RetryPolicy(max_attempts=2, backoff_base=0.01, jitter=0)
+    task = FlakyTask(script, retry_policy=policy, succeed_attempt=3)
+    with pytest.raises(OSError):
+        script.run_async_tasks()
+    assert task.attempts == 2
+
+
+def test_script_tasks_retry_not_retryable() -> None:
+    """
+    Test failures not matching retry policy are not retried
+    """
+    script = Script()
+    policy = RetryPolicy(max_attempts=3, backoff_base=0.01, retry_exceptions=(KeyError,))
+    task = FlakyTask(script, retry_policy=policy, succeed_attempt=3)
+    with pytest.raises(OSError):
+        script.run_async_tasks()
+    assert task.attempts == 1
+
+
+def test_script_tasks_retry_releases_slot(monkeypatch) -> None:
+    """
+    Test task waiting for retry does not block other tasks with concurrency limit
+    """
+    script = Script()
+    monkeypatch.setattr(script, 'max_concurrent_tasks', 1)
+    policy = RetryPolicy(max_attempts=2, backoff_base=1, jitter=0)
+    FlakyTask(script, retry_policy=policy, succeed_attempt=2)
+    task = MessageTask(script, sleep=0.8, message='Test message')
+    start = time.monotonic()
+    script.run_async_tasks()
+    assert 1 <= time.monotonic() - start < 1.5
+    assert task.message == 'Test message'
+
+
+def test_script_tasks_max_concurrent_tasks(monkeypatch) -> None:
+    """
+    Test limiting number of concurrently running tasks
+    """
+    script = Script()
+    monkeypatch.setattr(script, 'max_concurrent_tasks', 2)
+    for _ in range(6):
+        ConcurrencyTask(script)
+    script.run_async_tasks()
+    assert ConcurrencyTask.max_running == 2
+
+    monkeypatch.setattr(script, 'max_concurrent_tasks', 0)
+    with pytest.raises(ScriptError):
+        script.run_async_tasks()
+
+
+def test_script_tasks_resource_usage(monkeypatch, tmpdir, capsys) -> None:
+    """
+    Test task resource usage accounting and summary
+    """
+    summary_file = os.path.join(tmpdir.strpath, 'summary.json')
+    script = KeepGoingScript()
+    monkeypatch.setattr(script, 'task_summary', True)
+    monkeypatch.setattr(script, 'task_summary_file', summary_file)
+    command_task = CommandLineTask(script, (sys.executable, '-c', 'sum(range(1000000))'))
+    sleep_task = MessageTask(script, sleep=0.2)
+    fail_task = FailTask(script)
+    with pytest.raises(TaskError):
+        script.run_async_tasks()
+
+    assert command_task.status == TASK_STATUS_SUCCEEDED
+    assert command_task.resource_usage.max_rss > 0
+    assert command_task.wall_time > 0
+    assert sleep_task.wall_time >= 0.2
+    assert fail_task.status == TASK_STATUS_FAILED
+    assert fail_task.attempts == 1
+
+    with open(summary_file, encoding='utf-8') as filedescriptor:
+        summary = json.load(filedescriptor)
+    assert len(summary) == 3
+    assert summary[0]['wall_time'] >= summary[1]['wall_time'] >= summary[2]['wall_time']
+    assert [item for item in summary if 'max_rss' in item][0]['returncode'] == 0
+
+    errors = capsys.readouterr().err.splitlines()
+    assert 'Task summary: 3 tasks: 1 failed, 2 succeeded' in errors
+
+
+def test_script_tasks_cancelled_status() -> None:
+    """
+    Test cancelled tasks have cancelled status
+    """
+    script = Script()
+    FailTask(script)
+    task = MessageTask(script, sleep=10)
+    with pytest.raises(ValueError):
+        script.run_async_tasks()
+    assert task.status == TASK_STATUS_CANCELLED
+
+
+def test_script_tasks_as_completed() -> None:
+    """
+    Test iterating task results as tasks finish while other tasks are running
+    """
+    script = Script()
+    slow_task = ResultTask(script, sleep=0.3, result='slow')
+    ResultTask(script, sleep=0.1, result='fast')
+    ResultTask(script, sleep=0.2, result='medium')
+
+    async def collect_results() -> List[Any]:
+        results = []
+        async for result in script.as_completed_async_tasks():
+            results.append((result, slow_task.status))
+        return results
+
+    assert asyncio.run(collect_results()) == [
+        ('fast', TASK_STATUS_RUNNING),
+        ('medium', TASK_STATUS_RUNNING),
+        ('slow', TASK_STATUS_SUCCEEDED),
+    ]
+
+
+def test_script_tasks_as_completed_many_tasks() -> None:
+    """
+    Test waiting for many tasks takes time linear to the number of tasks
+    """
+    script = Script()
+    script.max_concurrent_tasks = 8
+    for index in range(20000):
+        ResultTask(script, sleep=0, result=index)
+    start = time.monotonic()
+    results = script.run_async_tasks()
+    assert time.monotonic() - start < 10
+    assert results == list(range(20000))
+
+
+def test_script_tasks_as_completed_many_tasks_streamed() -> None:
+    """
+    Test results of many tasks are yielded while remaining tasks are running
+    """
+    script = Script()
+    script.max_concurrent_tasks = 8
+    tasks = [ResultTask(script, sleep=0, result=index) for index in range(20000)]
+
+    async def collect_results() -> Tuple[List[Any], int]:
+        results = []
+        pending = None
+        async for result in script.as_completed_async_tasks():
+            if pending is None:
+                pending = len([task for task in tasks if task.status != TASK_STATUS_SUCCEEDED])
+            results.append(result)
+        return results, pending
+
+    start = time.monotonic()
+    results, pending = script.run_coroutine(collect_results())
+    assert time.monotonic() - start < 10
+    assert sorted(results) == list(range(20000))
+    assert pending > 19000
+    script.close_event_loop()
+
+
+def test_script_tasks_as_completed_break() -> None:
+    """
+    Test remaining tasks are cancelled when iteration of task results is stopped
+    """
+    script = Script()
+    ResultTask(script, sleep=0.1, result='fast')
+    slow_task = ResultTask(script, sleep=10, result='slow')
+
+    async def first_result() -> Any:
+        results = script.as_completed_async_tasks()
+        async for result in results:
+            await results.aclose()
+            return result
+        return None
+
+    start = time.monotonic()
+    assert asyncio.run(first_result()) == 'fast'
+    assert time.monotonic() - start < 5
+    assert slow_task.status == TASK_STATUS_CANCELLED
+    assert script.__task_loop__ is None
+
+
+def test_script_tasks_as_completed_keep_going() -> None:
+    """
+    Test iterating task results with failed tasks and keep-going policy
+    """
+    script = KeepGoingScript()
+    ResultTask(script, sleep=0.1, result='first')
+    SlowFailTask(script, sleep=0.05)
+    ResultTask(script, sleep=0.2, result='second')
+    results = []
+
+    async def collect_results() -> None:
+        async for result in script.as_completed_async_tasks():
+            results.append(result)
+
+    with pytest.raises(TaskError):
+        asyncio.run(collect_results())
+    assert results == ['first', 'second']
+
+
+class LoopTask(Task):
+    """
+    Test task recording the running event loop
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        return asyncio.get_running_loop()
+
+
+def test_script_tasks_event_loop_reused() -> None:
+    """
+    Test tasks of a script are run in the same event loop, closed when the script exits
+    """
+    script = Script()
+    LoopTask(script)
+    first_loop = script.run_async_tasks()[0]
+    second_loop = script.run_async_tasks()[0]
+    assert first_loop is second_loop
+    assert not first_loop.is_closed()
+
+    with pytest.raises(SystemExit):
+        script.exit(0)
+    assert first_loop.is_closed()
+    assert script.__event_loop__ is None
+
+
+def test_script_tasks_event_loop_closed_with_background_task() -> None:
+    """
+    Test background tasks left in the script event loop are cancelled on exit
+    """
+    script = Script()
+    loop = script.__get_event_loop__()
+    background_task = loop.create_task(asyncio.sleep(10))
+    script.run_coroutine(asyncio.sleep(0))
+    assert not background_task.done()
+    script.close_event_loop()
+    assert background_task.cancelled()
+    assert loop.is_closed()
+
+
+def test_script_tasks_run_coroutine_running_loop() -> None:
+    """
+    Test running coroutine in script event loop from a running event loop
+    """
+    script = Script()
+
+    async def run_nested() -> None:
+        script.run_coroutine(asyncio.sleep(0))
+
+    with pytest.raises(ScriptError):
+        asyncio.run(run_nested())
+
+
+def test_script_tasks_uvloop_not_installed(monkeypatch) -> None:
+    """
+    Test script event loop falls back to asyncio loop when uvloop is not installed
+    """
+    monkeypatch.setitem(sys.modules, 'uvloop', None)
+    monkeypatch.setattr(Script, 'use_uvloop', True)
+    script = Script()
+    loop = script.__get_event_loop__()
+    assert isinstance(loop, asyncio.AbstractEventLoop)
+    script.close_event_loop()
+
+
+def test_script_tasks_uvloop(monkeypatch) -> None:
+    """
+    Test script event loop is created with uvloop when enabled
+    """
+    module = type(sys)('uvloop')
+    created_loops = []
+
+    def new_event_loop() -> asyncio.AbstractEventLoop:
+        loop = asyncio.new_event_loop()
+        created_loops.append(loop)
+        return loop
+
+    module.new_event_loop = new_event_loop
+    monkeypatch.setitem(sys.modules, 'uvloop', module)
+    script = Script()
+    assert script.__get_event_loop__() is not None
+    assert created_loops == []
+    script.close_event_loop()
+
+    monkeypatch.setattr(Script, 'use_uvloop', True)
+    script = Script()
+    LoopTask(script)
+    assert script.run_async_tasks() == created_loops
+    script.close_event_loop()
+    assert created_loops[0].is_closed()
+
+
+def test_script_tasks_event_loop_closed_with_cleanup_task() -> None:
+    """
+    Test tasks started while cancelling tasks are finished before closing the event loop
+    """
+    script = Script()
+    loop = script.__get_event_loop__()
+    cleanup_tasks = []
+
+    async def run_forever() -> None:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cleanup_tasks.append(asyncio.ensure_future(asyncio.sleep(10)))
+            raise
+
+    loop.create_task(run_forever())
+    script.run_coroutine(asyncio.sleep(0))
+    script.close_event_loop()
+    assert len(cleanup_tasks) == 1
+    assert cleanup_tasks[0].done()
+    assert loop.is_closed()
+
+
+def test_script_tasks_command_line_task_cancelled_twice() -> None:
+    """
+    Test process of command line task cancelled again while terminating is reaped
+    """
+    script = Script()
+    task = CommandLineTask(script, ('sleep', '10'))
+
+    async def cancel_twice() -> None:
+        running = asyncio.ensure_future(task.run())
+        while task.process is None:
+            await asyncio.sleep(0.01)
+        process = task.process
+        running.cancel()
+        await asyncio.sleep(0)
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        return process
+
+    process = script.run_coroutine(cancel_twice())
+    assert process.returncode == -signal.SIGTERM
+    assert task.process is None
+    assert task.resource_usage is not None
+    script.close_event_loop()
+
+
+def test_script_tasks_event_loop_closed_while_terminating() -> None:
+    """
+    Test process being terminated by cancelled command line task is reaped when the event loop is closed
+    """
+    script = Script()
+    task = CommandLineTask(script, ('sh', '-c', 'trap "" TERM; sleep 10; true'))
+    task.terminate_timeout = 0.3
+
+    async def start_terminating() -> Any:
+        running = asyncio.ensure_future(task.run())
+        while task.process is None:
+            await asyncio.sleep(0.01)
+        # Let the shell set up its signal handling before cancelling the task
+        await asyncio.sleep(0.1)
+        running.cancel()
+        await asyncio.sleep(0.05)
+        return task.process
+
+    process = script.run_coroutine(start_terminating())
+    assert process.returncode is None
+    start = time.monotonic()
+    script.close_event_loop()
+    assert time.monotonic() - start < 5
+    assert process.returncode == -signal.SIGKILL
+    assert task.resource_usage is not None
@@ -7,13 +7,17 @@
 Unit tests for subcommands in cli_toolkit.command module
 """
 import argparse
+import asyncio
 import sys
 
+from typing import Any, Dict, Tuple
+
 import pytest
 
 from cli_toolkit.base import ScriptError, DEFAULT_SUBPARSER_HELP
 from cli_toolkit.script import Script
 from cli_toolkit.command import Command
+from cli_toolkit.task import Task
 
 
 class EmptyCommand(Command):
@@ -35,6 +39,41 @@ class ResultsCommand(Command):
         self.result = True
 
 
+class LoopTask(Task):
+    """
+    Task recording the event loop it was run in
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+        if kwargs.get('fail', False):
+            raise ValueError('Task failed')
+        self.parent.loops.append(asyncio.get_running_loop())
+
+
+class AsyncCommand(Command):
+    """
+    Command with coroutine run method
+    """
+    name = 'async'
+    run_tasks = False
+    fail = False
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.loops = []
+
+    # pylint: disable=invalid-overridden-method
+    async def run(self, args: argparse.Namespace) -> None:
+        await asyncio.sleep(0)
+        self.loops.append(asyncio.get_running_loop())
+        LoopTask(self, fail=self.fail)
+        if self.run_tasks:
+            await self.create_async_tasks()
+            LoopTask(self)
+
+
 class SubcommandsScript(Script):
     """
     Script with subcommands loaded from subcommands attribute
@@ -319,3 +358,71 @@ def test_command_with_invalid_args(monkeypatch) -> None:
             script.run()
             assert command.result is False
         assert exit_code.value.code == 2
+
+
+def run_async_command(monkeypatch, **attrs: Dict[str, Any]) -> Tuple[AsyncCommand, int]:
+    """
+    Run async command with script, returning the command and exit code
+    """
+    script = Script()
+    command = AsyncCommand(script)
+    for attr, value in attrs.items():
+        setattr(command, attr, value)
+    script.add_subcommand(command)
+    monkeypatch.setattr(sys, 'argv', ('test', 'async'))
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    return command, exit_status.value.code
+
+
+def test_command_async_run(monkeypatch) -> None:
+    """
+    Test command with coroutine run method and tasks run in the same event loop
+    """
+    command, exit_code = run_async_command(monkeypatch)
+    assert exit_code == 0
+    assert len(command.loops) == 2
+    assert command.loops[0] is command.loops[1]
+
+
+def test_command_async_run_tasks(monkeypatch) -> None:
+    """
+    Test tasks run by coroutine run method are not run again after the command
+    """
+    command, exit_code = run_async_command(monkeypatch, run_tasks=True)
+    assert exit_code == 0
+    assert len(command.loops) == 2
+
+
+def test_command_async_run_task_error(monkeypatch, capsys) -> None:
+    """
+    Test failing tasks of command with coroutine run method
+    """
+    _command, exit_code = run_async_command(monkeypatch, fail=True, task_failure_policy='keep-going')
+    assert exit_code == 1
+    assert '1 of 1 tasks failed' in capsys.readouterr().err
+
+
+def test_run_async_tasks_running_loop() -> None:
+    """
+    Test running async tasks synchronously from a running event loop
+    """
+    script = Script()
+
+    async def run_tasks() -> None:
+        script.run_async_tasks()
+
+    with pytest.raises(ScriptError):
+        asyncio.run(run_tasks())
+
+
+def test_script_name_reset(monkeypatch) -> None:
+    """
+    Test resetting script name updates program name of the script and subcommands
+    """
+    script = SubcommandsScript(usage='%(prog)s [options]')
+    monkeypatch.setattr(sys, 'argv', ['/usr/bin/renamed-script'])
+    script.__reset_run_state__()
+    assert script.name == 'renamed-script'
+    assert script.__parser__.prog == 'renamed-script'
+    assert script.__subcommands__['empty'].__parser__.prog == 'renamed-script [options] empty'
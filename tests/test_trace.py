@@ -0,0 +1,145 @@
+#
+# Copyright (C) 2020-2023 by Ilkka Tuohela <hile@iki.fi>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+#
+"""
+Unit tests for cli_toolkit.trace module
+"""
+import argparse
+import json
+import os
+import sys
+
+from typing import Any, Dict
+
+import pytest
+
+from cli_toolkit.command import Command
+from cli_toolkit.exceptions import ScriptError
+from cli_toolkit.script import Script
+from cli_toolkit.task import CommandLineTask, Task
+from cli_toolkit.trace import TraceRecorder
+
+
+class TraceTask(Task):
+    """
+    Test task for tracing
+    """
+    async def run(self, **kwargs: Dict[Any, Any]) -> None:
+        """
+        Run test task
+        """
+
+
+class TasksCommand(Command):
+    """
+    Test command running tasks
+    """
+    name = 'tasks'
+    max_concurrent_tasks = 1
+
+    def run(self, args: argparse.Namespace) -> None:
+        TraceTask(self)
+        CommandLineTask(self, ('true',))
+        with self.trace_span('custom span'):
+            self.run_subcommand(args)
+
+
+class TraceScript(Script):
+    """
+    Test script with subcommand running tasks
+    """
+    subcommands = (
+        TasksCommand,
+    )
+
+
+def test_trace_recorder_events(tmpdir) -> None:
+    """
+    Test recording trace events
+    """
+    recorder = TraceRecorder()
+    with recorder.span('closed', 'test', args={'value': 1}):
+        pass
+    span = recorder.span('open', 'test')
+    span.__enter__()  # pylint: disable=no-member
+    span_id = recorder.get_span_id()
+    recorder.begin_async('async', 'test', span_id)
+    recorder.end_async('async', 'test', span_id, {'status': 'ok'})
+    assert recorder.acquire_lane() == 1
+    assert recorder.acquire_lane() == 2
+    recorder.release_lane(1)
+    assert recorder.acquire_lane() == 1
+
+    trace_file = os.path.join(tmpdir.strpath, 'trace.json')
+    recorder.write(trace_file)
+    with open(trace_file, encoding='utf-8') as filedescriptor:
+        events = json.load(filedescriptor)['traceEvents']
+    names = [(event['name'], event['ph']) for event in events]
+    assert ('closed', 'X') in names
+    assert ('open', 'X') in names
+    assert ('async', 'b') in names
+    assert ('async', 'e') in names
+    assert len([event for event in events if event['name'] == 'thread_name']) == 3
+
+    with pytest.raises(ScriptError):
+        recorder.write(os.path.join(tmpdir.strpath, 'missing', 'trace.json'))
+
+
+def test_trace_recorder_disabled() -> None:
+    """
+    Test disabled trace recorder does not record events
+    """
+    recorder = TraceRecorder()
+    with recorder.span('discarded', 'test'):
+        pass
+    recorder.disable()
+    with recorder.span('ignored', 'test'):
+        pass
+    recorder.add_complete_event('ignored', 'test', recorder.timestamp())
+    assert recorder.events == []
+
+
+def test_trace_script_disabled(monkeypatch) -> None:
+    """
+    Test script without --trace does not enable tracing
+    """
+    script = TraceScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+    assert script.__get_trace_recorder__() is None
+    assert script.__trace_recorder__.events == []
+
+
+def test_trace_script_run(monkeypatch, tmpdir) -> None:
+    """
+    Test writing trace of script run with tasks
+    """
+    trace_file = os.path.join(tmpdir.strpath, 'trace.json')
+    script = TraceScript()
+    monkeypatch.setattr(sys, 'argv', ['test-cli', '--trace', trace_file, 'tasks'])
+    with pytest.raises(SystemExit) as exit_status:
+        script.run()
+    assert exit_status.value.code == 0
+
+    with open(trace_file, encoding='utf-8') as filedescriptor:
+        events = json.load(filedescriptor)['traceEvents']
+    names = {(event.get('cat'), event['name'], event['ph']) for event in events}
+    for expected in (
+            ('startup', 'init', 'X'),
+            ('startup', 'initialize', 'X'),
+            ('startup', 'parse_args', 'X'),
+            ('dispatch', 'test-cli tasks', 'X'),
+            ('dispatch', 'tasks tasks', 'X'),
+            ('script', 'custom span', 'X'),
+            ('task', 'TraceTask', 'b'),
+            ('task', 'TraceTask', 'e'),
+            ('task', 'queue wait', 'b'),
+            ('task', 'queue wait', 'e'),
+            ('attempt', 'true', 'X'),
+            ('process', 'true', 'b'),
+            ('process', 'true', 'e')):
+        assert expected in names